@@ -61,9 +61,10 @@ export class SnacksService {
   async getAllWithMetrics(): Promise<any[]> {
     const supabase = this.supabaseService.getClient();
 
-    // Get the most recent metrics for each snack
+    // One row per snack, kept up to date by the collector after each run
+    // (latest metrics, comparison point, changes and overall score)
     const { data, error } = await supabase
-      .from('daily_metrics')
+      .from('snack_summary')
       .select(`
         snack_id,
         google_trends_score,
@@ -72,7 +73,9 @@ export class SnacksService {
         news_article_count,
         avg_news_sentiment,
         stock_close_price,
-        date,
+        trends_change,
+        stock_change,
+        overall_score,
         snacks!inner (
           id,
           name,
@@ -83,69 +86,29 @@ export class SnacksService {
           )
         )
       `)
-      .order('date', { ascending: false });
+      .order('overall_score', { ascending: false });
 
     if (error) {
       console.error('Error fetching snacks with metrics:', error);
       throw new Error(`Failed to fetch snacks with metrics: ${error.message}`);
     }
 
-    if (!data || data.length === 0) {
-      return [];
-    }
-
-    // Group by snack_id and collect metrics for each snack (limited to 30 like getDetail)
-    const snackMetricsMap = new Map<number, any[]>();
-
-    data.forEach(metric => {
-      if (!snackMetricsMap.has(metric.snack_id)) {
-        snackMetricsMap.set(metric.snack_id, []);
-      }
-      const snackMetrics = snackMetricsMap.get(metric.snack_id)!;
-      // Only keep up to 30 metrics per snack (matching getDetail's limit)
-      if (snackMetrics.length < 30) {
-        snackMetrics.push(metric);
-      }
-    });
-
-    // Calculate trends_change by comparing with second-to-last metric (matching getDetail logic)
-    const results: any[] = [];
-    for (const [snackId, metrics] of snackMetricsMap) {
-      const latestMetric = metrics[0]; // Most recent (data is ordered by date desc)
-      // Compare against the second-to-last metric in the range (matching getDetail: metricsData[length - 2])
-      const previousMetric = metrics.length > 2 ? metrics[metrics.length - 2] : (metrics.length > 1 ? metrics[1] : undefined);
-
-      const trendsChange = this.calculateTrendsChange(
-        latestMetric.google_trends_score,
-        previousMetric?.google_trends_score
-      );
-
-      const stockChange = this.calculateStockChange(
-        latestMetric.stock_close_price,
-        previousMetric?.stock_close_price
-      );
-
-      const overallScore = this.calculateOverallScore(latestMetric);
-
-      results.push({
-        snack_id: snackId,
-        snack_name: latestMetric.snacks.name,
-        company_name: (latestMetric.snacks.companies as any).name,
-        stock_ticker: (latestMetric.snacks.companies as any).stock_ticker,
-        stock_exchange: (latestMetric.snacks.companies as any).stock_exchange,
-        current_trends_score: latestMetric.google_trends_score,
-        trends_change: trendsChange,
-        reddit_mentions: latestMetric.reddit_mention_count,
-        reddit_sentiment: latestMetric.avg_reddit_sentiment,
-        news_mentions: latestMetric.news_article_count,
-        news_sentiment: latestMetric.avg_news_sentiment,
-        stock_price: latestMetric.stock_close_price,
-        stock_change: stockChange,
-        overall_score: overallScore
-      });
-    }
-
-    return results.sort((a, b) => b.overall_score - a.overall_score);
+    return (data || []).map(summary => ({
+      snack_id: summary.snack_id,
+      snack_name: (summary.snacks as any).name,
+      company_name: (summary.snacks as any).companies.name,
+      stock_ticker: (summary.snacks as any).companies.stock_ticker,
+      stock_exchange: (summary.snacks as any).companies.stock_exchange,
+      current_trends_score: summary.google_trends_score,
+      trends_change: summary.trends_change,
+      reddit_mentions: summary.reddit_mention_count,
+      reddit_sentiment: summary.avg_reddit_sentiment,
+      news_mentions: summary.news_article_count,
+      news_sentiment: summary.avg_news_sentiment,
+      stock_price: summary.stock_close_price,
+      stock_change: summary.stock_change,
+      overall_score: summary.overall_score
+    }));
   }
 
   async getTrending(): Promise<any[]> {
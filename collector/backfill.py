@@ -0,0 +1,450 @@
+"""
+Backfills daily_metrics for past dates, e.g. after adding a snack or to fill the
+gaps an outage left behind:
+
+    python backfill.py --start 2025-01-01 --end 2025-03-31 --snack cool-ranch-doritos
+
+The range is split into date shards that are collected in parallel. Per shard,
+Google Trends is asked once per keyword batch for a multi-day timeframe, Finnhub
+once per ticker for daily candles, and NewsAPI once per snack for the shard's
+date window, paging through its newest articles. Reddit search cannot be
+bounded by date, so it runs once per snack for the whole range before the
+shards. Days older than the posts or articles a search reached are left empty. The results are split into one row per day and written with the
+regular daily_metrics upsert. Only the (snack, day, source) cells that are still
+empty are fetched, so rerunning a range just fills in what is missing.
+"""
+
+import argparse
+import datetime
+import logging
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+# The collector modules read their settings when imported, so .env is loaded first
+load_dotenv()
+
+from data_collector import (  # noqa: E402
+    ALL_SOURCES,
+    SOURCE_LIMITS,
+    SUBREDDITS_TO_SEARCH,
+    get_news_data,
+    get_pytrends,
+    get_reddit_data,
+    get_selected_sources,
+    get_stock_candles,
+    iso_date_to_unix,
+    published_day,
+    run_post_stages,
+    summarize_mentions,
+)
+from db_utils import BulkWriter, close_db_pool, create_db_pool  # noqa: E402
+from google_trends import TrendsBatcher, build_trends_keyword  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from response_cache import response_cache  # noqa: E402
+from sentiment import sentiment_scorer  # noqa: E402
+from snack_catalog import load_snack_catalog  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# Reddit search cannot be bounded by date, so each snack's search reads this many
+# of the newest matching posts and keeps the ones inside the backfilled range
+BACKFILL_REDDIT_LIMIT = 250
+# Pages of 100 articles read per snack and shard, newest first
+BACKFILL_NEWS_PAGES = 5
+# Days looked back for the last close when a shard starts on a non-trading day
+STOCK_LOOKBACK_DAYS = 7
+
+# The daily_metrics column that tells whether a source was already collected
+SOURCE_COLUMNS = {
+    "trends": "google_trends_score",
+    "reddit": "reddit_mention_count",
+    "news": "news_article_count",
+    "stocks": "stock_close_price",
+}
+
+# Count and average sentiment columns filled from each mention source
+MENTION_COLUMNS = {
+    "reddit": ("reddit_mention_count", "avg_reddit_sentiment"),
+    "news": ("news_article_count", "avg_news_sentiment"),
+}
+
+GET_EXISTING_METRICS_QUERY = f"""
+    SELECT snack_id, date::text, {", ".join(SOURCE_COLUMNS.values())}
+    FROM daily_metrics
+    WHERE snack_id = ANY(%s) AND date BETWEEN %s AND %s;
+"""
+
+
+def date_range(start, end):
+    return [
+        (start + datetime.timedelta(days=offset)).isoformat()
+        for offset in range((end - start).days + 1)
+    ]
+
+
+def find_missing_cells(conn, snack_config, days, sources):
+    """
+    Returns a map of (snack key, source) -> set of ISO dates that have no value
+    yet. A day with no daily_metrics row is missing every source; stocks only
+    count for snacks with a ticker.
+    """
+    snack_ids = [config["snack_id"] for config in snack_config.values()]
+    with conn.cursor() as cursor:
+        cursor.execute(GET_EXISTING_METRICS_QUERY, (snack_ids, days[0], days[-1]))
+        existing = {
+            (snack_id, day): dict(zip(SOURCE_COLUMNS, values))
+            for snack_id, day, *values in cursor.fetchall()
+        }
+
+    missing = defaultdict(set)
+    for snack_name, config in snack_config.items():
+        for source in sources:
+            if source == "stocks" and not config.get("stock_ticker"):
+                continue
+            for day in days:
+                row = existing.get((config["snack_id"], day))
+                if row is None or row[source] is None:
+                    missing[(snack_name, source)].add(day)
+    return missing
+
+
+def split_shards(days, shard_days):
+    return [days[i : i + shard_days] for i in range(0, len(days), shard_days)]
+
+
+def carry_forward(closes, days):
+    # weekends and holidays take the last close before them
+    prices = {}
+    last_close = None
+    for day in sorted(closes.keys() | set(days)):
+        last_close = closes.get(day, last_close)
+        if day in days:
+            prices[day] = last_close
+    return prices
+
+
+def fetch_reddit_history(snack_config, missing, limiter):
+    """
+    Runs one Reddit search per snack that misses Reddit days, over the range of
+    those days. Returns snack key -> ISO date -> mention summary, holding only
+    the days the search reached, with an empty summary for days without posts.
+    When the search stops at BACKFILL_REDDIT_LIMIT posts, the day of its oldest
+    post may be cut short and older days were not seen at all; those days are
+    left out so they stay NULL instead of being stored as zero mentions.
+    """
+    history = {}
+    for snack_name, config in snack_config.items():
+        days = sorted(missing.get((snack_name, "reddit"), ()))
+        if not days:
+            continue
+        by_day, reach = get_reddit_data(
+            search_query=config["reddit_query"],
+            search_limit=BACKFILL_REDDIT_LIMIT,
+            search_terms=config["search_terms"],
+            subreddits_to_search=SUBREDDITS_TO_SEARCH,
+            time_filter_unix=iso_date_to_unix(days[0]),
+            time_until_unix=iso_date_to_unix(days[-1]) + (24 * 60 * 60) - 1,
+            group_by=published_day,
+            limiter=limiter,
+            report_reach=True,
+        )
+        if by_day is None:
+            continue
+        reached_day = (
+            datetime.datetime.fromtimestamp(reach, tz=datetime.timezone.utc)
+            .date()
+            .isoformat()
+            if reach is not None
+            else ""
+        )
+        history[snack_name] = {
+            day: by_day.get(day) or summarize_mentions([])
+            for day in days
+            if day > reached_day
+        }
+        if len(history[snack_name]) < len(days):
+            logger.info(
+                f"Reddit search for {snack_name} only reached back to {reached_day}; "
+                f"{len(days) - len(history[snack_name])} older days stay empty."
+            )
+    return history
+
+
+def backfill_shard(
+    db_pool, snack_config, days, missing, sources, limiters, reddit_history
+):
+    """
+    Collects one date shard and writes its rows in a single transaction. Each
+    source is fetched only for the snacks that miss it on one of these days;
+    Reddit comes from reddit_history (see fetch_reddit_history). Returns the
+    number of rows written.
+    """
+    start_iso, end_iso = days[0], days[-1]
+    shard_days = set(days)
+    needs = {
+        source: {
+            snack_name: config
+            for snack_name, config in snack_config.items()
+            if missing.get((snack_name, source), set()) & shard_days
+        }
+        for source in sources
+    }
+    logger.info(
+        f"Backfilling {start_iso} to {end_iso}: "
+        + ", ".join(f"{len(needs[source])} snacks for {source}" for source in sources)
+    )
+
+    # source -> snack key -> ISO date -> value (a mention summary for reddit and
+    # news); a snack is left out when its fetch failed. Days outside the shard,
+    # e.g. late comments, are never read.
+    values = defaultdict(dict)
+
+    if needs.get("trends"):
+        keywords = {
+            snack_name: build_trends_keyword(config["search_terms"])
+            for snack_name, config in needs["trends"].items()
+            if config.get("search_terms")
+        }
+        batcher = TrendsBatcher(
+            get_pytrends(),
+            timeframe=f"{start_iso} {end_iso}",
+            limiter=limiters["trends"],
+            cache=response_cache,
+        )
+        daily_scores = batcher.get_daily_scores(list(keywords.values()))
+        for snack_name, keyword in keywords.items():
+            if keyword in daily_scores:
+                values["trends"][snack_name] = daily_scores[keyword]
+
+    if needs.get("stocks"):
+        lookback_iso = (
+            datetime.date.fromisoformat(start_iso)
+            - datetime.timedelta(days=STOCK_LOOKBACK_DAYS)
+        ).isoformat()
+        prices = {}
+        for stock_ticker in dict.fromkeys(
+            config["stock_ticker"] for config in needs["stocks"].values()
+        ):
+            closes = get_stock_candles(
+                stock_ticker, lookback_iso, end_iso, limiter=limiters["stocks"]
+            )
+            if closes is not None:
+                prices[stock_ticker] = carry_forward(closes, shard_days)
+        for snack_name, config in needs["stocks"].items():
+            if config["stock_ticker"] in prices:
+                values["stocks"][snack_name] = prices[config["stock_ticker"]]
+
+    for snack_name, config in needs.get("news", {}).items():
+        by_day, reach = get_news_data(
+            search_query=config["news_query"],
+            time_filter_iso=start_iso,
+            time_until_iso=f"{end_iso}T23:59:59",
+            group_by=published_day,
+            limiter=limiters["news"],
+            max_pages=BACKFILL_NEWS_PAGES,
+            report_reach=True,
+        )
+        if by_day is None:
+            continue
+        # past BACKFILL_NEWS_PAGES pages the day of the oldest article read may be
+        # cut short and older days were not read; they stay NULL, not zero articles
+        reached_day = reach[:10] if reach is not None else ""
+        news_days = sorted(missing[(snack_name, "news")] & shard_days)
+        values["news"][snack_name] = {
+            day: by_day.get(day) or summarize_mentions([])
+            for day in news_days
+            if day > reached_day
+        }
+        if len(values["news"][snack_name]) < len(news_days):
+            logger.info(
+                f"NewsAPI search for {snack_name} only reached back to {reached_day}; "
+                f"{len(news_days) - len(values['news'][snack_name])} older days stay empty."
+            )
+
+    for snack_name in needs.get("reddit", {}):
+        if snack_name in reddit_history:
+            values["reddit"][snack_name] = reddit_history[snack_name]
+
+    writer = BulkWriter(db_pool)
+    rows = 0
+    try:
+        for snack_name, config in snack_config.items():
+            for day in days:
+                # only cells that are missing and were fetched; NULL keeps what is stored
+                fetched = {
+                    source: values[source][snack_name]
+                    for source in sources
+                    if day in missing.get((snack_name, source), ())
+                    and snack_name in values[source]
+                    # Reddit and news days the search did not reach stay NULL
+                    and (
+                        source not in MENTION_COLUMNS
+                        or day in values[source][snack_name]
+                    )
+                }
+                if not fetched:
+                    continue
+
+                metrics = {"snack_id": config["snack_id"], "date": day}
+                if "trends" in fetched:
+                    metrics["google_trends_score"] = fetched["trends"].get(day)
+                if "stocks" in fetched:
+                    metrics["stock_close_price"] = fetched["stocks"].get(day)
+                mentions_to_save = []
+                for source, (count_column, sentiment_column) in MENTION_COLUMNS.items():
+                    if source in fetched:
+                        summary = fetched[source].get(day) or summarize_mentions([])
+                        metrics[count_column] = summary["count"]
+                        metrics[sentiment_column] = summary["avg_sentiment"]
+                        mentions_to_save += summary["mentions"]
+
+                if mentions_to_save:
+                    writer.add_mentions(config["snack_id"], mentions_to_save)
+                writer.add_metrics(metrics)
+                rows += 1
+
+        writer.flush()
+        writer.commit()
+    finally:
+        writer.close()
+
+    logger.info(f"Backfilled {rows} rows for {start_iso} to {end_iso}.")
+    return rows
+
+
+def run_backfill(db_pool, snack_config, start, end, shard_days=30, workers=4):
+    """
+    Backfills every missing (snack, day, source) cell between start and end
+    (dates, inclusive). Shards run in parallel, sharing one rate limiter per
+    source. Returns True if every shard was written.
+    """
+    days = date_range(start, end)
+    sources = get_selected_sources()
+    missing = db_pool.run(find_missing_cells, snack_config, days, sources)
+    if not missing:
+        logger.info(f"Nothing to backfill between {days[0]} and {days[-1]}.")
+        return True
+
+    missing_days = set().union(*missing.values())
+    shards = [
+        shard
+        for shard in split_shards(days, shard_days)
+        if missing_days.intersection(shard)
+    ]
+    logger.info(
+        f"Backfilling {sum(len(cells) for cells in missing.values())} missing cells "
+        f"for {len(snack_config)} snacks in {len(shards)} shards."
+    )
+
+    limiters = {
+        source: RateLimiter(source, **SOURCE_LIMITS[source]) for source in ALL_SOURCES
+    }
+    reddit_history = {}
+    if "reddit" in sources:
+        reddit_history = fetch_reddit_history(snack_config, missing, limiters["reddit"])
+    succeeded = True
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="backfill"
+    ) as executor:
+        futures = {
+            executor.submit(
+                backfill_shard,
+                db_pool,
+                snack_config,
+                shard,
+                missing,
+                sources,
+                limiters,
+                reddit_history,
+            ): shard
+            for shard in shards
+        }
+        for future, shard in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                # the other shards are already committed; a rerun retries this one
+                logger.error(f"Backfill of {shard[0]} to {shard[-1]} failed: {e}")
+                succeeded = False
+
+    # once every shard is done, so no shard's rollup misses another's rows
+    written = {}
+    for (snack_name, _), cells in missing.items():
+        snack_id = snack_config[snack_name]["snack_id"]
+        earliest = min(cells)
+        if snack_id not in written or earliest < written[snack_id]:
+            written[snack_id] = earliest
+    run_post_stages(db_pool, written)
+    return succeeded
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--start", type=datetime.date.fromisoformat, required=True, help="YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.date.fromisoformat,
+        help="YYYY-MM-DD, inclusive (default: yesterday)",
+    )
+    parser.add_argument(
+        "--snack",
+        action="append",
+        help="snack key or name to backfill; repeat for several (default: all)",
+    )
+    parser.add_argument(
+        "--shard-days",
+        type=int,
+        default=30,
+        help="days per shard; Trends returns daily rows for up to 270 days",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="shards collected at once"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args(argv)
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    end = min(args.end or yesterday, yesterday)
+    if args.start > end:
+        logger.error(f"Nothing to do: {args.start} is after {end}.")
+        return 1
+
+    db_pool = create_db_pool()
+    if not db_pool:
+        return 1
+    try:
+        snack_config = db_pool.run(load_snack_catalog)
+        if args.snack:
+            wanted = {name.lower().replace(" ", "-") for name in args.snack}
+            unknown = wanted.difference(snack_config)
+            if unknown:
+                logger.error(f"Unknown snacks: {', '.join(sorted(unknown))}")
+                return 1
+            snack_config = {
+                snack_name: config
+                for snack_name, config in snack_config.items()
+                if snack_name in wanted
+            }
+
+        succeeded = run_backfill(
+            db_pool, snack_config, args.start, end, args.shard_days, args.workers
+        )
+        return 0 if succeeded else 1
+    finally:
+        sentiment_scorer.close()
+        response_cache.close()
+        close_db_pool(db_pool)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
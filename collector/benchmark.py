@@ -0,0 +1,368 @@
+"""
+Offline throughput benchmark for the collection pipeline.
+
+Runs run_collection_pipeline against the stand-in clients in fake_clients.py and
+a scratch schema in a local Postgres, once per snack count, each in its own
+process so peak RSS and module state are not shared between sizes:
+
+    BENCHMARK_DB_CONNECTION_STRING=postgresql://localhost/postgres \\
+        python benchmark.py --snacks 10 100 1000 --latency 0.02
+
+Reports wall time, API calls (and injected 429s) per source, database
+statements and commits, peak RSS and time spent in sentiment scoring and term
+matching.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+BENCHMARK_SCHEMA = "collector_benchmark"
+
+BENCHMARK_TABLES_QUERY = f"""
+    DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE;
+    CREATE SCHEMA {BENCHMARK_SCHEMA};
+    SET search_path TO {BENCHMARK_SCHEMA};
+    CREATE TABLE companies (
+        id serial PRIMARY KEY, name text, stock_ticker text, stock_exchange text
+    );
+    CREATE TABLE snacks (
+        id serial PRIMARY KEY, name text, company_id integer REFERENCES companies (id)
+    );
+    CREATE TABLE snack_aliases (
+        id serial PRIMARY KEY, snack_id integer REFERENCES snacks (id), alias_name text
+    );
+    CREATE TABLE daily_metrics (
+        id serial PRIMARY KEY,
+        snack_id integer REFERENCES snacks (id),
+        date date,
+        google_trends_score integer,
+        reddit_mention_count integer,
+        avg_reddit_sentiment double precision,
+        news_article_count integer,
+        avg_news_sentiment double precision,
+        stock_close_price double precision,
+        UNIQUE (snack_id, date)
+    );
+    CREATE TABLE snack_mentions (
+        id serial PRIMARY KEY,
+        snack_id integer REFERENCES snacks (id),
+        source text,
+        source_name text,
+        content text,
+        url text UNIQUE,
+        sentiment_score double precision,
+        published_at timestamptz
+    );
+"""
+
+ADJECTIVES = "Zesty Crunchy Smoky Tangy Fiery Cheesy Salty Sweet Sour Spicy Golden Frosted".split()
+NOUNS = (
+    "Puffs Crisps Bites Twists Chips Wafers Rings Clusters Bars Pops Cola Fizz".split()
+)
+
+SOURCES = ("trends", "reddit", "news", "stocks")
+
+
+def build_snack_names(count, seed):
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        names.append(f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i + 1}")
+    return names
+
+
+def seed_database(dsn, count, seed):
+    """Creates the benchmark schema with count snacks; every other snack gets an alias."""
+    names = build_snack_names(count, seed)
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute(BENCHMARK_TABLES_QUERY)
+        companies = max(1, count // 4)
+        for i in range(companies):
+            cursor.execute(
+                "INSERT INTO companies (name, stock_ticker) VALUES (%s, %s)",
+                (f"Company {i + 1}", f"BX{i + 1}"),
+            )
+        for i, name in enumerate(names):
+            cursor.execute(
+                "INSERT INTO snacks (name, company_id) VALUES (%s, %s) RETURNING id",
+                (name, i % companies + 1),
+            )
+            (snack_id,) = cursor.fetchone()
+            if i % 2:
+                cursor.execute(
+                    "INSERT INTO snack_aliases (snack_id, alias_name) VALUES (%s, %s)",
+                    (snack_id, f"{name.split()[1]} {i + 1}"),
+                )
+    conn.close()
+    return names
+
+
+class Timers:
+    """Accumulates time spent inside wrapped methods, across threads."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, owner, attribute, label):
+        original = getattr(owner, attribute)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.seconds[label] = self.seconds.get(label, 0.0) + elapsed
+                    self.calls[label] = self.calls.get(label, 0) + 1
+
+        setattr(owner, attribute, timed)
+
+
+def make_counting_connection(base, counts, lock):
+    """A connection class that counts statements sent and commits."""
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, params=None):
+            with lock:
+                counts["statements"] += 1
+            return super().execute(query, params)
+
+    class CountingConnection(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cursor_factory = CountingCursor
+
+        def commit(self):
+            with lock:
+                counts["commits"] += 1
+            return super().commit()
+
+    return CountingConnection
+
+
+def run_once(args, count):
+    """Runs the pipeline once over count synthetic snacks and returns the report."""
+    # Settings are read when the collector modules are imported
+    os.environ["RESPONSE_CACHE_MODE"] = "off"
+    os.environ.pop("SENTIMENT_CACHE_PATH", None)
+    # the scratch schema shares the database name, so a saved copy of its URLs
+    # would pass for the real mentions' on the next collector run
+    os.environ["KNOWN_URLS_CACHE_PATH"] = ""
+    os.environ.pop("COLLECTOR_RUN_DATE", None)
+    os.environ["COLLECTOR_PROMETHEUS_PATH"] = ""
+    os.environ["COLLECTOR_REPORT_PATH"] = ""
+
+    import data_collector
+    import db_utils
+    import matcher
+    import sentiment
+    import snack_catalog
+    from fake_clients import (
+        FakeFinnhub,
+        FakeNewsApi,
+        FakeReddit,
+        FakeTrendReq,
+        SourceStats,
+    )
+
+    dsn = psycopg2.extensions.make_dsn(
+        args.dsn, options=f"-c search_path={BENCHMARK_SCHEMA}"
+    )
+    names = seed_database(dsn, count, args.seed)
+    terms = names + [f"{name.split()[1]} {i + 1}" for i, name in enumerate(names)]
+
+    stats = SourceStats()
+    client_options = dict(
+        latency=args.latency, rate_limit_ratio=args.rate_limit_ratio, seed=args.seed
+    )
+    data_collector.pytrends = FakeTrendReq(stats, **client_options)
+    data_collector.reddit = FakeReddit(
+        stats,
+        terms,
+        comments_per_post=args.comments_per_post,
+        listing_size=args.listing_size,
+        **client_options,
+    )
+    data_collector.newsapi = FakeNewsApi(
+        stats, articles_per_query=args.articles_per_query, **client_options
+    )
+    data_collector.finnhub_client = FakeFinnhub(stats, **client_options)
+    if not args.throttled:
+        for limits in data_collector.SOURCE_LIMITS.values():
+            limits["requests_per_second"] = None
+
+    timers = Timers()
+    timers.wrap(sentiment.SentimentScorer, "score_batch", "sentiment")
+    timers.wrap(matcher.TermMatcher, "find", "matching")
+    timers.wrap(matcher.TermMatcher, "search", "matching")
+
+    db_counts = {"statements": 0, "commits": 0}
+    pool = db_utils.ConnectionPool(
+        dsn,
+        connection_factory=make_counting_connection(
+            db_utils.PreparingConnection, db_counts, threading.Lock()
+        ),
+    )
+    # compiled like a real run, but never cached over the real catalog's file
+    snack_config = pool.run(snack_catalog.load_snack_catalog, "")
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        data_collector.run_collection_pipeline(
+            snack_config, pool, concurrent=args.concurrent
+        )
+    wall_seconds = time.perf_counter() - started
+
+    with pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM snack_mentions")
+        (mention_rows,) = cursor.fetchone()
+        cursor.execute("SELECT count(*) FROM daily_metrics")
+        (metric_rows,) = cursor.fetchone()
+    pool.close()
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    return {
+        "snacks": count,
+        "concurrent": args.concurrent,
+        "wall_seconds": round(wall_seconds, 3),
+        "api_calls": {source: stats.calls[source] for source in SOURCES},
+        "rate_limited": {source: stats.rate_limited[source] for source in SOURCES},
+        "db_statements": db_counts["statements"],
+        "db_commits": db_counts["commits"],
+        "peak_rss_mb": round(peak_rss / 2**20, 1),
+        "sentiment_seconds": round(timers.seconds.get("sentiment", 0.0), 3),
+        "matching_seconds": round(timers.seconds.get("matching", 0.0), 3),
+        "matching_calls": timers.calls.get("matching", 0),
+        "mention_rows": mention_rows,
+        "metric_rows": metric_rows,
+    }
+
+
+def print_table(reports):
+    header = (
+        f"{'snacks':>7} {'wall s':>8} {'trends':>7} {'reddit':>7} {'news':>6} "
+        f"{'stocks':>7} {'429s':>5} {'db stmts':>9} {'commits':>8} {'rss MB':>7} "
+        f"{'sent. s':>8} {'match s':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        calls = report["api_calls"]
+        print(
+            f"{report['snacks']:>7} {report['wall_seconds']:>8.2f} {calls['trends']:>7} "
+            f"{calls['reddit']:>7} {calls['news']:>6} {calls['stocks']:>7} "
+            f"{sum(report['rate_limited'].values()):>5} {report['db_statements']:>9} "
+            f"{report['db_commits']:>8} {report['peak_rss_mb']:>7.1f} "
+            f"{report['sentiment_seconds']:>8.2f} {report['matching_seconds']:>8.2f}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the collector offline with stand-in API clients."
+    )
+    parser.add_argument(
+        "--snacks", type=int, nargs="+", default=[10, 100, 1000], help="snack counts"
+    )
+    parser.add_argument(
+        "--dsn",
+        default=os.getenv("BENCHMARK_DB_CONNECTION_STRING"),
+        help=f"Postgres to benchmark against; everything is written to the {BENCHMARK_SCHEMA} schema",
+    )
+    parser.add_argument(
+        "--concurrent", action="store_true", help="run the pipeline in concurrent mode"
+    )
+    parser.add_argument(
+        "--throttled",
+        action="store_true",
+        help="keep the per-source request rates (off by default, so only the simulated latency limits throughput)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every API call"
+    )
+    parser.add_argument(
+        "--rate-limit-ratio",
+        type=float,
+        default=0.0,
+        help="share of API calls answered with a 429 (retried with the real RATE_LIMIT_BACKOFF)",
+    )
+    parser.add_argument("--comments-per-post", type=int, default=50)
+    parser.add_argument("--articles-per-query", type=int, default=40)
+    parser.add_argument(
+        "--listing-size",
+        type=int,
+        default=1000,
+        help="new posts and comments per subreddit in shared Reddit mode",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.dsn:
+        sys.exit("Set BENCHMARK_DB_CONNECTION_STRING or pass --dsn.")
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_once(args, args.snacks[0])))
+        return
+
+    reports = []
+    for count in args.snacks:
+        command = [sys.executable, os.path.abspath(__file__), "--worker"]
+        command += ["--snacks", str(count), "--dsn", args.dsn]
+        for option in (
+            "latency",
+            "rate_limit_ratio",
+            "comments_per_post",
+            "articles_per_query",
+            "listing_size",
+            "seed",
+        ):
+            command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+        if args.concurrent:
+            command.append("--concurrent")
+        if args.throttled:
+            command.append("--throttled")
+
+        result = subprocess.run(
+            command,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        )
+        reports.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    print_table(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
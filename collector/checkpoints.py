@@ -0,0 +1,197 @@
+import datetime
+import logging
+import os
+
+from db_utils import CREATE_RUN_TABLES_QUERY
+
+logger = logging.getLogger(__name__)
+
+COLLECTOR_CHECKPOINTS = os.getenv("COLLECTOR_CHECKPOINTS", "true").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+# An unfinished run started within this many hours is resumed instead of restarted
+COLLECTOR_RESUME_WINDOW_HOURS = float(os.getenv("COLLECTOR_RESUME_WINDOW_HOURS", "18"))
+# Forces the run date (YYYY-MM-DD) to resume or redo, e.g. after a failed nightly run
+COLLECTOR_RUN_DATE = os.getenv("COLLECTOR_RUN_DATE")
+
+# Shared Reddit ingest and combined news queries keep one watermark for all snacks
+SHARED_SNACK_ID = 0
+
+FIND_RESUMABLE_RUN_QUERY = """
+    SELECT run_date::text, window_start_unix
+    FROM collector_runs
+    WHERE completed_at IS NULL
+      AND started_at > now() - %s * interval '1 hour'
+    ORDER BY started_at DESC
+    LIMIT 1;
+"""
+
+FIND_RUN_BY_DATE_QUERY = """
+    SELECT run_date::text, window_start_unix
+    FROM collector_runs
+    WHERE run_date = %s AND completed_at IS NULL;
+"""
+
+START_RUN_QUERY = """
+    INSERT INTO collector_runs (run_date, window_start_unix)
+    VALUES (%s, %s)
+    ON CONFLICT (run_date) DO UPDATE SET
+        window_start_unix = EXCLUDED.window_start_unix,
+        started_at = now(),
+        completed_at = NULL;
+"""
+
+CLEAR_CHECKPOINTS_QUERY = "DELETE FROM collector_checkpoints WHERE run_date = %s;"
+
+GET_CHECKPOINTS_QUERY = """
+    SELECT snack_id, source, result
+    FROM collector_checkpoints
+    WHERE run_date = %s;
+"""
+
+# Watermarks from the same run date are ignored, so rerunning a day recounts it
+GET_WATERMARKS_QUERY = """
+    SELECT source, snack_id, watermark
+    FROM collector_watermarks
+    WHERE run_date < %s;
+"""
+
+FINISH_RUN_QUERY = "UPDATE collector_runs SET completed_at = now() WHERE run_date = %s;"
+
+
+def load_run(conn, window):
+    """
+    Resumes the latest unfinished run, or starts a new one with window
+    (start unix time, run date). Returns (window, checkpoints, watermarks,
+    resumed).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_RUN_TABLES_QUERY)
+        if COLLECTOR_RUN_DATE:
+            cursor.execute(FIND_RUN_BY_DATE_QUERY, (COLLECTOR_RUN_DATE,))
+        else:
+            cursor.execute(FIND_RESUMABLE_RUN_QUERY, (COLLECTOR_RESUME_WINDOW_HOURS,))
+        row = cursor.fetchone()
+
+        if row is not None:
+            run_date, window_start_unix = row
+            window = (window_start_unix, run_date)
+            cursor.execute(GET_CHECKPOINTS_QUERY, (run_date,))
+            checkpoints = {
+                (snack_id, source): result
+                for snack_id, source, result in cursor.fetchall()
+            }
+        else:
+            if COLLECTOR_RUN_DATE:
+                window = (window[0], COLLECTOR_RUN_DATE)
+            window_start_unix, run_date = window
+            cursor.execute(CLEAR_CHECKPOINTS_QUERY, (run_date,))
+            cursor.execute(START_RUN_QUERY, (run_date, window_start_unix))
+            checkpoints = {}
+
+        cursor.execute(GET_WATERMARKS_QUERY, (run_date,))
+        watermarks = {
+            (source, snack_id): watermark
+            for source, snack_id, watermark in cursor.fetchall()
+        }
+    conn.commit()
+    return window, checkpoints, watermarks, row is not None
+
+
+def finish_run(conn, run_date):
+    with conn.cursor() as cursor:
+        cursor.execute(FINISH_RUN_QUERY, (run_date,))
+    conn.commit()
+
+
+def parse_timestamp(value):
+    # NewsAPI uses a trailing Z, which fromisoformat only accepts from Python 3.11
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+class RunState:
+    """
+    Tracks which (snack, source) fetches of the current run date have finished,
+    so a restarted run skips them and keeps the pinned time window, and which
+    items each source has already seen (its watermark), so the next run only
+    asks for newer ones.
+    """
+
+    def __init__(self, pool, enabled=COLLECTOR_CHECKPOINTS):
+        self.pool = pool
+        self.enabled = enabled
+        self.window_start_unix = None
+        self.run_date = None
+        self.checkpoints = {}
+        self.watermarks = {}
+        # advanced watermarks are only stored once the whole run has finished
+        self.pending_watermarks = {}
+
+    def start(self, window):
+        if not self.enabled:
+            self.window_start_unix, self.run_date = window
+            return self
+
+        window, self.checkpoints, self.watermarks, resumed = self.pool.run(
+            load_run, window
+        )
+        self.window_start_unix, self.run_date = window
+        if resumed:
+            logger.info(
+                f"Resuming the run for {self.run_date} with {len(self.checkpoints)} completed fetches."
+            )
+        return self
+
+    def is_done(self, snack_id, source):
+        return (snack_id, source) in self.checkpoints
+
+    def result(self, snack_id, source):
+        return self.checkpoints.get((snack_id, source))
+
+    def record(self, writer, snack_id, source, result):
+        if self.enabled:
+            self.checkpoints[(snack_id, source)] = result
+            writer.add_checkpoint(self.run_date, snack_id, source, result)
+
+    def watermark(self, source, snack_id):
+        return self.watermarks.get((source, snack_id))
+
+    def since_unix(self, source, snack_id):
+        """The window start, moved up to the source's watermark when that is later."""
+        watermark = self.watermark(source, snack_id)
+        if watermark is None:
+            return self.window_start_unix
+        return max(self.window_start_unix, int(watermark.timestamp()))
+
+    def since_iso(self, source, snack_id):
+        # Same as since_unix for NewsAPI's from parameter, which takes the run date
+        # when there is no later watermark
+        watermark = self.watermark(source, snack_id)
+        if watermark is None or watermark.timestamp() <= self.window_start_unix:
+            return self.run_date
+        return watermark.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def advance(self, source, snack_id, latest):
+        # latest is the newest published_at (ISO string) seen for the source
+        if not self.enabled or not latest:
+            return
+        latest = parse_timestamp(latest)
+        current = self.pending_watermarks.get((source, snack_id))
+        if current is None or latest > current:
+            self.pending_watermarks[(source, snack_id)] = latest
+
+    def finish(self, writer):
+        if not self.enabled:
+            return
+        for (source, snack_id), watermark in self.pending_watermarks.items():
+            writer.add_watermark(source, snack_id, watermark, self.run_date)
+        writer.flush()
+        writer.commit()
+        self.pool.run(finish_run, self.run_date)
+        logger.info(f"Run for {self.run_date} is complete.")
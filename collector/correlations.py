@@ -0,0 +1,301 @@
+"""
+Correlates each snack's popularity signals with its company's stock price and
+stores the results in snack_correlations, one row per (snack, signal, lag,
+window). Two windows are kept:
+
+- the last CORRELATION_WINDOW_DAYS days before the snack's latest row, and
+- all history (window_days = 0), kept as running sums so a run only folds in
+  the days it added instead of reading the full history again.
+
+A lag of L pairs a signal on day d - L with the price on day d, i.e. how well
+popularity leads the price by L days. daily_metrics is loaded as one dense
+date x snack matrix per signal and every snack, signal and lag is computed at
+once with NumPy.
+"""
+
+import datetime
+import logging
+import os
+
+from psycopg2.extras import execute_values
+
+from db_utils import CREATE_CORRELATIONS_QUERY
+from instrumentation import run_metrics
+
+logger = logging.getLogger(__name__)
+
+# Days in the rolling window, ending at each snack's latest row
+CORRELATION_WINDOW_DAYS = int(os.getenv("CORRELATION_WINDOW_DAYS", "30"))
+# Days the signal is shifted back against the price
+CORRELATION_LAGS = tuple(
+    int(lag) for lag in os.getenv("CORRELATION_LAGS", "0,1,3,7").split(",") if lag
+)
+# Fewer paired days than this leave the correlation NULL
+CORRELATION_MIN_PERIODS = int(os.getenv("CORRELATION_MIN_PERIODS", "10"))
+
+SIGNALS = (
+    "google_trends_score",
+    "reddit_mention_count",
+    "avg_reddit_sentiment",
+    "news_article_count",
+    "avg_news_sentiment",
+)
+PRICE = "stock_close_price"
+# window_days of the all-history rows
+ALL_HISTORY = 0
+
+GET_LATEST_DATES_QUERY = """
+    SELECT t.snack_id, latest.date
+    FROM unnest(%s::integer[]) AS t (snack_id)
+    CROSS JOIN LATERAL (
+        SELECT date
+        FROM daily_metrics d
+        WHERE d.snack_id = t.snack_id
+        ORDER BY d.date DESC
+        LIMIT 1
+    ) latest;
+"""
+
+GET_METRIC_SNACKS_QUERY = "SELECT DISTINCT snack_id FROM daily_metrics;"
+
+GET_RUNNING_SUMS_QUERY = """
+    SELECT snack_id, signal, lag_days, as_of, observations,
+           sum_x, sum_y, sum_xx, sum_yy, sum_xy
+    FROM snack_correlations
+    WHERE window_days = 0 AND snack_id = ANY(%s);
+"""
+
+GET_METRICS_SINCE_QUERY = f"""
+    SELECT d.snack_id, d.date, {", ".join(SIGNALS)}, {PRICE}
+    FROM daily_metrics d
+    JOIN unnest(%s::integer[], %s::date[]) AS t (snack_id, since)
+        ON d.snack_id = t.snack_id
+    WHERE d.date >= t.since;
+"""
+
+UPSERT_CORRELATIONS_QUERY = """
+    INSERT INTO snack_correlations (
+        snack_id, signal, lag_days, window_days, as_of, observations, correlation,
+        sum_x, sum_y, sum_xx, sum_yy, sum_xy
+    )
+    VALUES %s
+    ON CONFLICT (snack_id, signal, lag_days, window_days) DO UPDATE SET
+        as_of = EXCLUDED.as_of,
+        observations = EXCLUDED.observations,
+        correlation = EXCLUDED.correlation,
+        sum_x = EXCLUDED.sum_x,
+        sum_y = EXCLUDED.sum_y,
+        sum_xx = EXCLUDED.sum_xx,
+        sum_yy = EXCLUDED.sum_yy,
+        sum_xy = EXCLUDED.sum_xy,
+        updated_at = now();
+"""
+
+SUM_NAMES = ("n", "sum_x", "sum_y", "sum_xx", "sum_yy", "sum_xy")
+
+
+def load_matrices(rows, snack_ids, start, end):
+    """
+    Turns (snack_id, date, *signals, price) rows into a (signal, day, snack)
+    array and a (day, snack) price array over every calendar day from start to
+    end. Missing days and NULLs are NaN.
+    """
+    import numpy as np
+
+    days = (end - start).days + 1
+    column = {snack_id: index for index, snack_id in enumerate(snack_ids)}
+    signals = np.full((len(SIGNALS), days, len(snack_ids)), np.nan)
+    prices = np.full((days, len(snack_ids)), np.nan)
+    if rows:
+        day_index = np.array([(row[1] - start).days for row in rows])
+        snack_index = np.array([column[row[0]] for row in rows])
+        values = np.array([row[2:] for row in rows], dtype=float)
+        signals[:, day_index, snack_index] = values[:, : len(SIGNALS)].T
+        prices[day_index, snack_index] = values[:, len(SIGNALS)]
+    return signals, prices
+
+
+def lagged_sums(signals, prices, include, lag):
+    """
+    Sums over the days d with include[d] where both the signal on d - lag and
+    the price on d are known, per signal and snack: n, x, y, xx, yy and xy.
+    """
+    import numpy as np
+
+    if lag:
+        x = signals[:, :-lag, :]
+        y = prices[lag:, :]
+        include = include[lag:, :]
+    else:
+        x, y = signals, prices
+    paired = np.isfinite(x) & np.isfinite(y) & include
+    x = np.where(paired, x, 0.0)
+    y = np.where(paired, y, 0.0)
+    return {
+        "n": paired.sum(axis=1).astype(float),
+        "sum_x": x.sum(axis=1),
+        "sum_y": y.sum(axis=1),
+        "sum_xx": (x * x).sum(axis=1),
+        "sum_yy": (y * y).sum(axis=1),
+        "sum_xy": (x * y).sum(axis=1),
+    }
+
+
+def pearson(sums, min_periods=CORRELATION_MIN_PERIODS):
+    import numpy as np
+
+    # NaN where there are too few pairs or either side never moved
+    n = sums["n"]
+    covariance = n * sums["sum_xy"] - sums["sum_x"] * sums["sum_y"]
+    variance_x = n * sums["sum_xx"] - sums["sum_x"] ** 2
+    variance_y = n * sums["sum_yy"] - sums["sum_y"] ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = covariance / np.sqrt(variance_x * variance_y)
+    valid = (n >= min_periods) & (variance_x > 0) & (variance_y > 0)
+    return np.where(valid, np.clip(correlation, -1.0, 1.0), np.nan)
+
+
+def to_value(value):
+    import numpy as np
+
+    return None if np.isnan(value) else float(value)
+
+
+def refresh_correlations(
+    conn,
+    written=None,
+    window=CORRELATION_WINDOW_DAYS,
+    lags=CORRELATION_LAGS,
+    min_periods=CORRELATION_MIN_PERIODS,
+):
+    """
+    Updates snack_correlations for the snacks in written (snack_id -> earliest
+    daily_metrics date written for it), or for every snack when written is None.
+    Snacks whose stored all-history sums end before the earliest written date
+    only read the days since; the others (no sums yet, a new lag, or an older
+    day rewritten, e.g. by a backfill) are recomputed from their full history.
+    Returns the number of rows written.
+    """
+    import numpy as np
+
+    with run_metrics.timer("correlations"), conn.cursor() as cursor:
+        cursor.execute(CREATE_CORRELATIONS_QUERY)
+        if written is None:
+            cursor.execute(GET_METRIC_SNACKS_QUERY)
+            written = {snack_id: None for (snack_id,) in cursor.fetchall()}
+        if not written or not lags:
+            conn.commit()
+            return 0
+
+        cursor.execute(GET_LATEST_DATES_QUERY, (list(written),))
+        latest = dict(cursor.fetchall())
+        snack_ids = sorted(latest)
+        cursor.execute(GET_RUNNING_SUMS_QUERY, (snack_ids,))
+        stored = {}
+        for snack_id, signal, lag, as_of, *sums in cursor.fetchall():
+            stored.setdefault(snack_id, {})[(signal, lag)] = (as_of, sums)
+
+        # the day after which each snack's all-history sums still need folding in
+        folded_through = {}
+        expected_sums = {(signal, lag) for signal in SIGNALS for lag in lags}
+        max_lag = max(lags)
+        since = []
+        for snack_id in snack_ids:
+            sums = stored.get(snack_id, {})
+            as_of_dates = {as_of for as_of, _ in sums.values()}
+            earliest_written = written[snack_id]
+            if (
+                set(sums) == expected_sums
+                and len(as_of_dates) == 1
+                and earliest_written is not None
+                and str(earliest_written) > str(min(as_of_dates))
+            ):
+                as_of = min(as_of_dates)
+                folded_through[snack_id] = as_of
+                first_day = min(
+                    as_of + datetime.timedelta(days=1),
+                    latest[snack_id] - datetime.timedelta(days=window - 1),
+                )
+                since.append(str(first_day - datetime.timedelta(days=max_lag)))
+            else:
+                since.append("-infinity")
+
+        cursor.execute(GET_METRICS_SINCE_QUERY, (snack_ids, since))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.commit()
+            return 0
+
+        start = min(row[1] for row in rows)
+        end = max(latest.values())
+        signals, prices = load_matrices(rows, snack_ids, start, end)
+        dates = np.arange(np.datetime64(start), np.datetime64(end) + 1)[:, None]
+        latest_dates = np.array(
+            [latest[snack_id] for snack_id in snack_ids], dtype="datetime64[D]"
+        )[None, :]
+        after = np.array(
+            [
+                folded_through.get(snack_id, start - datetime.timedelta(days=1))
+                for snack_id in snack_ids
+            ],
+            dtype="datetime64[D]",
+        )[None, :]
+        in_window = (dates > latest_dates - np.timedelta64(window, "D")) & (
+            dates <= latest_dates
+        )
+        unfolded = (dates > after) & (dates <= latest_dates)
+
+        values = []
+        for lag in lags:
+            rolling = lagged_sums(signals, prices, in_window, lag)
+            rolling_correlation = pearson(rolling, min_periods)
+            # all history: the new days plus the sums stored by the last refresh
+            history = lagged_sums(signals, prices, unfolded, lag)
+            for snack_index, snack_id in enumerate(snack_ids):
+                if snack_id not in folded_through:
+                    continue
+                for signal_index, signal in enumerate(SIGNALS):
+                    _, previous = stored[snack_id][(signal, lag)]
+                    for name, value in zip(SUM_NAMES, previous):
+                        history[name][signal_index, snack_index] += value or 0.0
+            history_correlation = pearson(history, min_periods)
+
+            for signal_index, signal in enumerate(SIGNALS):
+                for snack_index, snack_id in enumerate(snack_ids):
+                    cell = (signal_index, snack_index)
+                    values.append(
+                        (
+                            snack_id,
+                            signal,
+                            lag,
+                            window,
+                            latest[snack_id],
+                            int(rolling["n"][cell]),
+                            to_value(rolling_correlation[cell]),
+                            None,
+                            None,
+                            None,
+                            None,
+                            None,
+                        )
+                    )
+                    values.append(
+                        (
+                            snack_id,
+                            signal,
+                            lag,
+                            ALL_HISTORY,
+                            latest[snack_id],
+                            int(history["n"][cell]),
+                            to_value(history_correlation[cell]),
+                            *(float(history[name][cell]) for name in SUM_NAMES[1:]),
+                        )
+                    )
+        execute_values(cursor, UPSERT_CORRELATIONS_QUERY, values, page_size=1000)
+    conn.commit()
+    run_metrics.count("rows_written", len(values), table="snack_correlations")
+    logger.info(
+        f"Updated correlations for {len(snack_ids)} snacks "
+        f"({len(folded_through)} folded in, {len(snack_ids) - len(folded_through)} recomputed)."
+    )
+    return len(values)
@@ -1,25 +1,39 @@
 import datetime
 import logging
 import os
-import random
+import threading
 import time
-
-import finnhub
-import pandas as pd
-import praw
-import praw.models
-from db_utils import (
-    get_last_known_prices_from_db,
-    save_metrics_to_db,
-    save_mentions_to_db,
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from checkpoints import COLLECTOR_CHECKPOINTS, SHARED_SNACK_ID, RunState
+from correlations import refresh_correlations
+from db_utils import NEWS_NEGATIVE_QUERY, BulkWriter, get_last_known_prices_from_db
+from export import EXPORT_PATH, export_snapshot
+from google_trends import TrendsBatcher, build_trends_keyword
+from instrumentation import profiling, run_metrics
+from known_urls import known_urls
+from matcher import TermMatcher, get_term_matcher
+from news_planner import (
+    NEWS_PAGE_SIZE,
+    is_seen,
+    plan_news_queries,
+    stream_planned_news,
 )
-from dotenv import load_dotenv
-from newsapi import NewsApiClient
-from pytrends.exceptions import ResponseError
-from pytrends.request import TrendReq
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-
-load_dotenv()
+from rate_limiter import RateLimiter
+from reddit_ingest import (
+    AliasIndex,
+    CommentTreeFetcher,
+    restore_item,
+    snapshot_submission,
+    stream_reddit_mentions,
+    to_mention,
+)
+from response_cache import response_cache
+from scheduler import Scheduler
+from sentiment import sentiment_scorer
+from snack_summary import refresh_snack_summary
+from streaming import aggregate, batched, bounded
 
 logger = logging.getLogger(__name__)
 logging.getLogger("praw").setLevel(logging.INFO)
@@ -44,12 +58,16 @@ IRRELEVANT_KEYWORDS = {
 }
 
 
+RELEVANCE_MATCHER = TermMatcher(SNACK_RELEVANCE_KEYWORDS | IRRELEVANT_KEYWORDS)
+
+
 def is_article_relevant(article_text, search_terms):
     """Check if a news article is actually about the snack/drink product."""
-    text_lower = article_text.lower()
+    with run_metrics.timer("relevance"):
+        hits = RELEVANCE_MATCHER.find(article_text)
 
-    relevant_hits = sum(1 for kw in SNACK_RELEVANCE_KEYWORDS if kw in text_lower)
-    irrelevant_hits = sum(1 for kw in IRRELEVANT_KEYWORDS if kw in text_lower)
+    relevant_hits = len(hits & SNACK_RELEVANCE_KEYWORDS)
+    irrelevant_hits = len(hits & IRRELEVANT_KEYWORDS)
 
     # If clearly irrelevant and no food/drink context, filter it out
     if irrelevant_hits > 0 and relevant_hits == 0:
@@ -71,44 +89,164 @@ def get_environment_variable(key):
     return None
 
 
-CLIENT_ID = get_environment_variable("REDDIT_CLIENT_ID")
-CLIENT_SECRET = get_environment_variable("REDDIT_CLIENT_SECRET")
+def get_numeric_setting(key, default):
+    # Optional numeric tuning knob; falls back to the default when unset or invalid.
+    value = os.getenv(key)
+    if value is None or not value.strip():
+        return default
+    try:
+        return type(default)(value.strip())
+    except ValueError:
+        logger.warning(f"Invalid value {value!r} for {key}, using {default}.")
+        return default
+
+
+def is_setting_enabled(key):
+    value = os.getenv(key, "")
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 USER_AGENT = "SnackIndexCollector/0.1 by Taffe"
-NEWS_API_KEY = get_environment_variable("NEWS_API_KEY")
-FINNHUB_API_KEY = get_environment_variable("FINNHUB_API_KEY")
 SUBREDDITS_TO_SEARCH = "snacks+fastfood+food+soda"
 SEARCH_LIMIT = 20
+# "search" runs one Reddit search per snack; "shared" reads each subreddit once for all snacks
+# "per_snack" sends one NewsAPI query per snack; "combined" packs several snacks per query
+NEWS_QUERY_MODE = os.getenv("NEWS_QUERY_MODE", "per_snack").strip().lower()
+REDDIT_INGEST_MODE = os.getenv("REDDIT_INGEST_MODE", "search").strip().lower()
 MAX_MENTIONS_TO_SAVE = 5
 
-processed_stocks = set()
-cached_prices = {}
+# Per-source limits. requests_per_second is where each source's adaptive limiter
+# starts; it slows down on 429s and speeds back up to max_requests_per_second
+# (default: the starting rate). pytrends and praw share one client object that is
+# not thread safe, so they default to a single worker.
+SOURCE_LIMITS = {
+    "trends": {
+        "concurrency": get_numeric_setting("TRENDS_CONCURRENCY", 1),
+        "requests_per_second": get_numeric_setting("TRENDS_REQUESTS_PER_SECOND", 0.25),
+        # Trends publishes no quota, so its limiter probes for a faster pace
+        "max_requests_per_second": get_numeric_setting(
+            "TRENDS_MAX_REQUESTS_PER_SECOND", 1.0
+        ),
+    },
+    "reddit": {
+        "concurrency": get_numeric_setting("REDDIT_CONCURRENCY", 1),
+        "requests_per_second": get_numeric_setting("REDDIT_REQUESTS_PER_SECOND", 1.0),
+    },
+    "news": {
+        "concurrency": get_numeric_setting("NEWS_CONCURRENCY", 4),
+        "requests_per_second": get_numeric_setting("NEWS_REQUESTS_PER_SECOND", 2.0),
+    },
+    "stocks": {
+        "concurrency": get_numeric_setting("FINNHUB_CONCURRENCY", 2),
+        "requests_per_second": get_numeric_setting("FINNHUB_REQUESTS_PER_SECOND", 1.0),
+    },
+}
+
 
+ALL_SOURCES = tuple(SOURCE_LIMITS)
 
-pytrends = TrendReq(hl="en-US", tz=360)
-analyzer = SentimentIntensityAnalyzer()
 
+def get_selected_sources(value=None):
+    """
+    Parses COLLECTOR_SOURCES (e.g. "stocks" or "news,reddit") into the sources to
+    collect, in pipeline order. Unset or empty means every source.
+    """
+    if value is None:
+        value = os.getenv("COLLECTOR_SOURCES", "")
+    names = {name.strip().lower() for name in value.split(",") if name.strip()}
+    if not names:
+        return ALL_SOURCES
 
+    unknown = names.difference(ALL_SOURCES)
+    if unknown:
+        logger.warning(
+            f"Ignoring unknown COLLECTOR_SOURCES {sorted(unknown)}; expected {', '.join(ALL_SOURCES)}."
+        )
+    return tuple(source for source in ALL_SOURCES if source in names)
+
+
+# API clients are built on first use, so a run only imports, authenticates and
+# warns about the providers it actually calls. Assigning one of these globals
+# (as the benchmark does) swaps in a stand-in.
+pytrends = None
 reddit = None
-if CLIENT_ID and CLIENT_SECRET:  # initialize reddit IF api keys exist
-    reddit = praw.Reddit(
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET,
+newsapi = None
+finnhub_client = None
+client_lock = threading.Lock()
+initialized_clients = set()
+
+
+def get_client(name, build):
+    # A replayed run never talks to the providers, so it builds nothing
+    if response_cache.replaying:
+        return globals()[name]
+    with client_lock:
+        if globals()[name] is None and name not in initialized_clients:
+            initialized_clients.add(name)
+            globals()[name] = build()
+        return globals()[name]
+
+
+def build_pytrends():
+    # TrendReq fetches cookies on construction
+    from pytrends.request import TrendReq
+
+    return TrendReq(hl="en-US", tz=360)
+
+
+def build_reddit():
+    client_id = get_environment_variable("REDDIT_CLIENT_ID")
+    client_secret = get_environment_variable("REDDIT_CLIENT_SECRET")
+    if not (client_id and client_secret):
+        logger.error("Reddit credentials not found. Reddit functions will fail.")
+        return None
+
+    import praw
+
+    return praw.Reddit(
+        client_id=client_id,
+        client_secret=client_secret,
         user_agent=USER_AGENT,
     )
-else:
-    logger.error("Reddit credentials not found. Reddit functions will fail.")
 
-newsapi = None
-if NEWS_API_KEY:
-    newsapi = NewsApiClient(api_key=NEWS_API_KEY)
-else:
-    logger.error("NewsAPI credentials not found. News api functions will fail.")
 
-finnhub_client = None
-if FINNHUB_API_KEY:
-    finnhub_client = finnhub.Client(api_key=FINNHUB_API_KEY)
-else:
-    logger.error("Finnhub credentials not found. Finnhub functions will fail.")
+def build_newsapi():
+    news_api_key = get_environment_variable("NEWS_API_KEY")
+    if not news_api_key:
+        logger.error("NewsAPI credentials not found. News api functions will fail.")
+        return None
+
+    from newsapi import NewsApiClient
+
+    return NewsApiClient(api_key=news_api_key)
+
+
+def build_finnhub_client():
+    finnhub_api_key = get_environment_variable("FINNHUB_API_KEY")
+    if not finnhub_api_key:
+        logger.error("Finnhub credentials not found. Finnhub functions will fail.")
+        return None
+
+    import finnhub
+
+    return finnhub.Client(api_key=finnhub_api_key)
+
+
+def get_pytrends():
+    return get_client("pytrends", build_pytrends)
+
+
+def get_reddit():
+    return get_client("reddit", build_reddit)
+
+
+def get_newsapi():
+    return get_client("newsapi", build_newsapi)
+
+
+def get_finnhub_client():
+    return get_client("finnhub_client", build_finnhub_client)
+
 
 # time filter
 current_time_unix = int(time.time())
@@ -118,203 +256,374 @@ yesterday_iso = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime(
 )
 
 
-def get_google_trends_data(search_terms):
-    if not search_terms:
-        logging.warning("Received an empty list for Google Trends search. Skipping.")
-        return 0
+def get_google_trends_scores(snack_config, limiter=None):
+    """
+    Scores every snack with batched, anchor-normalized Trends requests.
+    Returns a map of snack key -> score.
+    """
+    keywords = {
+        snack_name: build_trends_keyword(config["search_terms"])
+        for snack_name, config in snack_config.items()
+        if config.get("search_terms")
+    }
+    if not keywords:
+        logging.warning("No search terms found for Google Trends. Skipping.")
+        return {}
+
+    if limiter is None:
+        limiter = RateLimiter("trends", **SOURCE_LIMITS["trends"])
+    batcher = TrendsBatcher(get_pytrends(), limiter=limiter, cache=response_cache)
+    scores = batcher.get_scores(list(keywords.values()))
+    logging.info(
+        f"Fetched Google Trends for {len(keywords)} snacks in {batcher.request_count} requests."
+    )
+    return {
+        snack_name: scores[keyword]
+        for snack_name, keyword in keywords.items()
+        if keyword in scores
+    }
 
-    max_retries = 1
-    retry_delay = 15
 
-    # retry api request
-    for attempt in range(max_retries):
-        try:
-            logging.debug(
-                f"Requesting Google Trends data for: {search_terms[:5]} (Attempt {attempt + 1})"
-            )
+def score_mentions(mentions):
+    # A mention already stored keeps its stored score; the rest are scored as one
+    # batch so repeated texts are only run through VADER once
+    to_score = []
+    for mention in mentions:
+        known_score = known_urls.get(mention.get("url"))
+        if known_score is None:
+            to_score.append(mention)
+        else:
+            mention["sentiment_score"] = known_score
+    if len(to_score) < len(mentions):
+        run_metrics.count("texts_known", len(mentions) - len(to_score))
+    if not to_score:
+        return
+    with run_metrics.timer("sentiment"):
+        scores = sentiment_scorer.score_batch([mention["text"] for mention in to_score])
+    run_metrics.count("texts_scored", len(to_score))
+    for mention, score in zip(to_score, scores):
+        mention["sentiment_score"] = score
+
+
+def is_relevant_mention(mention, search_query):
+    if is_article_relevant(mention["text"], search_query):
+        return True
+    logging.debug(f"Filtered irrelevant article: {mention['text']}")
+    return False
+
+
+def score_stream(pairs):
+    # sentiment stage: scores a batch of (group, mention) pairs at a time
+    for batch in batched(pairs):
+        score_mentions([mention for _, mention in batch])
+        yield from batch
+
+
+def summarize_stream(pairs, groups=(), relevance_query=None):
+    """
+    Runs (group, mention) pairs from a fetcher through relevance filter ->
+    sentiment -> aggregate. Fetching and scoring each run on their own thread and
+    hand over through bounded queues, so a slow stage holds back the one before
+    it. Only counts, sentiment totals and the first MAX_MENTIONS_TO_SAVE mentions
+    are kept per group, so memory stays flat however many mentions come in.
+    Returns group -> summary.
+    """
+    stream = bounded(pairs, name="fetch")
+    if relevance_query is not None:
+        stream = (
+            (group, mention)
+            for group, mention in stream
+            if is_relevant_mention(mention, relevance_query)
+        )
+    stream = bounded(score_stream(stream), name="sentiment")
+    return aggregate(stream, MAX_MENTIONS_TO_SAVE, groups)
 
-            pytrends.build_payload(
-                kw_list=search_terms[:5], cat=71, timeframe="now 1-d"
-            )
-            data = pytrends.interest_over_time()
 
-            if not data.empty and "isPartial" in data.columns:
-                data = data.drop(columns=["isPartial"])
-                last_row_mean = data.iloc[-1].mean()
-                return int(last_row_mean) if not pd.isna(last_row_mean) else 0
+def summarize(mentions, group_by=None, relevance_query=None):
+    # one summary, or one per group_by(mention) value (e.g. per day in a backfill)
+    if group_by is None:
+        pairs = ((None, mention) for mention in mentions)
+        return summarize_stream(pairs, (None,), relevance_query)[None]
+    pairs = ((group_by(mention), mention) for mention in mentions)
+    return summarize_stream(pairs, (), relevance_query)
 
-            return 0
 
-        except ResponseError as e:
-            if "response with code 429" in str(e):
-                logging.warning(
-                    f"Rate limit hit. Waiting for {retry_delay} seconds before retrying."
-                )
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Double the delay for the next attempt
-            else:
-                logging.error(f"An API error occurred for terms '{search_terms}': {e}")
-                return 0
-        except Exception as e:
-            logging.error(
-                f"An unexpected error occurred for terms '{search_terms}': {e}"
-            )
-            return 0
-
-    logging.error(
-        f"Failed to fetch Google Trends data for '{search_terms}' after {max_retries} attempts."
-    )
-    return 0
+def published_day(mention):
+    return mention["published_at"][:10]
 
 
 def get_reddit_data(
-    search_query, search_limit, search_terms, subreddits_to_search, time_filter_unix
+    search_query,
+    search_limit,
+    search_terms,
+    subreddits_to_search,
+    time_filter_unix,
+    comment_fetcher=None,
+    time_until_unix=None,
+    group_by=None,
+    limiter=None,
+    with_comments=True,
+    report_reach=False,
 ):
-    if not reddit:
+    """
+    Summarizes the Reddit search results (and their matching comments, unless
+    with_comments is off) for one snack, or per group_by(mention) when given.
+    None if the fetch failed. With report_reach, returns (summary, reach), where
+    reach is the creation time of the oldest post the search returned if it
+    stopped at search_limit posts, and None if it returned every match.
+    """
+    reddit = get_reddit()
+    if not reddit and not response_cache.replaying:
         logging.warning(
             "Reddit client not initialized. Skipping Reddit data collection."
         )
-        return []
+        return (None, None) if report_reach else None
 
-    reddit_mentions = []
+    term_matcher = get_term_matcher(tuple(search_terms))
+    owns_fetcher = with_comments and comment_fetcher is None
+    if owns_fetcher:
+        comment_fetcher = CommentTreeFetcher(
+            term_matcher, reddit=reddit, cache=response_cache
+        )
+    if limiter is None:
+        limiter = RateLimiter("reddit", **SOURCE_LIMITS["reddit"])
     logging.info(f"Searching Reddit for query: '{search_query}'")
 
-    try:
-        search_results = reddit.subreddit(subreddits_to_search).search(
-            search_query, limit=search_limit, sort="new"
+    def search():
+        # the listing is read inside the limiter, where its requests happen
+        return limiter.call(
+            lambda: list(
+                reddit.subreddit(subreddits_to_search).search(
+                    search_query, limit=search_limit, sort="new"
+                )
+            )
         )
 
-        for submission in search_results:
-            if submission.created_utc > time_filter_unix:
-                post_text = f"{submission.title} {submission.selftext}"
-                sentiment_score = analyzer.polarity_scores(post_text)["compound"]
-
-                reddit_mentions.append(
-                    {
-                        "text": post_text,
-                        "sentiment_score": sentiment_score,
-                        "source": "Reddit Submission",
-                        "source_name": submission.subreddit.display_name,
-                        "url": f"https://www.reddit.com{submission.permalink}",
-                        "published_at": datetime.datetime.fromtimestamp(
-                            submission.created_utc, tz=datetime.timezone.utc
-                        ).isoformat(),
-                    }
-                )
+    def mentions():
+        if response_cache.enabled:
+            records = response_cache.call(
+                "reddit",
+                {
+                    "search": search_query,
+                    "subreddits": subreddits_to_search,
+                    "limit": search_limit,
+                },
+                lambda: [snapshot_submission(submission) for submission in search()],
+            )
+            search_results = [restore_item(record) for record in records]
+        else:
+            search_results = search()
+        if len(search_results) >= search_limit:
+            reach[0] = min(submission.created_utc for submission in search_results)
+        submissions = [
+            submission
+            for submission in search_results
+            if submission.created_utc > time_filter_unix
+            and (time_until_unix is None or submission.created_utc <= time_until_unix)
+        ]
+        # start every comment tree download before reading the first one; they
+        # share the search's limiter, and with it the one praw client
+        if with_comments:
+            for submission in submissions:
+                comment_fetcher.prefetch(submission, limiter)
+
+        for submission in submissions:
+            yield to_mention(
+                submission,
+                f"{submission.title} {submission.selftext}",
+                "Reddit Submission",
+            )
+            if not with_comments:
+                continue
+            for mention in comment_fetcher.comments(submission):
+                if term_matcher.search(mention["text"]):
+                    yield mention
 
-                submission.comments.replace_more(limit=0)
-                for comment in submission.comments.list():
-                    if isinstance(comment, praw.models.MoreComments):
-                        continue
-                    if any(
-                        term.lower() in comment.body.lower() for term in search_terms
-                    ):
-                        comment_score = analyzer.polarity_scores(comment.body)[
-                            "compound"
-                        ]
-                        reddit_mentions.append(
-                            {
-                                "text": comment.body,
-                                "sentiment_score": comment_score,
-                                "source": "Reddit Comment",
-                                "source_name": comment.subreddit.display_name,
-                                "url": f"https://www.reddit.com{comment.permalink}",
-                                "published_at": datetime.datetime.fromtimestamp(
-                                    comment.created_utc, tz=datetime.timezone.utc
-                                ).isoformat(),
-                            }
-                        )
+    reach = [None]
+    try:
+        summary = summarize(mentions(), group_by)
+        return (summary, reach[0]) if report_reach else summary
     except Exception as e:
+        # None rather than an empty summary so the failed fetch is not checkpointed
         logging.error(f"An error occurred while fetching from Reddit {e}")
-        return []
+        return (None, None) if report_reach else None
+    finally:
+        if owns_fetcher:
+            comment_fetcher.close()
 
-    return reddit_mentions
+
+def get_shared_reddit_data(snack_config, subreddits_to_search, time_filter_unix):
+    """Returns a map of snack key -> Reddit summary from a single shared pass."""
+    reddit = get_reddit()
+    if not reddit and not response_cache.replaying:
+        logging.warning(
+            "Reddit client not initialized. Skipping Reddit data collection."
+        )
+        return None
+
+    logging.info(f"Reading new posts and comments from r/{subreddits_to_search}")
+    try:
+        return summarize_stream(
+            stream_reddit_mentions(
+                reddit,
+                snack_config,
+                subreddits_to_search,
+                time_filter_unix,
+                cache=response_cache,
+            ),
+            groups=snack_config,
+        )
+    except Exception as e:
+        logging.error(f"An error occurred while fetching from Reddit {e}")
+        return None
 
 
-def get_news_data(search_query, time_filter_iso):
-    if not newsapi:
+def get_news_data(
+    search_query,
+    time_filter_iso,
+    published_after=None,
+    time_until_iso=None,
+    group_by=None,
+    limiter=None,
+    max_pages=None,
+    report_reach=False,
+):
+    """
+    Summarizes the relevant NewsAPI articles for one snack's query, or per
+    group_by(mention) when given. None if the fetch failed. With max_pages, reads
+    up to that many full pages, newest first, instead of one default page sorted
+    by relevancy. With report_reach, returns (summary, reach), where reach is the
+    publish time of the oldest article read if more were left unread, and None
+    if every match was read.
+    """
+    newsapi = get_newsapi()
+    if not newsapi and not response_cache.replaying:
         logging.warning(
             "NewsAPI client not initialized. Skipping NewsAPI data collection."
         )
-        return []
+        return (None, None) if report_reach else None
 
-    processed_urls = set()
-    news_articles = []
+    if limiter is None:
+        limiter = RateLimiter("news", **SOURCE_LIMITS["news"])
     logging.info(f"Searching NewsAPI for query: '{search_query}'")
 
-    try:
-        all_articles = newsapi.get_everything(
+    def download(request):
+        return response_cache.call(
+            "news", request, lambda: limiter.call(newsapi.get_everything, **request)
+        )
+
+    def articles():
+        request = dict(
             q=search_query,
             from_param=time_filter_iso,
             language="en",
             sort_by="relevancy",
         )
-
-        for article in all_articles["articles"]:
+        if time_until_iso:
+            request["to"] = time_until_iso
+        if not max_pages:
+            yield from download(request)["articles"]
+            return
+
+        request["sort_by"] = "publishedAt"
+        for page in range(1, max_pages + 1):
+            try:
+                response = download(dict(request, page_size=NEWS_PAGE_SIZE, page=page))
+            except Exception as e:
+                if page == 1:
+                    raise
+                # later pages can hit the plan's result cap; what was read is cut off
+                logging.error(f"An error occurred while fetching news data {e}")
+                break
+            page_articles = response["articles"]
+            yield from page_articles
+            total = response.get("totalResults", 0)
+            if len(page_articles) < NEWS_PAGE_SIZE or page * NEWS_PAGE_SIZE >= total:
+                return
+        reach[0] = oldest[0]
+
+    def mentions():
+        processed_urls = set()
+        for article in articles():
+            if oldest[0] is None or article["publishedAt"] < oldest[0]:
+                oldest[0] = article["publishedAt"]
             url = article["url"]
             if url in processed_urls:
                 continue
 
             processed_urls.add(url)
-            article_text = f"{article['title']} {article['description']}"
-
-            if not is_article_relevant(article_text, search_query):
-                logging.debug(f"Filtered irrelevant article: {article['title']}")
+            if published_after and is_seen(article, published_after):
                 continue
-
-            sentiment_score = analyzer.polarity_scores(article_text)["compound"]
-
-            news_articles.append(
-                {
-                    "text": article_text,
-                    "sentiment_score": sentiment_score,
-                    "source": "NewsAPI",
-                    "source_name": article["source"]["name"],
-                    "url": url,
-                    "published_at": article["publishedAt"],
-                }
-            )
+            yield {
+                "text": f"{article['title']} {article['description']}",
+                "sentiment_score": None,
+                "source": "NewsAPI",
+                "source_name": article["source"]["name"],
+                "url": url,
+                "published_at": article["publishedAt"],
+            }
+
+    oldest = [None]
+    reach = [None]
+    try:
+        summary = summarize(mentions(), group_by, relevance_query=search_query)
+        return (summary, reach[0]) if report_reach else summary
     except Exception as e:
         logging.error(f"An error occurred while fetching news data {e}")
-        return []
-
-    return news_articles
-
+        return (None, None) if report_reach else None
 
-def get_avg_sentiment(mentions):
-    if not mentions:
-        return 0.0
-
-    total = 0
-
-    for mention in mentions:
-        total += mention["sentiment_score"]
 
-    avg = total / len(mentions)
+def get_planned_news_data(
+    snack_config, time_filter_iso, limiter=None, published_after=None
+):
+    """Returns a map of snack key -> news summary using combined NewsAPI queries."""
+    newsapi = get_newsapi()
+    if not newsapi and not response_cache.replaying:
+        logging.warning(
+            "NewsAPI client not initialized. Skipping NewsAPI data collection."
+        )
+        return None
 
-    return avg
+    plans = plan_news_queries(snack_config, NEWS_NEGATIVE_QUERY)
+    try:
+        return summarize_stream(
+            stream_planned_news(
+                newsapi,
+                snack_config,
+                plans,
+                time_filter_iso,
+                is_article_relevant,
+                limiter=limiter,
+                cache=response_cache,
+                published_after=published_after,
+            ),
+            groups=snack_config,
+        )
+    except Exception as e:
+        logging.error(f"An error occurred while fetching news data {e}")
+        return None
 
 
-def get_stock_price(stock_ticker):
-    if not finnhub_client:
+def get_stock_price(stock_ticker, limiter=None):
+    finnhub_client = get_finnhub_client()
+    if not finnhub_client and not response_cache.replaying:
         logging.warning(
             "Finnhub client not initialized. Skipping Finnhub data collection."
         )
         return None
+    if limiter is None:
+        limiter = RateLimiter("stocks", **SOURCE_LIMITS["stocks"])
     logging.info(f"Starting Stock Price Lookup for {stock_ticker}")
 
-    # stops multi fetching of same data
-    if stock_ticker in processed_stocks:
-        return cached_prices.get(stock_ticker)
-
     try:
-        stock_price_data = finnhub_client.quote(stock_ticker)
+        stock_price_data = response_cache.call(
+            "stocks",
+            {"quote": stock_ticker},
+            lambda: limiter.call(finnhub_client.quote, stock_ticker),
+        )
         closing_price = stock_price_data.get("c")
 
         if closing_price is not None and closing_price != 0:
-            processed_stocks.add(stock_ticker)
-            cached_prices[stock_ticker] = closing_price
-
             return closing_price
         else:
             logging.warning(f"No valid closing price data found for {stock_ticker}.")
@@ -327,109 +636,584 @@ def get_stock_price(stock_ticker):
         return None
 
 
-# runs data collection pipeline for each snack in config then updates db
-def run_collection_pipeline(snack_config, db_connection):
-    logging.info("Starting the Snack Index data collection pipeline.")
+def iso_date_to_unix(date_iso):
+    # midnight UTC at the start of the day
+    return int(
+        datetime.datetime.fromisoformat(date_iso)
+        .replace(tzinfo=datetime.timezone.utc)
+        .timestamp()
+    )
 
-    #  fallback map of prices
-    logging.info("Fetching last known stock prices for fallback...")
-    last_prices_map = get_last_known_prices_from_db(db_connection)
+
+def get_stock_candles(stock_ticker, start_iso, end_iso, limiter=None):
+    """
+    Daily closing prices for stock_ticker between two ISO dates, in one Finnhub
+    candle request. Returns a map of ISO date -> close (trading days only), or
+    None when the request failed.
+    """
+    finnhub_client = get_finnhub_client()
+    if not finnhub_client and not response_cache.replaying:
+        logging.warning(
+            "Finnhub client not initialized. Skipping Finnhub data collection."
+        )
+        return None
+    if limiter is None:
+        limiter = RateLimiter("stocks", **SOURCE_LIMITS["stocks"])
     logging.info(
-        f"Successfully created fallback map for {len(last_prices_map)} snacks."
+        f"Fetching daily candles for {stock_ticker} ({start_iso} to {end_iso})"
     )
 
-    stock_price_cache = {}
+    start_unix = iso_date_to_unix(start_iso)
+    # through the end of the last day
+    end_unix = iso_date_to_unix(end_iso) + (24 * 60 * 60) - 1
+    try:
+        candles = response_cache.call(
+            "stocks",
+            {"candles": stock_ticker, "from": start_iso, "to": end_iso},
+            lambda: limiter.call(
+                finnhub_client.stock_candles, stock_ticker, "D", start_unix, end_unix
+            ),
+        )
+        if candles.get("s") != "ok":
+            logging.warning(f"No candle data found for {stock_ticker}.")
+            return {}
+
+        return {
+            datetime.datetime.fromtimestamp(
+                timestamp, tz=datetime.timezone.utc
+            ).strftime("%Y-%m-%d"): close
+            for timestamp, close in zip(candles["t"], candles["c"])
+            if close
+        }
+    except Exception as e:
+        logging.error(
+            f"An error occurred while fetching candles for {stock_ticker}: {e}"
+        )
+        return None
 
-    twenty_four_hours_ago_unix = int(time.time()) - (24 * 60 * 60)
-    yesterday_iso = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime(
-        "%Y-%m-%d"
-    )
 
-    for snack_name, config in snack_config.items():
-        logging.info(f"Processing: {snack_name}")
-        snack_id = config["snack_id"]
+def get_stock_prices(stock_tickers, limiter=None):
+    """
+    Quotes every distinct ticker once, several at a time within Finnhub's rate
+    limit. Returns a map of ticker -> closing price (None when the quote failed).
+    """
+    if limiter is None:
+        limiter = RateLimiter("stocks", **SOURCE_LIMITS["stocks"])
+    if not stock_tickers:
+        return {}
+
+    with ThreadPoolExecutor(
+        max_workers=limiter.concurrency, thread_name_prefix="collector-stocks"
+    ) as executor:
+        prices = executor.map(
+            lambda stock_ticker: get_stock_price(stock_ticker, limiter),
+            stock_tickers,
+        )
+        return dict(zip(stock_tickers, prices))
+
 
-        sleep_time = random.uniform(2, 5)
+def resolve_stock_price(stock_ticker, stock_price, snack_id, last_prices_map):
+    # Falls back to the last price stored in the DB when the API gave us nothing
+    if stock_price is None:
+        fallback_price = last_prices_map.get(snack_id)
+
+        if fallback_price is not None:
+            stock_price = fallback_price
+            logging.warning(
+                f"API returned null for {stock_ticker}. Using last known price from DB: ${stock_price}"
+            )
+        else:
+            logging.error(
+                f"API returned null for {stock_ticker} and NO fallback price was found in DB for snack_id {snack_id}."
+            )
+    return stock_price
+
+
+def summarize_mentions(mentions):
+    """
+    Keeps what a snack's metrics need from one source's mentions, in a
+    JSON-serializable form that can be checkpointed.
+    """
+    return aggregate(
+        ((None, mention) for mention in mentions), MAX_MENTIONS_TO_SAVE, (None,)
+    )[None]
+
+
+def timed_fetch(source, snack_name, fetch, *args, **kwargs):
+    # snack_name is None for the batched stages that cover many snacks at once
+    with run_metrics.timer("fetch", source=source, snack=snack_name):
+        result = fetch(*args, **kwargs)
+    if result is None:
+        run_metrics.count("fetch_failures", source=source)
+    return result
+
+
+def save_snack_results(
+    writer,
+    snack_name,
+    config,
+    date_iso,
+    google_trends_score,
+    reddit_summary,
+    news_summary,
+    stock_price,
+):
+    # a summary (or score) of None means the source was not collected this run;
+    # its columns are written as NULL, which keeps the value already stored
+    snack_id = config["snack_id"]
+    reddit_summary = reddit_summary or {}
+    news_summary = news_summary or {}
+    avg_reddit_sentiment = reddit_summary.get("avg_sentiment")
+    reddit_mention_count = reddit_summary.get("count")
+    avg_news_sentiment = news_summary.get("avg_sentiment")
+    news_article_count = news_summary.get("count")
+
+    mentions_to_save = reddit_summary.get("mentions", []) + news_summary.get(
+        "mentions", []
+    )
+    # still counted in the aggregates above, but ON CONFLICT (url) would drop them
+    new_mentions = [
+        mention for mention in mentions_to_save if mention.get("url") not in known_urls
+    ]
+    if len(new_mentions) < len(mentions_to_save):
+        run_metrics.count(
+            "rows_prefiltered",
+            len(mentions_to_save) - len(new_mentions),
+            table="mentions",
+        )
+    if new_mentions:
+        writer.add_mentions(snack_id, new_mentions)
+
+    # create metrics obj
+    daily_metrics = {
+        "snack_id": snack_id,
+        "date": date_iso,
+        "google_trends_score": google_trends_score,
+        "reddit_mention_count": reddit_mention_count,
+        "avg_reddit_sentiment": avg_reddit_sentiment,
+        "news_article_count": news_article_count,
+        "avg_news_sentiment": avg_news_sentiment,
+        "stock_close_price": stock_price,
+    }
+
+    writer.add_metrics(daily_metrics)
+
+    # Logs
+    logging.info(f"Finished processing for {snack_name}. Log summary:")
+    if google_trends_score is not None:
+        logging.info(f"Google Trends Score: {google_trends_score}")
+    if reddit_summary:
+        logging.info(
+            f"Reddit Mentions: {reddit_mention_count}, Avg Sentiment: {avg_reddit_sentiment:.4f}"
+        )
+    if news_summary:
         logging.info(
-            f"Waiting for {sleep_time:.2f} seconds before Google Trends request..."
+            f"News Articles: {news_article_count}, Avg Sentiment: {avg_news_sentiment:.4f}"
         )
-        time.sleep(sleep_time)
+    if stock_price is not None:
+        logging.info(f"Stock Price for {config.get('stock_ticker')}: ${stock_price}")
 
-        # start fetch data
-        google_trends_score = get_google_trends_data(config["search_terms"])
 
-        reddit_data = get_reddit_data(
-            search_query=config["reddit_query"],
-            search_limit=SEARCH_LIMIT,
-            search_terms=config["search_terms"],
-            subreddits_to_search=SUBREDDITS_TO_SEARCH,
-            time_filter_unix=twenty_four_hours_ago_unix,
-        )
-        avg_reddit_sentiment = get_avg_sentiment(reddit_data)
-        reddit_mention_count = len(reddit_data)
+def watermark_snack_id(source, snack_id):
+    # shared Reddit ingest and combined news queries keep one watermark for all snacks
+    if (source == "reddit" and REDDIT_INGEST_MODE == "shared") or (
+        source == "news" and NEWS_QUERY_MODE == "combined"
+    ):
+        return SHARED_SNACK_ID
+    return snack_id
+
 
-        news_data = get_news_data(
-            search_query=config["news_query"], time_filter_iso=yesterday_iso
+def save_source_results(
+    writer, snack_name, config, date_iso, results, sources, last_prices_map
+):
+    """
+    Writes a snack's row from its per-source results (checkpoint form, None when
+    the fetch failed). A failed or skipped source is written as NULL, so a 429 or
+    an outage is not stored as a score or count of zero.
+    """
+    trends_score = None
+    if "trends" in sources and results.get("trends"):
+        trends_score = results["trends"]["score"]
+    summaries = {
+        source: results.get(source)
+        for source in ("reddit", "news")
+        if source in sources
+    }
+    stock_ticker = config.get("stock_ticker")
+    stock_price = None
+    if stock_ticker and "stocks" in sources:
+        stock_price = resolve_stock_price(
+            stock_ticker,
+            results["stocks"]["price"] if results.get("stocks") else None,
+            config["snack_id"],
+            last_prices_map,
         )
-        avg_news_sentiment = get_avg_sentiment(news_data)
-        news_article_count = len(news_data)
 
-        mentions_to_save = (
-            reddit_data[:MAX_MENTIONS_TO_SAVE] + news_data[:MAX_MENTIONS_TO_SAVE]
+    save_snack_results(
+        writer,
+        snack_name,
+        config,
+        date_iso,
+        trends_score,
+        summaries.get("reddit"),
+        summaries.get("news"),
+        stock_price,
+    )
+
+
+def run_post_stages(db_pool, written):
+    """
+    Runs after the writes are committed: folds the daily_metrics rows just
+    written (snack_id -> the earliest date written) into snack_summary and
+    snack_correlations, touching only those snacks, and appends what changed to
+    the EXPORT_PATH snapshot.
+    """
+    db_pool.run(refresh_snack_summary, written)
+    db_pool.run(refresh_correlations, written)
+    if EXPORT_PATH:
+        db_pool.run(export_snapshot, EXPORT_PATH, min(written.values(), default=None))
+
+
+class InlineExecutor:
+    """Runs submitted work right away on the calling thread (sequential mode)."""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def collect_snacks(
+    snack_config,
+    db_pool,
+    writer,
+    comment_fetcher,
+    run_state,
+    concurrent,
+    sources=ALL_SOURCES,
+    schedule=None,
+):
+    """
+    Fetches every selected (snack, source) pair the run has not checkpointed yet, then
+    writes each snack's metrics from fresh and checkpointed results in
+    snack_config order, or in the schedule's priority order when it has a time
+    budget. In concurrent mode the fetches fan out to one thread pool per source,
+    each sized by SOURCE_LIMITS; otherwise they run one after another on this
+    thread. Either way every request goes through its source's adaptive limiter.
+    The per-snack Reddit and news fetches go through the schedule, which cuts
+    them down or skips them near its deadline. Only successful, complete fetches
+    are checkpointed.
+    """
+    if schedule is None:
+        schedule = Scheduler(budget=0)
+    snack_config = db_pool.run(schedule.prioritize, snack_config, run_state.run_date)
+    # one adaptive limiter per source for the whole run, handed down to the requests
+    limiters = {
+        source: RateLimiter(source, **SOURCE_LIMITS[source]) for source in sources
+    }
+    if concurrent:
+        executors = {
+            source: ThreadPoolExecutor(
+                max_workers=limiter.concurrency,
+                thread_name_prefix=f"collector-{source}",
+            )
+            for source, limiter in limiters.items()
+        }
+    else:
+        executors = {source: InlineExecutor() for source in sources}
+
+    date_iso = run_state.run_date
+    todo = {
+        source: {
+            snack_name: config
+            for snack_name, config in snack_config.items()
+            if source in sources and not run_state.is_done(config["snack_id"], source)
+        }
+        for source in SOURCE_LIMITS
+    }
+
+    if schedule.enabled:
+        # the batched jobs serve every snack at once, so the deadline never cuts them;
+        # only the shared Reddit and combined news passes are long enough to matter
+        unchecked = [source for source in ("trends", "stocks") if todo[source]]
+        level = logging.INFO
+        if REDDIT_INGEST_MODE == "shared" and todo["reddit"]:
+            unchecked.append("shared reddit")
+            level = logging.WARNING
+        if NEWS_QUERY_MODE == "combined" and todo["news"]:
+            unchecked.append("combined news")
+            level = logging.WARNING
+        if unchecked:
+            logging.log(
+                level,
+                f"The {schedule.budget:.0f}s time budget does not apply to the batched "
+                f"fetches ({', '.join(unchecked)}); they always run in full.",
+            )
+
+    try:
+        # the batched jobs run alongside the per-snack fetches
+        trends_future = None
+        if todo["trends"]:
+            trends_future = executors["trends"].submit(
+                timed_fetch,
+                "trends",
+                None,
+                get_google_trends_scores,
+                todo["trends"],
+                limiters["trends"],
+            )
+        # one quote per ticker per run, shared by every snack of that company
+        stock_tickers = list(
+            dict.fromkeys(
+                config["stock_ticker"]
+                for config in todo["stocks"].values()
+                if config.get("stock_ticker")
+            )
         )
-        if mentions_to_save:
-            save_mentions_to_db(db_connection, snack_id, mentions_to_save)
-
-        stock_ticker = config.get("stock_ticker")
-        stock_price = None
-        if stock_ticker:
-            if stock_ticker in stock_price_cache:
-                stock_price = stock_price_cache[stock_ticker]
-                logging.info(
-                    f"Using cached stock price for {stock_ticker}: ${stock_price}"
+        stocks_future = None
+        if stock_tickers:
+            stocks_future = executors["stocks"].submit(
+                timed_fetch,
+                "stocks",
+                None,
+                get_stock_prices,
+                stock_tickers,
+                limiters["stocks"],
+            )
+        shared_reddit_future = None
+        if REDDIT_INGEST_MODE == "shared" and todo["reddit"]:
+            shared_reddit_future = executors["reddit"].submit(
+                timed_fetch,
+                "reddit",
+                None,
+                get_shared_reddit_data,
+                todo["reddit"],
+                SUBREDDITS_TO_SEARCH,
+                run_state.since_unix("reddit", SHARED_SNACK_ID),
+            )
+        planned_news_future = None
+        if NEWS_QUERY_MODE == "combined" and todo["news"]:
+            planned_news_future = executors["news"].submit(
+                timed_fetch,
+                "news",
+                None,
+                get_planned_news_data,
+                todo["news"],
+                run_state.since_iso("news", SHARED_SNACK_ID),
+                limiters["news"],
+                published_after=run_state.watermark("news", SHARED_SNACK_ID),
+            )
+
+        pending = {}
+        for snack_name, config in snack_config.items():
+            snack_id = config["snack_id"]
+            pending[snack_name] = {}
+            if NEWS_QUERY_MODE != "combined" and snack_name in todo["news"]:
+                pending[snack_name]["news"] = executors["news"].submit(
+                    schedule.fetch,
+                    "news",
+                    snack_id,
+                    partial(
+                        timed_fetch,
+                        "news",
+                        snack_name,
+                        get_news_data,
+                        search_query=config["news_query"],
+                        time_filter_iso=run_state.since_iso("news", snack_id),
+                        published_after=run_state.watermark("news", snack_id),
+                        limiter=limiters["news"],
+                    ),
                 )
-            else:
-                stock_price = get_stock_price(stock_ticker)
-                # Still cache the result, even if it's None, to avoid re-fetching
-                stock_price_cache[stock_ticker] = stock_price
-
-            if stock_price is None:
-                snack_id = config["snack_id"]
-                fallback_price = last_prices_map.get(snack_id)
-
-                if fallback_price is not None:
-                    stock_price = fallback_price
-                    logging.warning(
-                        f"API returned null for {stock_ticker}. Using last known price from DB: ${stock_price}"
-                    )
+            if REDDIT_INGEST_MODE != "shared" and snack_name in todo["reddit"]:
+                reddit_fetch = partial(
+                    timed_fetch,
+                    "reddit",
+                    snack_name,
+                    get_reddit_data,
+                    search_query=config["reddit_query"],
+                    search_limit=SEARCH_LIMIT,
+                    search_terms=config["search_terms"],
+                    subreddits_to_search=SUBREDDITS_TO_SEARCH,
+                    time_filter_unix=run_state.since_unix("reddit", snack_id),
+                    comment_fetcher=comment_fetcher,
+                    limiter=limiters["reddit"],
+                )
+                pending[snack_name]["reddit"] = executors["reddit"].submit(
+                    schedule.fetch,
+                    "reddit",
+                    snack_id,
+                    reddit_fetch,
+                    # without the comment trees when only that fits before the deadline
+                    lite=partial(reddit_fetch, with_comments=False),
+                )
+
+        if concurrent:
+            logging.info(
+                f"Queued {len(pending)} snacks across {len(executors)} sources."
+            )
+
+        trends_scores = trends_future.result() if trends_future else {}
+        stock_prices = stocks_future.result() if stocks_future else {}
+        # the last stored price is only looked up for snacks whose ticker got no quote
+        missing_price_ids = [
+            config["snack_id"]
+            for snack_name, config in snack_config.items()
+            if snack_name in todo["stocks"]
+            and config.get("stock_ticker")
+            and stock_prices.get(config["stock_ticker"]) is None
+        ]
+        last_prices_map = {}
+        if missing_price_ids:
+            logging.info(
+                f"Fetching last known stock prices for {len(missing_price_ids)} snacks..."
+            )
+            last_prices_map = db_pool.run(
+                get_last_known_prices_from_db, missing_price_ids
+            )
+        shared_reddit = shared_reddit_future.result() if shared_reddit_future else None
+        planned_news = planned_news_future.result() if planned_news_future else None
+        for snack_name, config in snack_config.items():
+            logging.info(f"Processing: {snack_name}")
+            snack_id = config["snack_id"]
+            futures = pending.pop(snack_name)
+
+            fresh = {}
+            if snack_name in trends_scores:
+                fresh["trends"] = {"score": trends_scores[snack_name]}
+            if "reddit" in futures:
+                fresh["reddit"] = futures["reddit"].result()
+            elif shared_reddit is not None and snack_name in todo["reddit"]:
+                fresh["reddit"] = shared_reddit.get(snack_name)
+            if "news" in futures:
+                fresh["news"] = futures["news"].result()
+            elif planned_news is not None and snack_name in todo["news"]:
+                fresh["news"] = planned_news.get(snack_name)
+            stock_ticker = config.get("stock_ticker")
+            if stock_prices.get(stock_ticker) is not None:
+                fresh["stocks"] = {"price": stock_prices[stock_ticker]}
+
+            # a cut-down result is written, but left for a rerun to fetch in full
+            degraded = schedule.degraded(snack_id)
+            results = {}
+            for source in SOURCE_LIMITS:
+                if fresh.get(source) is not None:
+                    results[source] = fresh[source]
+                    if source not in degraded:
+                        run_state.record(writer, snack_id, source, fresh[source])
                 else:
-                    logging.error(
-                        f"API returned null for {stock_ticker} and NO fallback price was found in DB for snack_id {snack_id}."
+                    results[source] = run_state.result(snack_id, source)
+
+            for source in ("reddit", "news"):
+                if fresh.get(source) is not None and source not in degraded:
+                    run_state.advance(
+                        source,
+                        watermark_snack_id(source, snack_id),
+                        fresh[source]["latest"],
                     )
-        # create metrics obj
-        daily_metrics = {
-            "snack_id": config["snack_id"],
-            "date": yesterday_iso,
-            "google_trends_score": google_trends_score,
-            "reddit_mention_count": reddit_mention_count,
-            "avg_reddit_sentiment": avg_reddit_sentiment,
-            "news_article_count": news_article_count,
-            "avg_news_sentiment": avg_news_sentiment,
-            "stock_close_price": stock_price,
-        }
+            schedule.flag(snack_id, results)
 
-        save_metrics_to_db(db_connection, daily_metrics)
+            save_source_results(
+                writer, snack_name, config, date_iso, results, sources, last_prices_map
+            )
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
 
-        # Logs
-        logging.info(f"Finished processing for {snack_name}. Log summary:")
-        logging.info(f"Google Trends Score: {google_trends_score}")
-        logging.info(
-            f"Reddit Mentions: {reddit_mention_count}, Avg Sentiment: {avg_reddit_sentiment:.4f}"
-        )
-        logging.info(
-            f"News Articles: {news_article_count}, Avg Sentiment: {avg_news_sentiment:.4f}"
+
+def get_run_window():
+    """
+    Returns (unix time 24 hours ago, yesterday's ISO date). Recorded runs store
+    the window with their responses so a replay sees the same one.
+    """
+
+    def compute():
+        return [
+            int(time.time()) - (24 * 60 * 60),
+            (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+        ]
+
+    if response_cache.mode in ("record", "replay"):
+        return tuple(response_cache.call("run", {"window": "24h"}, compute))
+    return tuple(compute())
+
+
+# runs data collection pipeline for each snack in config then updates db
+def run_collection_pipeline(snack_config, db_pool, concurrent=None, sources=None):
+    logging.info("Starting the Snack Index data collection pipeline.")
+
+    if concurrent is None:
+        concurrent = is_setting_enabled("COLLECTOR_CONCURRENT")
+    if sources is None:
+        sources = get_selected_sources()
+
+    run_metrics.start()
+    succeeded = False
+    try:
+        with profiling():
+            collect_run(snack_config, db_pool, concurrent, sources)
+        succeeded = True
+    finally:
+        # stage timings, counters and the run report are written even for a failed run
+        run_metrics.finish(succeeded)
+
+
+def collect_run(snack_config, db_pool, concurrent, sources=ALL_SOURCES):
+    # COLLECTOR_TIME_BUDGET counts from here
+    schedule = Scheduler(
+        concurrency=(
+            {source: limits["concurrency"] for source, limits in SOURCE_LIMITS.items()}
+            if concurrent
+            else None
         )
-        if stock_price is not None:
-            logging.info(f"Stock Price for {stock_ticker}: ${stock_price}")
+    ).start()
+    # a restarted run picks up its pinned window and completed fetches; a run of
+    # only some sources is a one-off refresh and leaves the checkpoints alone
+    full_run = set(sources) == set(ALL_SOURCES)
+    run_state = RunState(db_pool, enabled=full_run and COLLECTOR_CHECKPOINTS).start(
+        get_run_window()
+    )
 
-        print("-" * 40)
+    # URLs become known once the commit that inserted them succeeds
+    writer = BulkWriter(db_pool, on_inserted=known_urls.add)
+    db_pool.run(known_urls.refresh)
+    # one comment tree download per submission, shared by every snack that finds it;
+    # a compiled SnackCatalog brings its alias index along
+    alias_index = getattr(snack_config, "alias_index", None) or AliasIndex(snack_config)
+    comment_fetcher = CommentTreeFetcher(
+        alias_index.matcher,
+        reddit=get_reddit() if "reddit" in sources else None,
+        cache=response_cache,
+    )
+    try:
+        if concurrent:
+            logging.info("Running collection in concurrent mode.")
+        if not full_run:
+            logging.info(f"Collecting only: {', '.join(sources)}.")
+        collect_snacks(
+            snack_config,
+            db_pool,
+            writer,
+            comment_fetcher,
+            run_state,
+            concurrent,
+            sources,
+            schedule,
+        )
+        run_state.finish(writer)
+        # the known URLs are only cached once the mentions they stand for are stored
+        writer.flush()
+        writer.commit()
+        known_urls.save()
+        db_pool.run(schedule.finish, run_state.run_date)
+        run_post_stages(db_pool, writer.metrics_written)
+    finally:
+        comment_fetcher.close()
+        writer.close()
+        sentiment_scorer.close()
+        response_cache.close()
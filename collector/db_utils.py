@@ -1,8 +1,16 @@
 import logging
+from contextlib import contextmanager
 from math import log
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import os
+import random
+import threading
+import time
 
+from instrumentation import run_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +21,171 @@ LEFT JOIN companies c ON s.company_id = c.id
 LEFT JOIN snack_aliases a ON s.id = a.snack_id;"""
 
 
-def connect_db():
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "4"))
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+# Idle connections older than this are pinged before being handed out
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+# Turn off when connecting through a transaction-mode pooler, which cannot keep
+# session-level prepared statements.
+DB_PREPARED_STATEMENTS = os.getenv(
+    "DB_PREPARED_STATEMENTS", "true"
+).strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    # Remembers which server-side prepared statements exist on this session
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+
+def execute_prepared(cursor, name, query, params):
+    """
+    Runs query through a server-side prepared statement, preparing it on first use
+    for this connection. Falls back to a plain execute when disabled.
+    """
+    connection = cursor.connection
+    if not DB_PREPARED_STATEMENTS or not isinstance(connection, PreparingConnection):
+        cursor.execute(query, params)
+        return
+
+    if name not in connection.prepared:
+        parts = query.strip().rstrip(";").split("%s")
+        positional = parts[0] + "".join(
+            f"${i}{part}" for i, part in enumerate(parts[1:], start=1)
+        )
+        cursor.execute(f"PREPARE {name} AS {positional}")
+        connection.prepared.add(name)
+
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+def with_backoff(func, action, retries=DB_CONNECT_RETRIES):
+    delay = 1.0
+    for attempt in range(1, retries + 1):
+        try:
+            return func()
+        except CONNECTION_ERRORS as e:
+            if attempt == retries:
+                raise
+            run_metrics.count("retries", source="db")
+            logger.warning(
+                f"Could not {action} (attempt {attempt}/{retries}): {e}. Retrying in {delay:.0f}s."
+            )
+            time.sleep(delay + random.uniform(0, delay / 2))
+            delay = min(delay * 2, 30)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of Supabase connections. Connections are health-checked when
+    they are checked out after sitting idle, broken ones are replaced, and
+    connecting is retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        connect_retries=DB_CONNECT_RETRIES,
+        health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+        connection_factory=PreparingConnection,
+    ):
+        self.connect_retries = connect_retries
+        self.health_check_interval = health_check_interval
+        # psycopg2 pools raise when exhausted; the semaphore makes callers wait instead
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._pool = with_backoff(
+            lambda: ThreadedConnectionPool(
+                min_size, max_size, dsn, connection_factory=connection_factory
+            ),
+            "connect to Supabase DB",
+            connect_retries,
+        )
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if time.monotonic() - connection.last_used < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def _checkout(self):
+        connection = self._pool.getconn()
+        if self._is_healthy(connection):
+            return connection
+        logger.warning("Discarding broken database connection.")
+        self._pool.putconn(connection, close=True)
+        raise psycopg2.OperationalError("pooled connection failed its health check")
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            return with_backoff(
+                self._checkout,
+                "get a healthy database connection",
+                self.connect_retries,
+            )
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, broken=False):
+        connection.last_used = time.monotonic()
+        try:
+            self._pool.putconn(connection, close=broken or bool(connection.closed))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.getconn()
+        broken = False
+        try:
+            yield connection
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.putconn(connection, broken)
+
+    def run(self, func, *args, **kwargs):
+        """Calls func(connection, ...) and retries it on a fresh connection if the link drops."""
+        for attempt in range(1, self.connect_retries + 1):
+            try:
+                with self.connection() as connection:
+                    return func(connection, *args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                if attempt == self.connect_retries:
+                    raise
+                run_metrics.count("retries", source="db")
+                logger.warning(
+                    f"Database connection lost during {func.__name__}: {e}. Retrying."
+                )
+
+    def close(self):
+        self._pool.closeall()
+        logging.info("Database connection pool closed.")
+
+
+def create_db_pool():
     try:
         connection_string = os.getenv("DB_CONNECTION_STRING")
 
@@ -21,19 +193,18 @@ def connect_db():
             logger.error("DB_CONNECTION_STRING environment variable not set.")
             return None
 
-        connection = psycopg2.connect(connection_string.strip())
+        pool = ConnectionPool(connection_string.strip())
 
-        logger.info("Connection to Supabase DB successful")
-        return connection
+        logger.info("Connection pool to Supabase DB ready")
+        return pool
     except Exception as e:
         logger.error(f"Error connecting to Supabase DB: {e}", exc_info=True)
         return None
 
 
-def close_db_connection(connection):
-    if connection:
-        connection.close()
-        logging.info("Database connection closed.")
+def close_db_pool(pool):
+    if pool:
+        pool.close()
 
 
 def fetch_data(connection):
@@ -49,43 +220,49 @@ def fetch_data(connection):
         cursor.close()
         return rows
 
+    except CONNECTION_ERRORS:
+        raise
     except psycopg2.Error as e:
         logging.error(f"Error fetching data: {e}")
         return []
 
 
-def get_last_known_prices_from_db(conn):
+def get_last_known_prices_from_db(conn, snack_ids):
     """
-    Queries the database to get the most recent valid stock price for each snack.
-    This uses a window function to efficiently find the latest record per snack.
+    Queries the database to get the most recent valid stock price for each of
+    the given snacks. DISTINCT ON walks the (snack_id, date) unique index
+    backwards per snack instead of ranking every row in daily_metrics.
     Returns a dictionary mapping snack_id to its last known price.
     """
     last_prices = {}
     query = """
-        SELECT snack_id, stock_close_price
-        FROM (
-            SELECT
-                snack_id,
-                stock_close_price,
-                ROW_NUMBER() OVER(PARTITION BY snack_id ORDER BY date DESC) as rn
-            FROM daily_metrics
-            WHERE stock_close_price IS NOT NULL
-        ) AS ranked_metrics
-        WHERE rn = 1;
+        SELECT DISTINCT ON (snack_id) snack_id, stock_close_price
+        FROM daily_metrics
+        WHERE snack_id = ANY(%s) AND stock_close_price IS NOT NULL
+        ORDER BY snack_id, date DESC;
     """
     try:
         with conn.cursor() as cur:
-            cur.execute(query)
+            cur.execute(query, (list(snack_ids),))
             results = cur.fetchall()
             for row in results:
                 snack_id, price = row
                 last_prices[snack_id] = price
         return last_prices
+    except CONNECTION_ERRORS:
+        raise
     except Exception as e:
         print(f"CRITICAL: Could not fetch last known prices from DB: {e}")
         return {}
 
 
+NEWS_NEGATIVE_QUERY = (
+    "NOT stock NOT shares NOT earnings NOT nasdaq NOT nyse "
+    "NOT racing NOT NASCAR NOT supercross NOT motocross "
+    "NOT UFC NOT esports NOT sponsor"
+)
+
+
 def create_snack_config(db_results):
     snack_config = {}
 
@@ -113,38 +290,288 @@ def create_snack_config(db_results):
 
         # build news query
         positive_query = f"({config['reddit_query']})"
-        negative_query = (
-            "NOT stock NOT shares NOT earnings NOT nasdaq NOT nyse "
-            "NOT racing NOT NASCAR NOT supercross NOT motocross "
-            "NOT UFC NOT esports NOT sponsor"
-        )
-        config["news_query"] = f"{positive_query} {negative_query}"
+        config["news_query"] = f"{positive_query} {NEWS_NEGATIVE_QUERY}"
 
     return snack_config
 
 
+INSERT_MENTION_QUERY = """
+    INSERT INTO snack_mentions (
+        snack_id, source, source_name, content, url, sentiment_score, published_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (url) DO NOTHING;
+"""
+
+BULK_INSERT_MENTIONS_QUERY = """
+    INSERT INTO snack_mentions (
+        snack_id, source, source_name, content, url, sentiment_score, published_at
+    ) VALUES %s
+    ON CONFLICT (url) DO NOTHING
+    RETURNING snack_id, url, sentiment_score, published_at;
+"""
+
+METRICS_COLUMNS = """
+    snack_id, date, google_trends_score, reddit_mention_count, avg_reddit_sentiment,
+    news_article_count, avg_news_sentiment, stock_close_price
+"""
+
+# NULL means the run did not collect that source, so the stored value is kept
+METRICS_CONFLICT_CLAUSE = """
+    ON CONFLICT (snack_id, date) DO UPDATE SET
+        google_trends_score = COALESCE(EXCLUDED.google_trends_score, daily_metrics.google_trends_score),
+        reddit_mention_count = COALESCE(EXCLUDED.reddit_mention_count, daily_metrics.reddit_mention_count),
+        avg_reddit_sentiment = COALESCE(EXCLUDED.avg_reddit_sentiment, daily_metrics.avg_reddit_sentiment),
+        news_article_count = COALESCE(EXCLUDED.news_article_count, daily_metrics.news_article_count),
+        avg_news_sentiment = COALESCE(EXCLUDED.avg_news_sentiment, daily_metrics.avg_news_sentiment),
+        stock_close_price = COALESCE(EXCLUDED.stock_close_price, daily_metrics.stock_close_price)
+"""
+
+UPSERT_METRICS_QUERY = f"""
+    INSERT INTO daily_metrics ({METRICS_COLUMNS})
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    {METRICS_CONFLICT_CLAUSE};
+"""
+
+BULK_UPSERT_METRICS_QUERY = f"""
+    INSERT INTO daily_metrics ({METRICS_COLUMNS})
+    VALUES %s
+    {METRICS_CONFLICT_CLAUSE};
+"""
+
+CREATE_RUN_TABLES_QUERY = """
+    CREATE TABLE IF NOT EXISTS collector_runs (
+        run_date date PRIMARY KEY,
+        window_start_unix bigint NOT NULL,
+        started_at timestamptz NOT NULL DEFAULT now(),
+        completed_at timestamptz
+    );
+    CREATE TABLE IF NOT EXISTS collector_checkpoints (
+        run_date date NOT NULL,
+        snack_id integer NOT NULL,
+        source text NOT NULL,
+        result jsonb,
+        completed_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (run_date, snack_id, source)
+    );
+    CREATE TABLE IF NOT EXISTS collector_watermarks (
+        source text NOT NULL,
+        snack_id integer NOT NULL,
+        watermark timestamptz NOT NULL,
+        run_date date NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (source, snack_id)
+    );
+"""
+
+# One row per (run date, snack, source) for the distributed collector. Workers
+# lease pending units, store the fetch result and the reducer writes the row.
+CREATE_WORK_QUEUE_QUERY = """
+    CREATE TABLE IF NOT EXISTS collector_work_units (
+        run_date date NOT NULL,
+        snack_id integer NOT NULL,
+        source text NOT NULL,
+        status text NOT NULL DEFAULT 'pending',
+        attempts integer NOT NULL DEFAULT 0,
+        leased_by text,
+        lease_expires_at timestamptz,
+        result jsonb,
+        error text,
+        completed_at timestamptz,
+        PRIMARY KEY (run_date, snack_id, source)
+    );
+    CREATE INDEX IF NOT EXISTS collector_work_units_open_idx
+        ON collector_work_units (run_date, source, snack_id)
+        WHERE status IN ('pending', 'leased');
+"""
+
+# One row per snack for the overview endpoints, refreshed from daily_metrics after
+# each run (see snack_summary.py)
+CREATE_SNACK_SUMMARY_QUERY = """
+    CREATE TABLE IF NOT EXISTS snack_summary (
+        snack_id integer PRIMARY KEY REFERENCES snacks (id) ON DELETE CASCADE,
+        latest_date date NOT NULL,
+        google_trends_score integer,
+        reddit_mention_count integer,
+        avg_reddit_sentiment double precision,
+        news_article_count integer,
+        avg_news_sentiment double precision,
+        stock_close_price double precision,
+        previous_date date,
+        previous_trends_score integer,
+        previous_stock_price double precision,
+        trends_change double precision NOT NULL DEFAULT 0,
+        stock_change double precision NOT NULL DEFAULT 0,
+        overall_score double precision NOT NULL DEFAULT 0,
+        window_start date NOT NULL,
+        window_rows integer NOT NULL,
+        window_avg_trends_score double precision,
+        window_reddit_mentions bigint,
+        window_avg_reddit_sentiment double precision,
+        window_news_articles bigint,
+        window_avg_news_sentiment double precision,
+        updated_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS snack_summary_overall_score_idx
+        ON snack_summary (overall_score DESC);
+"""
+
+# Popularity signal vs. stock price correlations per snack (see correlations.py).
+# window_days = 0 rows cover all history and keep the running sums they came from.
+CREATE_CORRELATIONS_QUERY = """
+    CREATE TABLE IF NOT EXISTS snack_correlations (
+        snack_id integer NOT NULL REFERENCES snacks (id) ON DELETE CASCADE,
+        signal text NOT NULL,
+        lag_days integer NOT NULL,
+        window_days integer NOT NULL,
+        as_of date NOT NULL,
+        observations integer NOT NULL,
+        correlation double precision,
+        sum_x double precision,
+        sum_y double precision,
+        sum_xx double precision,
+        sum_yy double precision,
+        sum_xy double precision,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (snack_id, signal, lag_days, window_days)
+    );
+"""
+
+# Fetch times and partial rows of runs with a time budget (see scheduler.py).
+# collector_fetch_costs keeps a moving average per (snack, source); source is
+# e.g. reddit:lite for a source's cheaper variant.
+CREATE_SCHEDULE_TABLES_QUERY = """
+    CREATE TABLE IF NOT EXISTS collector_fetch_costs (
+        snack_id integer NOT NULL,
+        source text NOT NULL,
+        seconds double precision NOT NULL,
+        samples integer NOT NULL DEFAULT 1,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (snack_id, source)
+    );
+    CREATE TABLE IF NOT EXISTS collector_partial_rows (
+        snack_id integer NOT NULL,
+        date date NOT NULL,
+        missing text[] NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (snack_id, date)
+    );
+"""
+
+INSERT_CHECKPOINT_QUERY = """
+    INSERT INTO collector_checkpoints (run_date, snack_id, source, result)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (run_date, snack_id, source) DO UPDATE SET
+        result = EXCLUDED.result,
+        completed_at = now();
+"""
+
+BULK_INSERT_CHECKPOINTS_QUERY = """
+    INSERT INTO collector_checkpoints (run_date, snack_id, source, result)
+    VALUES %s
+    ON CONFLICT (run_date, snack_id, source) DO UPDATE SET
+        result = EXCLUDED.result,
+        completed_at = now();
+"""
+
+# Watermarks only move forward
+UPSERT_WATERMARK_QUERY = """
+    INSERT INTO collector_watermarks (source, snack_id, watermark, run_date)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (source, snack_id) DO UPDATE SET
+        watermark = GREATEST(collector_watermarks.watermark, EXCLUDED.watermark),
+        run_date = GREATEST(collector_watermarks.run_date, EXCLUDED.run_date),
+        updated_at = now();
+"""
+
+BULK_UPSERT_WATERMARKS_QUERY = """
+    INSERT INTO collector_watermarks (source, snack_id, watermark, run_date)
+    VALUES %s
+    ON CONFLICT (source, snack_id) DO UPDATE SET
+        watermark = GREATEST(collector_watermarks.watermark, EXCLUDED.watermark),
+        run_date = GREATEST(collector_watermarks.run_date, EXCLUDED.run_date),
+        updated_at = now();
+"""
+
+# How each kind of buffered row is written. Rows with a key are deduplicated in
+# the buffer (last one wins), which DO UPDATE batches require.
+WRITE_KINDS = {
+    "mentions": {
+        "batch_query": BULK_INSERT_MENTIONS_QUERY,
+        "row_query": INSERT_MENTION_QUERY,
+        "statement": "insert_snack_mention",
+        "key": None,
+        "returning": True,
+    },
+    "metrics": {
+        "batch_query": BULK_UPSERT_METRICS_QUERY,
+        "row_query": UPSERT_METRICS_QUERY,
+        "statement": "upsert_daily_metrics",
+        "key": lambda row: row[:2],
+        "returning": False,
+    },
+    "checkpoints": {
+        "batch_query": BULK_INSERT_CHECKPOINTS_QUERY,
+        "row_query": INSERT_CHECKPOINT_QUERY,
+        "statement": "insert_checkpoint",
+        "key": lambda row: row[:3],
+        "returning": False,
+    },
+    "watermarks": {
+        "batch_query": BULK_UPSERT_WATERMARKS_QUERY,
+        "row_query": UPSERT_WATERMARK_QUERY,
+        "statement": "upsert_watermark",
+        "key": lambda row: row[:2],
+        "returning": False,
+    },
+}
+
+DB_FLUSH_SIZE = int(os.getenv("DB_FLUSH_SIZE", "500"))
+DB_COMMIT_INTERVAL = float(os.getenv("DB_COMMIT_INTERVAL", "30"))
+
+
+def mention_to_row(snack_id, mention):
+    mention["snack_id"] = snack_id
+    mention["content"] = mention.get(
+        "text", ""
+    )  # Safely get 'text' and map it to 'content'
+    return (
+        snack_id,
+        mention.get("source"),
+        mention.get("source_name"),
+        mention["content"],
+        mention.get("url"),
+        mention.get("sentiment_score"),
+        mention.get("published_at"),
+    )
+
+
+def metrics_to_row(metrics):
+    return (
+        metrics["snack_id"],
+        metrics["date"],
+        metrics.get("google_trends_score"),
+        metrics.get("reddit_mention_count"),
+        metrics.get("avg_reddit_sentiment"),
+        metrics.get("news_article_count"),
+        metrics.get("avg_news_sentiment"),
+        metrics.get("stock_close_price"),
+    )
+
+
 def save_mentions_to_db(conn, snack_id, mentions):
     if not mentions:
         return
 
-    insert_query = """
-            INSERT INTO snack_mentions (
-                snack_id, source, source_name, content, url, sentiment_score, published_at
-            ) VALUES (
-                %(snack_id)s, %(source)s, %(source_name)s, %(content)s, %(url)s, %(sentiment_score)s, %(published_at)s
-            )
-            ON CONFLICT (url) DO NOTHING;
-        """
     saved_count = 0
-    with conn.cursor() as cursor:
+    with run_metrics.timer("db_write", source="mentions"), conn.cursor() as cursor:
         for mention in mentions:
             try:
-                mention["snack_id"] = snack_id
-                mention["content"] = mention.get(
-                    "text", ""
-                )  # Safely get 'text' and map it to 'content'
-
-                cursor.execute(insert_query, mention)
+                execute_prepared(
+                    cursor,
+                    "insert_snack_mention",
+                    INSERT_MENTION_QUERY,
+                    mention_to_row(snack_id, mention),
+                )
                 if cursor.rowcount > 0:
                     saved_count += 1
             except Exception as e:
@@ -153,6 +580,7 @@ def save_mentions_to_db(conn, snack_id, mentions):
                 )
 
         conn.commit()
+        run_metrics.count("rows_written", saved_count, table="mentions")
         if saved_count > 0:
             logging.info(
                 f"Successfully inserted {saved_count} new mentions for snack_id {snack_id}."
@@ -160,36 +588,215 @@ def save_mentions_to_db(conn, snack_id, mentions):
 
 
 def save_metrics_to_db(connection, metrics):
-    UPSERT_METRICS_QUERY = """
-        INSERT INTO daily_metrics (
-            snack_id, date, google_trends_score, reddit_mention_count, avg_reddit_sentiment,
-            news_article_count, avg_news_sentiment, stock_close_price
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (snack_id, date) DO UPDATE SET
-            google_trends_score = EXCLUDED.google_trends_score,
-            reddit_mention_count = EXCLUDED.reddit_mention_count,
-            avg_reddit_sentiment = EXCLUDED.avg_reddit_sentiment,
-            news_article_count = EXCLUDED.news_article_count,
-            avg_news_sentiment = EXCLUDED.avg_news_sentiment,
-            stock_close_price = EXCLUDED.stock_close_price;
-        """
     try:
-        cursor = connection.cursor()
-
-        data_to_insert = (
-            metrics["snack_id"],
-            metrics["date"],
-            metrics.get("google_trends_score"),
-            metrics.get("reddit_mention_count"),
-            metrics.get("avg_reddit_sentiment"),
-            metrics.get("news_article_count"),
-            metrics.get("avg_news_sentiment"),
-            metrics.get("stock_close_price"),
-        )
-        cursor.execute(UPSERT_METRICS_QUERY, data_to_insert)
-        connection.commit()
-        cursor.close()
+        with run_metrics.timer("db_write", source="metrics"):
+            cursor = connection.cursor()
+            execute_prepared(
+                cursor,
+                "upsert_daily_metrics",
+                UPSERT_METRICS_QUERY,
+                metrics_to_row(metrics),
+            )
+            connection.commit()
+            cursor.close()
+        run_metrics.count("rows_written", table="metrics")
         logger.info(f"Successfully saved metrics for snack_id: {metrics['snack_id']}")
     except psycopg2.Error as e:
         logger.error(f"Database error: {e}")
         connection.rollback()
+
+
+class BulkWriter:
+    """
+    Buffers mentions, daily metrics and run checkpoints for the whole run and
+    writes them with multi-row INSERT ... ON CONFLICT statements. Each batch runs
+    inside a savepoint; if it fails, its rows are retried one at a time so a
+    single bad row only loses itself. Commits happen every commit_interval
+    seconds and on close(). Batches written since the last commit are kept, so
+    if the pooled connection drops they are replayed on a fresh one. After each
+    commit, on_inserted (if given) is called with the url, sentiment score and
+    publish time of every mention that commit inserted.
+    """
+
+    def __init__(
+        self,
+        pool,
+        flush_size=DB_FLUSH_SIZE,
+        commit_interval=DB_COMMIT_INTERVAL,
+        on_inserted=None,
+    ):
+        self.pool = pool
+        self.on_inserted = on_inserted
+        self.connection = None
+        self.flush_size = max(1, flush_size)
+        self.commit_interval = commit_interval
+        self.buffers = {
+            kind: [] if spec["key"] is None else {}
+            for kind, spec in WRITE_KINDS.items()
+        }
+        self.mention_stats = {}
+        # snack_id -> earliest daily_metrics date written, for the summary rollup
+        self.metrics_written = {}
+        # (kind, rows, returned rows) written since the last commit
+        self.uncommitted = []
+        self.last_commit = time.monotonic()
+
+    def add(self, kind, row):
+        buffer = self.buffers[kind]
+        key = WRITE_KINDS[kind]["key"]
+        if key is None:
+            buffer.append(row)
+        else:
+            buffer[key(row)] = row
+        if len(buffer) >= self.flush_size:
+            self.flush_kind(kind)
+
+    def add_mentions(self, snack_id, mentions):
+        self.mention_stats.setdefault(snack_id, {"inserted": 0, "skipped": 0})
+        for mention in mentions:
+            self.add("mentions", mention_to_row(snack_id, mention))
+
+    def add_metrics(self, metrics):
+        date = str(metrics["date"])
+        earliest = self.metrics_written.get(metrics["snack_id"])
+        if earliest is None or date < earliest:
+            self.metrics_written[metrics["snack_id"]] = date
+        self.add("metrics", metrics_to_row(metrics))
+
+    def add_checkpoint(self, run_date, snack_id, source, result):
+        self.add("checkpoints", (run_date, snack_id, source, Json(result)))
+
+    def add_watermark(self, source, snack_id, watermark, run_date):
+        self.add("watermarks", (source, snack_id, watermark, run_date))
+
+    def _run_batch(self, kind, rows):
+        # Returns the RETURNING rows for the batch (or for the rows that survived)
+        spec = WRITE_KINDS[kind]
+        fetch = spec["returning"]
+
+        with self.connection.cursor() as cursor:
+            cursor.execute("SAVEPOINT bulk_batch")
+            try:
+                returned = execute_values(
+                    cursor,
+                    spec["batch_query"],
+                    rows,
+                    page_size=len(rows),
+                    fetch=fetch,
+                )
+                cursor.execute("RELEASE SAVEPOINT bulk_batch")
+                return returned or []
+            except CONNECTION_ERRORS:
+                raise
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_batch")
+                logger.warning(
+                    f"Batch of {len(rows)} {kind} rows failed ({e}). Retrying rows one at a time."
+                )
+
+            returned = []
+            for row in rows:
+                cursor.execute("SAVEPOINT bulk_row")
+                try:
+                    execute_prepared(cursor, spec["statement"], spec["row_query"], row)
+                    if fetch and cursor.rowcount > 0:
+                        returned.append((row[0], row[4], row[5], row[6]))
+                    cursor.execute("RELEASE SAVEPOINT bulk_row")
+                except CONNECTION_ERRORS:
+                    raise
+                except psycopg2.Error as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT bulk_row")
+                    logger.error(f"Failed to write {kind} row {row[:2]}... : {e}")
+            return returned
+
+    def _with_reconnect(self, action):
+        for attempt in range(1, self.pool.connect_retries + 1):
+            try:
+                if self.connection is None:
+                    self.connection = self.pool.getconn()
+                    # a fresh connection has none of the uncommitted batches yet
+                    for i, (kind, rows, _) in enumerate(self.uncommitted):
+                        self.uncommitted[i] = (kind, rows, self._run_batch(kind, rows))
+                return action()
+            except CONNECTION_ERRORS as e:
+                if self.connection is not None:
+                    self.pool.putconn(self.connection, broken=True)
+                    self.connection = None
+                if attempt == self.pool.connect_retries:
+                    raise
+                run_metrics.count("retries", source="db")
+                logger.warning(
+                    f"Lost database connection ({e}). Replaying {len(self.uncommitted)} uncommitted batches."
+                )
+
+    def flush_kind(self, kind):
+        buffer = self.buffers[kind]
+        if not buffer:
+            return
+
+        rows = list(buffer) if isinstance(buffer, list) else list(buffer.values())
+        self.buffers[kind] = type(buffer)()
+        with run_metrics.timer("db_write", source=kind):
+            returned = self._with_reconnect(lambda: self._run_batch(kind, rows))
+        self.uncommitted.append((kind, rows, returned))
+        if time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def _report(self):
+        for kind, rows, returned in self.uncommitted:
+            if kind == "metrics":
+                logger.info(f"Saved metrics for {len(rows)} snacks.")
+            if kind != "mentions":
+                run_metrics.count("rows_written", len(rows), table=kind)
+                continue
+            run_metrics.count("rows_written", len(returned), table=kind)
+            run_metrics.count("rows_skipped", len(rows) - len(returned), table=kind)
+
+            inserted_per_snack = {}
+            for snack_id, url, sentiment_score, published_at in returned:
+                inserted_per_snack[snack_id] = inserted_per_snack.get(snack_id, 0) + 1
+                if self.on_inserted is not None:
+                    self.on_inserted(url, sentiment_score, published_at)
+            written_per_snack = {}
+            for row in rows:
+                written_per_snack[row[0]] = written_per_snack.get(row[0], 0) + 1
+
+            for snack_id, written in written_per_snack.items():
+                inserted = inserted_per_snack.get(snack_id, 0)
+                stats = self.mention_stats[snack_id]
+                stats["inserted"] += inserted
+                stats["skipped"] += written - inserted
+                logger.info(
+                    f"Inserted {inserted} new mentions for snack_id {snack_id} ({written - inserted} skipped)."
+                )
+
+    def commit(self):
+        if self.connection is not None:
+            with run_metrics.timer("db_commit"):
+                self._with_reconnect(lambda: self.connection.commit())
+            self.pool.putconn(self.connection)
+            self.connection = None
+        self._report()
+        self.uncommitted = []
+        self.last_commit = time.monotonic()
+
+    def flush(self):
+        for kind in WRITE_KINDS:
+            self.flush_kind(kind)
+
+    def close(self):
+        try:
+            self.flush()
+            self.commit()
+        except psycopg2.Error as e:
+            logger.error(f"Database error while flushing bulk writes: {e}")
+            if self.connection is not None:
+                # closing the connection discards the failed transaction
+                self.pool.putconn(self.connection, broken=True)
+                self.connection = None
+            raise
+
+        for snack_id, stats in self.mention_stats.items():
+            logger.debug(
+                f"snack_id {snack_id}: {stats['inserted']} mentions inserted, {stats['skipped']} skipped."
+            )
@@ -0,0 +1,411 @@
+"""
+Runs a collection across any number of workers that share a Postgres work queue:
+
+    python distributed.py enqueue   # once: queues one unit per (snack, source)
+    python distributed.py work      # on as many jobs or machines as wanted
+    python distributed.py reduce    # after the workers: writes daily_metrics
+
+Workers lease units with SELECT ... FOR UPDATE SKIP LOCKED, a source's units a
+batch at a time so Trends, Finnhub and the shared Reddit/combined news modes still
+batch their requests, and store each unit's result in collector_work_units. A
+lease that is not renewed runs out and the unit goes to another worker. The
+reducer writes the row of every snack whose units are all finished (done or out
+of attempts) and closes the run once none are left.
+"""
+
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+# The collector modules read their settings when imported, so .env is loaded first
+load_dotenv()
+
+from checkpoints import (  # noqa: E402
+    COLLECTOR_RUN_DATE,
+    GET_WATERMARKS_QUERY,
+    SHARED_SNACK_ID,
+    RunState,
+)
+from data_collector import (  # noqa: E402
+    NEWS_QUERY_MODE,
+    REDDIT_INGEST_MODE,
+    SEARCH_LIMIT,
+    SOURCE_LIMITS,
+    SUBREDDITS_TO_SEARCH,
+    get_google_trends_scores,
+    get_news_data,
+    get_planned_news_data,
+    get_reddit,
+    get_reddit_data,
+    get_run_window,
+    get_selected_sources,
+    get_shared_reddit_data,
+    get_stock_prices,
+    run_post_stages,
+    save_source_results,
+    timed_fetch,
+    watermark_snack_id,
+)
+from db_utils import (  # noqa: E402
+    BulkWriter,
+    close_db_pool,
+    create_db_pool,
+    get_last_known_prices_from_db,
+)
+from instrumentation import run_metrics  # noqa: E402
+from known_urls import known_urls  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from reddit_ingest import AliasIndex, CommentTreeFetcher  # noqa: E402
+from response_cache import response_cache  # noqa: E402
+from sentiment import sentiment_scorer  # noqa: E402
+from snack_catalog import load_snack_catalog  # noqa: E402
+from work_queue import (  # noqa: E402
+    COLLECTOR_WORKER_ID,
+    LeaseKeeper,
+    claim_units,
+    complete_units,
+    enqueue_run,
+    find_queued_run,
+    get_units,
+)
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+def get_run_units(snack_config, sources):
+    # stocks are only queued for snacks with a ticker, as in a regular run
+    return [
+        (config["snack_id"], source)
+        for config in snack_config.values()
+        for source in sources
+        if source != "stocks" or config.get("stock_ticker")
+    ]
+
+
+def enqueue(db_pool, snack_config, sources):
+    """Queues the run's units and returns its run date."""
+    window = get_run_window()
+    if COLLECTOR_RUN_DATE:
+        window = (window[0], COLLECTOR_RUN_DATE)
+    units = get_run_units(snack_config, sources)
+    _, run_date = db_pool.run(enqueue_run, window, units)
+    logger.info(
+        f"Queued {len(units)} units for {len(snack_config)} snacks for {run_date}."
+    )
+    return run_date
+
+
+def load_watermarks(conn, run_date):
+    with conn.cursor() as cursor:
+        cursor.execute(GET_WATERMARKS_QUERY, (run_date,))
+        watermarks = {
+            (source, snack_id): watermark
+            for source, snack_id, watermark in cursor.fetchall()
+        }
+    conn.commit()
+    return watermarks
+
+
+def fetch_units(source, claimed, run_state, limiter, comment_fetcher):
+    """
+    Fetches one source for the claimed snacks (snack key -> config). Returns
+    snack key -> result in checkpoint form, None when its fetch failed.
+    """
+    if source == "trends":
+        scores = timed_fetch("trends", None, get_google_trends_scores, claimed, limiter)
+        return {
+            snack_name: {"score": scores[snack_name]} if snack_name in scores else None
+            for snack_name in claimed
+        }
+
+    if source == "stocks":
+        stock_tickers = list(
+            dict.fromkeys(config["stock_ticker"] for config in claimed.values())
+        )
+        prices = timed_fetch("stocks", None, get_stock_prices, stock_tickers, limiter)
+        results = {}
+        for snack_name, config in claimed.items():
+            price = (prices or {}).get(config["stock_ticker"])
+            results[snack_name] = {"price": price} if price is not None else None
+        return results
+
+    if source == "reddit" and REDDIT_INGEST_MODE == "shared":
+        summaries = timed_fetch(
+            "reddit",
+            None,
+            get_shared_reddit_data,
+            claimed,
+            SUBREDDITS_TO_SEARCH,
+            run_state.since_unix("reddit", SHARED_SNACK_ID),
+        )
+        return {snack_name: (summaries or {}).get(snack_name) for snack_name in claimed}
+
+    if source == "news" and NEWS_QUERY_MODE == "combined":
+        summaries = timed_fetch(
+            "news",
+            None,
+            get_planned_news_data,
+            claimed,
+            run_state.since_iso("news", SHARED_SNACK_ID),
+            limiter,
+            published_after=run_state.watermark("news", SHARED_SNACK_ID),
+        )
+        return {snack_name: (summaries or {}).get(snack_name) for snack_name in claimed}
+
+    def fetch_one(item):
+        snack_name, config = item
+        snack_id = config["snack_id"]
+        if source == "news":
+            return timed_fetch(
+                "news",
+                snack_name,
+                get_news_data,
+                search_query=config["news_query"],
+                time_filter_iso=run_state.since_iso("news", snack_id),
+                published_after=run_state.watermark("news", snack_id),
+                limiter=limiter,
+            )
+        return timed_fetch(
+            "reddit",
+            snack_name,
+            get_reddit_data,
+            search_query=config["reddit_query"],
+            search_limit=SEARCH_LIMIT,
+            search_terms=config["search_terms"],
+            subreddits_to_search=SUBREDDITS_TO_SEARCH,
+            time_filter_unix=run_state.since_unix("reddit", snack_id),
+            comment_fetcher=comment_fetcher,
+            limiter=limiter,
+        )
+
+    with ThreadPoolExecutor(
+        max_workers=limiter.concurrency, thread_name_prefix=f"collector-{source}"
+    ) as executor:
+        return dict(zip(claimed, executor.map(fetch_one, claimed.items())))
+
+
+def work_source(db_pool, snack_config, source, run_state, comment_fetcher):
+    """Claims and fetches batches of source's units until none are left open."""
+    by_id = {
+        config["snack_id"]: snack_name for snack_name, config in snack_config.items()
+    }
+    limiter = RateLimiter(source, **SOURCE_LIMITS[source])
+    finished = 0
+    while True:
+        snack_ids = db_pool.run(claim_units, run_state.run_date, source)
+        if not snack_ids:
+            return finished
+
+        unknown = [snack_id for snack_id in snack_ids if snack_id not in by_id]
+        if unknown:
+            # queued for a snack this worker's catalog does not have (yet)
+            logger.warning(f"Unknown snack ids in the {source} queue: {unknown}")
+        # in catalog order, so batched sources plan their requests as a regular run does
+        claimed_ids = set(snack_ids)
+        claimed = {
+            snack_name: config
+            for snack_name, config in snack_config.items()
+            if config["snack_id"] in claimed_ids
+        }
+        results = fetch_units(source, claimed, run_state, limiter, comment_fetcher)
+        by_snack_id = {snack_id: None for snack_id in unknown}
+        by_snack_id.update(
+            (claimed[snack_name]["snack_id"], result)
+            for snack_name, result in results.items()
+        )
+        lost = db_pool.run(complete_units, run_state.run_date, source, by_snack_id)
+        if lost:
+            logger.warning(
+                f"Lost the lease on {len(lost)} {source} units before finishing them: {lost}"
+            )
+        finished += len(by_snack_id) - len(lost)
+        logger.info(f"Finished {len(by_snack_id) - len(lost)} {source} units.")
+
+
+def work(db_pool, snack_config, sources, run_date=COLLECTOR_RUN_DATE):
+    """
+    Works the queue of run_date (default: the newest unfinished queued run) until
+    no unit of the selected sources is left to claim. Each source is claimed on
+    its own thread. Returns the number of units this worker finished.
+    """
+    window = db_pool.run(find_queued_run, run_date)
+    if window is None:
+        logger.error("No queued run found. Run `python distributed.py enqueue` first.")
+        return 0
+
+    run_state = RunState(db_pool, enabled=False).start(window)
+    run_state.watermarks = db_pool.run(load_watermarks, run_state.run_date)
+    # mentions an earlier run stored keep their score instead of being scored again
+    db_pool.run(known_urls.refresh)
+    logger.info(
+        f"Worker {COLLECTOR_WORKER_ID} working the queue for {run_state.run_date}."
+    )
+
+    alias_index = getattr(snack_config, "alias_index", None) or AliasIndex(snack_config)
+    comment_fetcher = CommentTreeFetcher(
+        alias_index.matcher,
+        reddit=get_reddit() if "reddit" in sources else None,
+        cache=response_cache,
+    )
+    try:
+        with LeaseKeeper(db_pool, run_state.run_date), ThreadPoolExecutor(
+            max_workers=len(sources), thread_name_prefix="collector-worker"
+        ) as executor:
+            futures = [
+                executor.submit(
+                    work_source,
+                    db_pool,
+                    snack_config,
+                    source,
+                    run_state,
+                    comment_fetcher,
+                )
+                for source in sources
+            ]
+            finished = sum(future.result() for future in futures)
+    finally:
+        comment_fetcher.close()
+
+    logger.info(f"Worker {COLLECTOR_WORKER_ID} finished {finished} units.")
+    return finished
+
+
+def reduce_run(db_pool, snack_config, run_date=COLLECTOR_RUN_DATE):
+    """
+    Writes the daily_metrics row (and mentions) of every snack whose units are all
+    finished, from the stored results. Failed units get the same fallbacks as a
+    regular run. Once every snack is written the watermarks advance and the run
+    is marked complete. Returns the number of snacks still waiting on units.
+    """
+    window = db_pool.run(find_queued_run, run_date)
+    if window is None:
+        logger.error("No queued run found to reduce.")
+        return 0
+    run_date = window[1]
+    units = db_pool.run(get_units, run_date)
+
+    by_id = {
+        config["snack_id"]: snack_name for snack_name, config in snack_config.items()
+    }
+    finished = {}
+    waiting = 0
+    for snack_id, snack_units in units.items():
+        if snack_id not in by_id:
+            logger.warning(f"Skipping queued snack_id {snack_id}, not in the catalog.")
+        elif all(status in FINISHED_STATUSES for status, _ in snack_units.values()):
+            finished[by_id[snack_id]] = snack_units
+        else:
+            waiting += 1
+
+    missing_price_ids = [
+        snack_config[snack_name]["snack_id"]
+        for snack_name, snack_units in finished.items()
+        if snack_units.get("stocks", ("done",))[0] == "failed"
+    ]
+    last_prices_map = {}
+    if missing_price_ids:
+        last_prices_map = db_pool.run(get_last_known_prices_from_db, missing_price_ids)
+
+    # the enqueue step registered the run; only its watermarks and completion are left
+    run_state = RunState(db_pool, enabled=False).start(window)
+    run_state.enabled = True
+    db_pool.run(known_urls.refresh)
+    writer = BulkWriter(db_pool, on_inserted=known_urls.add)
+    try:
+        for snack_name, config in snack_config.items():
+            if snack_name not in finished:
+                continue
+            snack_units = finished[snack_name]
+            results = {
+                source: result if status == "done" else None
+                for source, (status, result) in snack_units.items()
+            }
+            for source in ("reddit", "news"):
+                if results.get(source) is not None:
+                    run_state.advance(
+                        source,
+                        watermark_snack_id(source, config["snack_id"]),
+                        results[source]["latest"],
+                    )
+            save_source_results(
+                writer,
+                snack_name,
+                config,
+                run_date,
+                results,
+                tuple(snack_units),
+                last_prices_map,
+            )
+        if waiting:
+            logger.info(
+                f"Reduced {len(finished)} snacks for {run_date}; {waiting} still have open units."
+            )
+        else:
+            run_state.finish(writer)
+        writer.flush()
+        writer.commit()
+        run_post_stages(db_pool, writer.metrics_written)
+    finally:
+        writer.close()
+    return waiting
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=("enqueue", "work", "reduce"))
+    parser.add_argument(
+        "--wait",
+        type=float,
+        default=0,
+        help="reduce: seconds to keep retrying while units are still open",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args(argv)
+    db_pool = create_db_pool()
+    if not db_pool:
+        return 1
+    try:
+        snack_config = db_pool.run(load_snack_catalog)
+        sources = get_selected_sources()
+
+        if args.command == "enqueue":
+            # printed for the workflow to hand to the worker and reduce jobs
+            print(enqueue(db_pool, snack_config, sources))
+            return 0
+
+        if args.command == "work":
+            run_metrics.start()
+            succeeded = False
+            try:
+                work(db_pool, snack_config, sources)
+                succeeded = True
+            finally:
+                run_metrics.finish(succeeded)
+            return 0
+
+        deadline = time.monotonic() + args.wait
+        while True:
+            waiting = reduce_run(db_pool, snack_config)
+            if not waiting or time.monotonic() >= deadline:
+                return 1 if waiting else 0
+            time.sleep(min(30, max(0, deadline - time.monotonic())))
+    finally:
+        sentiment_scorer.close()
+        response_cache.close()
+        close_db_pool(db_pool)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""
+Exports daily_metrics and snack_mentions to a local columnar snapshot, so
+analysis can scan years of history without querying the production database:
+
+    python export.py --path snapshot/
+
+Tables are written as hive-style month partitions (daily_metrics/month=2025-01/
+part-0.arrow), in Arrow IPC files that can be memory-mapped, or in Parquet. Each
+export only adds what changed since the last one, as recorded in the snapshot's
+_manifest.json: snack_mentions rows are never updated, so new ids are appended
+as new part files, and ids missing just below the newest one are looked up
+again next time, in case their transaction had not committed yet. daily_metrics
+rows are upserted, so the months from the last exported day (or from the
+earliest day a run wrote) on are written again. Rows are read with COPY ... TO
+STDOUT in CSV rather than fetched row by row.
+
+    import pyarrow.dataset as ds
+    metrics = ds.dataset("snapshot/daily_metrics", format="arrow", partitioning="hive")
+"""
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# Run as a script, .env is loaded before the settings below are read; the
+# collector imports this module after main.py has loaded it
+if __name__ == "__main__":
+    load_dotenv()
+
+from db_utils import close_db_pool, create_db_pool  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# Snapshot directory the collector appends to after each run; empty to skip
+EXPORT_PATH = os.getenv("EXPORT_PATH", "")
+# "arrow" (uncompressed Arrow IPC, zero-copy when memory-mapped) or "parquet"
+EXPORT_FORMAT = os.getenv("EXPORT_FORMAT", "arrow").strip().lower()
+# snack_mentions ids read per COPY, which bounds the memory an export needs
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "200000"))
+# Ids missing this close below the newest exported mention are read again by later
+# exports: a transaction that took them may not have committed yet
+EXPORT_ID_WINDOW = int(os.getenv("EXPORT_ID_WINDOW", "50000"))
+
+EXPORT_FORMATS = {"arrow": "arrow", "parquet": "parquet"}
+MANIFEST_NAME = "_manifest.json"
+# partition of mentions without a publish time
+UNKNOWN_MONTH = "unknown"
+
+# The type of each exported column; anything the CSV does not say is NULL
+METRICS_COLUMNS = {
+    "snack_id": "int32",
+    "date": "date32",
+    "google_trends_score": "int32",
+    "reddit_mention_count": "int32",
+    "avg_reddit_sentiment": "float64",
+    "news_article_count": "int32",
+    "avg_news_sentiment": "float64",
+    "stock_close_price": "float64",
+}
+
+MENTIONS_COLUMNS = {
+    "id": "int64",
+    "snack_id": "int32",
+    "source": "string",
+    "source_name": "string",
+    "content": "string",
+    "url": "string",
+    "sentiment_score": "float64",
+    "published_at": "timestamp[us]",
+}
+
+COPY_METRICS_QUERY = f"""
+    COPY (
+        SELECT {", ".join(METRICS_COLUMNS)}
+        FROM daily_metrics
+        WHERE date >= %s
+        ORDER BY date, snack_id
+    ) TO STDOUT WITH (FORMAT csv, HEADER true)
+"""
+
+# published_at is sent as UTC without an offset and marked as UTC after parsing
+COPY_MENTIONS_QUERY = """
+    COPY (
+        SELECT id, snack_id, source, source_name, content, url, sentiment_score,
+               published_at AT TIME ZONE 'UTC' AS published_at
+        FROM snack_mentions
+        WHERE id > %s AND id <= %s
+        ORDER BY id
+    ) TO STDOUT WITH (FORMAT csv, HEADER true)
+"""
+
+# The rows that have filled in id gaps left by earlier exports
+COPY_LATE_MENTIONS_QUERY = """
+    COPY (
+        SELECT id, snack_id, source, source_name, content, url, sentiment_score,
+               published_at AT TIME ZONE 'UTC' AS published_at
+        FROM snack_mentions m
+        JOIN unnest(%s::bigint[], %s::bigint[]) AS g (first_id, last_id)
+            ON m.id BETWEEN g.first_id AND g.last_id
+        ORDER BY id
+    ) TO STDOUT WITH (FORMAT csv, HEADER true)
+"""
+
+GET_FIRST_METRICS_DATE_QUERY = "SELECT min(date) FROM daily_metrics;"
+GET_LAST_MENTION_ID_QUERY = "SELECT COALESCE(max(id), 0) FROM snack_mentions;"
+
+
+def copy_to_table(cursor, query, params, columns):
+    """Runs a COPY ... TO STDOUT query and parses the CSV into an Arrow table."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    buffer = io.BytesIO()
+    cursor.copy_expert(cursor.mogrify(query, params).decode(), buffer)
+    buffer.seek(0)
+    return pa_csv.read_csv(
+        buffer,
+        # Postgres quotes values with line breaks, which mention content often has
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={
+                name: pa.type_for_alias(kind) for name, kind in columns.items()
+            },
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+        ),
+    )
+
+
+def month_of(dates):
+    """The partition key (YYYY-MM) of each value in a date or timestamp column."""
+    import pyarrow.compute as pc
+
+    months = pc.strftime(dates, format="%Y-%m")
+    return pc.fill_null(months, UNKNOWN_MONTH)
+
+
+def write_partition(table, path, name, export_format):
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    os.makedirs(path, exist_ok=True)
+    file_path = os.path.join(path, f"{name}.{EXPORT_FORMATS[export_format]}")
+    temp_path = f"{file_path}.tmp"
+    if export_format == "parquet":
+        pq.write_table(table, temp_path)
+    else:
+        feather.write_feather(table, temp_path, compression="uncompressed")
+    os.replace(temp_path, file_path)
+
+
+def split_by_month(table, column):
+    import pyarrow.compute as pc
+
+    months = month_of(table[column])
+    for month in sorted(pc.unique(months).to_pylist()):
+        yield month, table.filter(pc.equal(months, month))
+
+
+def read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def export_metrics(cursor, path, since, export_format):
+    """
+    Writes every daily_metrics month from since's month on. Returns the rows
+    written and the last day among them.
+    """
+    import pyarrow.compute as pc
+
+    month_start = datetime.date.fromisoformat(str(since)[:10]).replace(day=1)
+    table = copy_to_table(cursor, COPY_METRICS_QUERY, (month_start,), METRICS_COLUMNS)
+    for month, rows in split_by_month(table, "date"):
+        write_partition(
+            rows,
+            os.path.join(path, "daily_metrics", f"month={month}"),
+            "part-0",
+            export_format,
+        )
+    return table.num_rows, pc.max(table["date"]).as_py()
+
+
+def find_gaps(ids, after_id, until_id):
+    """The id ranges in (after_id, until_id] missing from ids (ascending), as [first, last]."""
+    import numpy as np
+
+    bounds = np.concatenate(
+        ([after_id], np.asarray(ids, dtype=np.int64), [until_id + 1])
+    )
+    return [
+        [int(bounds[i]) + 1, int(bounds[i + 1]) - 1]
+        for i in np.flatnonzero(np.diff(bounds) > 1)
+    ]
+
+
+def write_mentions(table, path, name, export_format):
+    import pyarrow.compute as pc
+
+    table = table.set_column(
+        table.schema.get_field_index("published_at"),
+        "published_at",
+        pc.assume_timezone(table["published_at"], "UTC"),
+    )
+    for month, rows in split_by_month(table, "published_at"):
+        write_partition(
+            rows,
+            os.path.join(path, "snack_mentions", f"month={month}"),
+            name,
+            export_format,
+        )
+
+
+def export_mentions(cursor, path, after_id, last_id, export_format, chunk_rows, window):
+    """
+    Appends the snack_mentions rows with after_id < id <= last_id as new part
+    files, named after the first id they could hold. Returns the rows written
+    and the id gaps among the last window ids.
+    """
+    written, gaps = 0, []
+    while after_id < last_id:
+        until_id = min(after_id + chunk_rows, last_id)
+        table = copy_to_table(
+            cursor, COPY_MENTIONS_QUERY, (after_id, until_id), MENTIONS_COLUMNS
+        )
+        write_mentions(table, path, f"part-{after_id + 1:012d}", export_format)
+        if until_id > last_id - window:
+            gaps += find_gaps(table["id"].to_numpy(), after_id, until_id)
+        written += table.num_rows
+        after_id = until_id
+    return written, gaps
+
+
+def export_late_mentions(cursor, path, gaps, export_format):
+    """
+    Appends the rows that have filled in id gaps since earlier exports, such as
+    those of a backfill shard that committed later. Returns the rows written and
+    the gaps still open.
+    """
+    if not gaps:
+        return 0, []
+    table = copy_to_table(
+        cursor,
+        COPY_LATE_MENTIONS_QUERY,
+        ([first_id for first_id, _ in gaps], [last_id for _, last_id in gaps]),
+        MENTIONS_COLUMNS,
+    )
+    if not table.num_rows:
+        return 0, gaps
+    found = table["id"].to_numpy()
+    # named after the first late id, which leaves the gaps and so starts no other part
+    write_mentions(table, path, f"part-{found[0]:012d}-late", export_format)
+    open_gaps = []
+    for first_id, last_id in gaps:
+        inside = found[(found >= first_id) & (found <= last_id)]
+        open_gaps += find_gaps(inside, first_id - 1, last_id)
+    return table.num_rows, open_gaps
+
+
+def export_snapshot(
+    conn,
+    path=EXPORT_PATH,
+    since=None,
+    export_format=EXPORT_FORMAT,
+    chunk_rows=EXPORT_CHUNK_ROWS,
+    window=EXPORT_ID_WINDOW,
+):
+    """
+    Brings the snapshot at path up to date. daily_metrics is written again from
+    the month of since (e.g. the earliest day a run wrote), or else from the last
+    exported day's month; a new snapshot starts with everything. Returns
+    (metrics rows, mention rows) written.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {export_format!r}; use arrow or parquet."
+        )
+    manifest = read_manifest(path)
+    if manifest.get("format", export_format) != export_format:
+        raise ValueError(
+            f"{path} already holds a {manifest['format']} snapshot; "
+            f"write the {export_format} export to another directory."
+        )
+    metrics = manifest.get("daily_metrics", {})
+    with conn.cursor() as cursor:
+        if metrics.get("exported_through"):
+            start = min(
+                str(day)[:10] for day in (since, metrics["exported_through"]) if day
+            )
+        else:
+            cursor.execute(GET_FIRST_METRICS_DATE_QUERY)
+            start = cursor.fetchone()[0]
+        metrics_rows, exported_through = 0, None
+        if start is not None:
+            metrics_rows, exported_through = export_metrics(
+                cursor, path, start, export_format
+            )
+
+        mentions = manifest.get("snack_mentions", {})
+        late_rows, gaps = export_late_mentions(
+            cursor, path, mentions.get("gaps", []), export_format
+        )
+        cursor.execute(GET_LAST_MENTION_ID_QUERY)
+        after_id = mentions.get("last_id", 0)
+        last_id = max(cursor.fetchone()[0], after_id)
+        mention_rows, new_gaps = export_mentions(
+            cursor, path, after_id, last_id, export_format, chunk_rows, window
+        )
+        mention_rows += late_rows
+    conn.commit()
+    # older gaps are ids that were rolled back or used up by ON CONFLICT DO NOTHING
+    gaps = [
+        [max(first_id, last_id - window + 1), gap_last_id]
+        for first_id, gap_last_id in gaps + new_gaps
+        if gap_last_id > last_id - window
+    ]
+
+    # written last, so an interrupted export is simply repeated
+    write_manifest(
+        path,
+        {
+            "format": export_format,
+            "daily_metrics": {
+                "exported_through": (
+                    str(exported_through)
+                    if exported_through
+                    else metrics.get("exported_through")
+                )
+            },
+            "snack_mentions": {"last_id": last_id, "gaps": gaps},
+            "exported_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+    )
+    logger.info(
+        f"Exported {metrics_rows} daily_metrics rows and {mention_rows} new mentions to {path}."
+    )
+    return metrics_rows, mention_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--path",
+        default=EXPORT_PATH or "snapshot",
+        help="snapshot directory (default: EXPORT_PATH or ./snapshot)",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.date.fromisoformat,
+        help="YYYY-MM-DD; write daily_metrics again from this day's month, e.g. after a backfill",
+    )
+    parser.add_argument(
+        "--format", choices=sorted(EXPORT_FORMATS), default=EXPORT_FORMAT
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args(argv)
+    db_pool = create_db_pool()
+    if not db_pool:
+        return 1
+    try:
+        db_pool.run(export_snapshot, args.path, args.since, args.format)
+        return 0
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        close_db_pool(db_pool)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
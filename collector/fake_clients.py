@@ -0,0 +1,295 @@
+import datetime
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+
+import pandas as pd
+from pytrends.exceptions import TooManyRequestsError
+
+# Stand-ins for the praw, NewsAPI, pytrends and Finnhub clients, used by the
+# offline benchmark. Every client serves deterministic synthetic data built from
+# the terms in the request, sleeps for a configurable latency and can be told to
+# answer a share of calls with a 429.
+
+QUOTED_TERM_PATTERN = re.compile(r'"([^"]+)"')
+
+FILLER_WORDS = (
+    "honestly tried the new bag of and it was way better than expected worst "
+    "thing I have eaten this week store near me finally restocked love hate meh"
+).split()
+SNACK_WORDS = "flavor snack taste chips soda grocery price recipe".split()
+SPONSOR_WORDS = ["nascar", "sponsor", "playoff", "race car", "quarterback"]
+
+
+class RateLimitedError(Exception):
+    """What a stand-in raises when it injects a 429."""
+
+
+class SourceStats:
+    """Thread-safe per-source counters of calls and injected 429s."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, source, rate_limited=False):
+        with self.lock:
+            self.calls[source] += 1
+            if rate_limited:
+                self.rate_limited[source] += 1
+
+
+class FakeSource:
+    """Shared latency, 429 injection and text generation for the stand-in clients."""
+
+    def __init__(self, source, stats, latency=0.0, rate_limit_ratio=0.0, seed=0):
+        self.source = source
+        self.stats = stats
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def call(self, error=RateLimitedError):
+        with self.rng_lock:
+            rate_limited = self.rng.random() < self.rate_limit_ratio
+        self.stats.record(self.source, rate_limited)
+        if self.latency:
+            time.sleep(self.latency)
+        if rate_limited:
+            raise error(f"{self.source} returned a response with code 429")
+
+    def text(self, rng, term=None):
+        words = rng.sample(FILLER_WORDS, 8)
+        if term:
+            words.insert(rng.randrange(len(words)), term)
+        if rng.random() < 0.5:
+            words.append(rng.choice(SNACK_WORDS))
+        if rng.random() < 0.1:
+            words.append(rng.choice(SPONSOR_WORDS))
+        return " ".join(words)
+
+
+class FakeComment:
+    def __init__(self, comment_id, body, subreddit, created_utc):
+        self.id = comment_id
+        self.body = body
+        self.subreddit = subreddit
+        self.permalink = f"/r/{subreddit.display_name}/comments/{comment_id}"
+        self.created_utc = created_utc
+        self.replies = []
+
+
+class FakeSubmission:
+    """A submission whose comment tree is only built (and billed) when it is read."""
+
+    def __init__(self, reddit, submission_id, title, selftext, subreddit, created_utc):
+        self.reddit = reddit
+        self.id = submission_id
+        self.title = title
+        self.selftext = selftext
+        self.subreddit = subreddit
+        self.permalink = f"/r/{subreddit.display_name}/comments/{submission_id}"
+        self.created_utc = created_utc
+        self._comments = None
+
+    @property
+    def comments(self):
+        if self._comments is None:
+            self._comments = self.reddit.build_comment_tree(self)
+        return self._comments
+
+
+class FakeSubreddit:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+        self.display_name = name.split("+")[0]
+
+    def search(self, query, limit=None, sort=None):
+        self.reddit.call()
+        rng = random.Random(f"{self.reddit.seed}:search:{query}")
+        terms = QUOTED_TERM_PATTERN.findall(query) or [query]
+        submissions = []
+        for i in range(min(limit or 100, self.reddit.posts_per_search)):
+            submissions.append(
+                self.reddit.submission_for(
+                    f"{zlib.crc32(f'{query}:{i}'.encode()):x}",
+                    rng,
+                    rng.choice(terms),
+                    self,
+                    self.reddit.now - i * 600,
+                )
+            )
+        return submissions
+
+    def new(self, limit=None):
+        self.reddit.call()
+        rng = random.Random(f"{self.reddit.seed}:new:{self.name}")
+        for i in range(self.reddit.listing_size):
+            term = rng.choice(self.reddit.terms) if rng.random() < 0.3 else None
+            yield self.reddit.submission_for(
+                f"{self.name}n{i}", rng, term, self, self.reddit.now - i * 60
+            )
+
+    def comments(self, limit=None):
+        self.reddit.call()
+        rng = random.Random(f"{self.reddit.seed}:comments:{self.name}")
+        for i in range(self.reddit.listing_size):
+            term = rng.choice(self.reddit.terms) if rng.random() < 0.3 else None
+            yield FakeComment(
+                f"{self.name}c{i}",
+                self.reddit.text(rng, term),
+                self,
+                self.reddit.now - i * 30,
+            )
+
+
+class FakeReddit(FakeSource):
+    """Stands in for praw.Reddit: subreddit search, new posts, new comments and comment trees."""
+
+    def __init__(
+        self,
+        stats,
+        terms,
+        posts_per_search=20,
+        comments_per_post=50,
+        listing_size=1000,
+        **kwargs,
+    ):
+        super().__init__("reddit", stats, **kwargs)
+        self.terms = list(terms)
+        self.posts_per_search = posts_per_search
+        self.comments_per_post = comments_per_post
+        self.listing_size = listing_size
+        self.now = time.time()
+        self.submissions = {}
+
+    def subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+    def submission(self, id):
+        return self.submissions[id]
+
+    def submission_for(self, submission_id, rng, term, subreddit, created_utc):
+        submission = FakeSubmission(
+            self,
+            submission_id,
+            self.text(rng, term),
+            self.text(rng),
+            subreddit,
+            created_utc,
+        )
+        self.submissions[submission_id] = submission
+        return submission
+
+    def build_comment_tree(self, submission):
+        self.call()
+        rng = random.Random(f"{self.seed}:tree:{submission.id}")
+        top_level = []
+        comments = []
+        for i in range(self.comments_per_post):
+            term = rng.choice(self.terms) if rng.random() < 0.2 else None
+            comment = FakeComment(
+                f"{submission.id}c{i}",
+                self.text(rng, term),
+                submission.subreddit,
+                submission.created_utc + i,
+            )
+            # roughly a third of the comments are replies to an earlier one
+            if comments and rng.random() < 0.3:
+                rng.choice(comments).replies.append(comment)
+            else:
+                top_level.append(comment)
+            comments.append(comment)
+        return top_level
+
+
+class FakeNewsApi(FakeSource):
+    """Stands in for NewsApiClient.get_everything, with paging."""
+
+    def __init__(self, stats, articles_per_query=40, **kwargs):
+        super().__init__("news", stats, **kwargs)
+        self.articles_per_query = articles_per_query
+
+    def get_everything(self, q, from_param=None, language=None, sort_by=None, **kwargs):
+        self.call()
+        page_size = kwargs.get("page_size") or 100
+        page = kwargs.get("page") or 1
+        rng = random.Random(f"{self.seed}:news:{q}:{page}")
+        terms = QUOTED_TERM_PATTERN.findall(q) or [q]
+        total = self.articles_per_query * max(1, len(terms) // 2)
+        published = datetime.datetime.now(datetime.timezone.utc)
+
+        articles = []
+        for i in range((page - 1) * page_size, min(total, page * page_size)):
+            term = rng.choice(terms)
+            articles.append(
+                {
+                    "source": {"id": None, "name": f"Outlet {i % 17}"},
+                    "title": self.text(rng, term),
+                    "description": self.text(rng),
+                    "content": self.text(rng, term),
+                    "url": f"https://news.example/{zlib.crc32(f'{q}:{i}'.encode()):x}",
+                    "publishedAt": (published - datetime.timedelta(minutes=i)).strftime(
+                        "%Y-%m-%dT%H:%M:%SZ"
+                    ),
+                }
+            )
+        return {"status": "ok", "totalResults": total, "articles": articles}
+
+
+class FakeTrendReq(FakeSource):
+    """Stands in for pytrends' TrendReq: build_payload then interest_over_time."""
+
+    def __init__(self, stats=None, **kwargs):
+        # TrendReq(hl=..., tz=...) is accepted too, so it can be swapped in before import
+        source_kwargs = {
+            key: kwargs[key]
+            for key in ("latency", "rate_limit_ratio", "seed")
+            if key in kwargs
+        }
+        super().__init__("trends", stats or SourceStats(), **source_kwargs)
+        self.kw_list = []
+
+    def build_payload(self, kw_list, cat=0, timeframe=None, **kwargs):
+        self.kw_list = list(kw_list)
+
+    def interest_over_time(self):
+        self.call(
+            lambda message: TooManyRequestsError(
+                f"The request failed: Google returned a response with code 429 ({message})",
+                None,
+            )
+        )
+        index = pd.date_range(end=pd.Timestamp.now().floor("h"), periods=24, freq="h")
+        data = {}
+        for keyword in self.kw_list:
+            rng = random.Random(f"{self.seed}:trends:{keyword}")
+            data[keyword] = [rng.randint(0, 100) for _ in index]
+        data["isPartial"] = [False] * (len(index) - 1) + [True]
+        return pd.DataFrame(data, index=index)
+
+
+class FakeFinnhub(FakeSource):
+    """Stands in for finnhub.Client.quote."""
+
+    def __init__(self, stats, **kwargs):
+        super().__init__("stocks", stats, **kwargs)
+
+    def quote(self, symbol):
+        self.call()
+        rng = random.Random(f"{self.seed}:quote:{symbol}")
+        close = round(rng.uniform(10, 300), 2)
+        return {
+            "c": close,
+            "h": close * 1.01,
+            "l": close * 0.99,
+            "o": close,
+            "pc": close,
+        }
@@ -0,0 +1,193 @@
+import logging
+import os
+from io import StringIO
+
+from instrumentation import run_metrics
+from pytrends.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+# Google Trends compares at most five keywords per payload; one slot goes to the anchor.
+MAX_KEYWORDS_PER_PAYLOAD = 5
+TRENDS_CATEGORY = 71  # Food & Drink
+TRENDS_TIMEFRAME = "now 1-d"
+TRENDS_ANCHOR_TERM = os.getenv("TRENDS_ANCHOR_TERM", "snacks").strip()
+# Every batch is rescaled so the anchor term reads as this value.
+TRENDS_ANCHOR_SCORE = 100
+
+
+def build_trends_keyword(search_terms):
+    # Google Trends treats "a + b" as a single OR keyword, so aliases share one slot
+    return " + ".join(search_terms[:MAX_KEYWORDS_PER_PAYLOAD])
+
+
+class TrendsBatcher:
+    """
+    Scores many snacks with as few Trends requests as possible. Each payload holds
+    the anchor term plus up to four snacks, and every batch is rescaled against the
+    anchor so scores from different batches can be compared. Interest-over-time
+    frames are kept for the life of the batcher, so a second call only requests
+    the batches that failed. Requests go through the limiter, which paces them and
+    retries 429s; an optional ResponseCache keeps frames between runs.
+    """
+
+    def __init__(
+        self,
+        client,
+        anchor_term=TRENDS_ANCHOR_TERM,
+        timeframe=TRENDS_TIMEFRAME,
+        category=TRENDS_CATEGORY,
+        limiter=None,
+        cache=None,
+    ):
+        self.client = client
+        self.anchor_term = anchor_term
+        self.timeframe = timeframe
+        self.category = category
+        self.limiter = limiter
+        self.cache = cache
+        self.frames = {}
+        self.request_count = 0
+
+    def build_batches(self, keywords):
+        unique_keywords = list(
+            dict.fromkeys(kw for kw in keywords if kw and kw != self.anchor_term)
+        )
+        batch_size = MAX_KEYWORDS_PER_PAYLOAD - 1
+        return [
+            tuple(unique_keywords[i : i + batch_size])
+            for i in range(0, len(unique_keywords), batch_size)
+        ]
+
+    def _request(self, kw_list):
+        self.request_count += 1
+        run_metrics.count("api_calls", source="trends")
+        with run_metrics.timer("api_request", source="trends"):
+            self.client.build_payload(
+                kw_list=kw_list, cat=self.category, timeframe=self.timeframe
+            )
+            return self.client.interest_over_time()
+
+    def fetch_frame(self, batch):
+        if batch in self.frames:
+            return self.frames[batch]
+
+        kw_list = [self.anchor_term, *batch]
+        logger.debug(f"Requesting Google Trends data for: {kw_list}")
+
+        def download():
+            if self.limiter:
+                return self.limiter.call(self._request, kw_list)
+            return self._request(kw_list)
+
+        if self.cache is not None and self.cache.enabled:
+            params = {
+                "kw_list": kw_list,
+                "cat": self.category,
+                "timeframe": self.timeframe,
+            }
+            # pandas is only loaded on the Trends path
+            import pandas as pd
+
+            payload = self.cache.call(
+                "trends",
+                params,
+                lambda: download().to_json(orient="split", date_format="iso"),
+            )
+            data = pd.read_json(StringIO(payload), orient="split")
+        else:
+            data = download()
+
+        if "isPartial" in data.columns:
+            data = data.drop(columns=["isPartial"])
+        self.frames[batch] = data
+        return data
+
+    def fetch_frames(self, batches):
+        # a batch that still fails after the limiter's retries is left out
+        for batch in batches:
+            if batch in self.frames:
+                continue
+            try:
+                self.fetch_frame(batch)
+            except ResponseError as e:
+                logger.error(
+                    f"Failed to fetch Google Trends data for '{list(batch)}': {e}"
+                )
+            except Exception as e:
+                logger.error(f"An unexpected error occurred for terms '{batch}': {e}")
+
+    def scale_batch(self, batch):
+        data = self.frames.get(batch)
+        if data is None or data.empty:
+            return {}
+
+        import pandas as pd
+
+        last_row = data.iloc[-1]
+        anchor_value = last_row.get(self.anchor_term)
+        if pd.isna(anchor_value) or anchor_value == 0:
+            logger.warning(
+                f"Anchor '{self.anchor_term}' has no interest in batch {list(batch)}; using unscaled scores."
+            )
+            factor = 1.0
+        else:
+            factor = TRENDS_ANCHOR_SCORE / anchor_value
+
+        scores = {}
+        for keyword in batch:
+            value = last_row.get(keyword)
+            scores[keyword] = 0 if pd.isna(value) else int(value * factor)
+        return scores
+
+    def scale_daily(self, batch):
+        """
+        Like scale_batch, but for every row of a multi-day frame: each row is
+        rescaled against the anchor at that time, then rows are averaged per day
+        (Trends returns hourly rows for ranges under a week).
+        """
+        data = self.frames.get(batch)
+        if data is None or data.empty or self.anchor_term not in data.columns:
+            return {}
+
+        anchor = data[self.anchor_term]
+        # rows where the anchor has no interest are left unscaled, as in scale_batch
+        factors = (TRENDS_ANCHOR_SCORE / anchor.where(anchor > 0)).fillna(1.0)
+        columns = [keyword for keyword in batch if keyword in data.columns]
+        scaled = data[columns].mul(factors, axis=0).fillna(0)
+        daily = scaled.groupby(scaled.index.strftime("%Y-%m-%d")).mean()
+        return {
+            keyword: {day: int(value) for day, value in daily[keyword].items()}
+            for keyword in columns
+        }
+
+    def get_daily_scores(self, keywords):
+        """
+        Returns keyword -> {ISO date -> anchor-scaled score} for the batcher's
+        timeframe (e.g. "2025-01-01 2025-01-31"), one request per batch.
+        """
+        batches = self.build_batches(keywords)
+        self.fetch_frames(batches)
+
+        scores = {}
+        for batch in batches:
+            if batch in self.frames:
+                scores.update(self.scale_daily(batch))
+        return {keyword: scores[keyword] for keyword in keywords if keyword in scores}
+
+    def get_scores(self, keywords):
+        """
+        Returns a keyword -> anchor-scaled score map. Keywords whose batch could
+        not be fetched are left out, so callers can tell them from a real 0.
+        """
+        batches = self.build_batches(keywords)
+        self.fetch_frames(batches)
+
+        scores = {}
+        for batch in batches:
+            if batch not in self.frames:
+                continue
+            batch_scores = self.scale_batch(batch)
+            for keyword in batch:
+                scores[keyword] = batch_scores.get(keyword, 0)
+        return {keyword: scores[keyword] for keyword in keywords if keyword in scores}
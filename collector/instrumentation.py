@@ -0,0 +1,306 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Prometheus textfile (for node_exporter's textfile collector) and JSON run
+# report written at the end of every run; set either to "" to skip it
+COLLECTOR_PROMETHEUS_PATH = os.getenv("COLLECTOR_PROMETHEUS_PATH", "collector.prom")
+COLLECTOR_REPORT_PATH = os.getenv("COLLECTOR_REPORT_PATH", "run_report.json")
+# off, cprofile or sample
+COLLECTOR_PROFILE = os.getenv("COLLECTOR_PROFILE", "off").strip().lower()
+COLLECTOR_PROFILE_PATH = os.getenv("COLLECTOR_PROFILE_PATH")
+COLLECTOR_PROFILE_INTERVAL = float(os.getenv("COLLECTOR_PROFILE_INTERVAL", "0.005"))
+
+METRIC_PREFIX = "snack_collector"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.values = []
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q):
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": len(self.values),
+            "total_seconds": round(self.sum, 4),
+            "p50_seconds": round(self.quantile(0.5), 4),
+            "p95_seconds": round(self.quantile(0.95), 4),
+            "max_seconds": round(max(self.values), 4),
+        }
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class RunMetrics:
+    """
+    Timers and counters for one collector run. Stage latencies are kept as
+    histograms per (stage, source); per-snack fetch times, retry counts and rows
+    written are tracked alongside. finish() writes a Prometheus textfile and a
+    JSON run report. Safe to use from the fetch threads.
+    """
+
+    def __init__(
+        self,
+        prometheus_path=COLLECTOR_PROMETHEUS_PATH,
+        report_path=COLLECTOR_REPORT_PATH,
+    ):
+        self.prometheus_path = prometheus_path
+        self.report_path = report_path
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.started = time.perf_counter()
+            self.histograms = {}
+            self.counters = Counter()
+            self.snack_seconds = {}
+
+    def observe(self, stage, seconds, source=None, snack=None):
+        with self.lock:
+            key = (stage, source)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+            if snack is not None:
+                per_source = self.snack_seconds.setdefault(snack, {})
+                per_source[source or stage] = round(
+                    per_source.get(source or stage, 0.0) + seconds, 4
+                )
+
+    @contextmanager
+    def timer(self, stage, source=None, snack=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, source, snack)
+
+    def count(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def to_prometheus(self, duration, success):
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_duration_seconds Time spent in each collector stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_duration_seconds histogram",
+        ]
+        for (stage, source), histogram in sorted(
+            self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or "")
+        ):
+            labels = [("stage", stage)]
+            if source:
+                labels.append(("source", source))
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{METRIC_PREFIX}_stage_duration_seconds_bucket"
+                    f"{format_labels(labels + [('le', bound)])} {cumulative}"
+                )
+            lines.append(
+                f"{METRIC_PREFIX}_stage_duration_seconds_bucket"
+                f"{format_labels(labels + [('le', '+Inf')])} {len(histogram.values)}"
+            )
+            lines.append(
+                f"{METRIC_PREFIX}_stage_duration_seconds_sum{format_labels(labels)} {histogram.sum:.6f}"
+            )
+            lines.append(
+                f"{METRIC_PREFIX}_stage_duration_seconds_count{format_labels(labels)} {len(histogram.values)}"
+            )
+
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(
+                        f"{METRIC_PREFIX}_{name}_total{format_labels(labels)} {value}"
+                    )
+
+        lines += [
+            f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+            f"{METRIC_PREFIX}_run_duration_seconds {duration:.3f}",
+            f"# TYPE {METRIC_PREFIX}_run_success gauge",
+            f"{METRIC_PREFIX}_run_success {int(success)}",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds {self.started_at:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def to_report(self, duration, success):
+        stages = {}
+        for (stage, source), histogram in self.histograms.items():
+            stages[f"{stage}:{source}" if source else stage] = histogram.summary()
+
+        counters = {}
+        for (name, labels), value in self.counters.items():
+            key = ",".join(f"{label}={label_value}" for label, label_value in labels)
+            counters.setdefault(name, {})[key or "total"] = value
+
+        return {
+            "started_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started_at)
+            ),
+            "duration_seconds": round(duration, 3),
+            "success": success,
+            "stages": dict(sorted(stages.items())),
+            "counters": counters,
+            "snacks": self.snack_seconds,
+        }
+
+    def finish(self, success=True):
+        duration = time.perf_counter() - self.started
+        with self.lock:
+            report = self.to_report(duration, success)
+            try:
+                if self.prometheus_path:
+                    # written to a temp file and renamed, so the exporter never reads half a file
+                    write_atomically(
+                        self.prometheus_path, self.to_prometheus(duration, success)
+                    )
+                if self.report_path:
+                    write_atomically(self.report_path, json.dumps(report, indent=2))
+            except OSError as e:
+                logger.error(f"Could not write run metrics: {e}")
+
+        slowest = sorted(
+            report["stages"].items(),
+            key=lambda item: item[1]["total_seconds"],
+            reverse=True,
+        )[:5]
+        logger.info(
+            f"Run took {duration:.1f}s. Slowest stages: "
+            + ", ".join(
+                f"{name} {stats['total_seconds']:.1f}s" for name, stats in slowest
+            )
+        )
+        return report
+
+
+def write_atomically(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+class StackSampler:
+    """
+    Minimal sampling profiler: a background thread records every other thread's
+    stack at a fixed interval. Output is in collapsed-stack format, which
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, interval=COLLECTOR_PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    stack.append(f"{module}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, "thread"))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, path):
+        self.stopped.set()
+        self.thread.join()
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiling(mode=COLLECTOR_PROFILE, path=COLLECTOR_PROFILE_PATH):
+    """
+    Profiles the enclosed block with cProfile or the stack sampler, if enabled.
+    cProfile only sees the calling thread, so use the sampler for concurrent runs.
+    """
+    if mode == "cprofile":
+        path = path or "collector.pstats"
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(
+                25
+            )
+            logger.info(f"cProfile stats written to {path}:\n{summary.getvalue()}")
+    elif mode == "sample":
+        path = path or "collector.folded"
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop(path)
+            logger.info(
+                f"Wrote {sum(sampler.samples.values())} stack samples to {path}."
+            )
+    else:
+        if mode not in ("", "off"):
+            logger.warning(f"Unknown COLLECTOR_PROFILE {mode!r}; profiling is off.")
+        yield
+
+
+run_metrics = RunMetrics()
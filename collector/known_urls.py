@@ -0,0 +1,246 @@
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+KNOWN_URL_PREFILTER = os.getenv("KNOWN_URL_PREFILTER", "true").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+# Only mentions published this recently can show up in a run's window again
+KNOWN_URL_DAYS = float(os.getenv("KNOWN_URL_DAYS", "3"))
+# Where the known URLs are kept between runs; set to "" to reload them every run
+KNOWN_URLS_CACHE_PATH = os.getenv("KNOWN_URLS_CACHE_PATH", ".cache/known_urls.pickle")
+# Rows published this long before the newest one already loaded are read again, for
+# mentions another process stored after the last load
+KNOWN_URL_OVERLAP_HOURS = float(os.getenv("KNOWN_URL_OVERLAP_HOURS", "48"))
+# Bumped whenever the pickled layout changes, so old cache files are reloaded
+KNOWN_URLS_FORMAT = 1
+
+GET_KNOWN_URLS_QUERY = """
+    SELECT url, sentiment_score, published_at
+    FROM snack_mentions
+    WHERE published_at > %s AND url IS NOT NULL AND sentiment_score IS NOT NULL;
+"""
+
+
+def url_key(url):
+    return int.from_bytes(
+        hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(),
+        "big",
+        signed=True,
+    )
+
+
+def to_epoch(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+
+# The table's oid changes when it is dropped and created again, which makes a
+# cached copy of its URLs stale
+GET_MENTIONS_TABLE_QUERY = "SELECT to_regclass('snack_mentions')::oid;"
+
+
+def get_database_name(conn):
+    params = conn.get_dsn_parameters()
+    with conn.cursor() as cursor:
+        cursor.execute(GET_MENTIONS_TABLE_QUERY)
+        (table_oid,) = cursor.fetchone()
+    conn.commit()
+    if table_oid is None:
+        return None
+    return (
+        f"{params.get('host')}:{params.get('port')}/{params.get('dbname')}/{table_oid}"
+    )
+
+
+class KnownUrls:
+    """
+    The snack_mentions URLs stored in the last KNOWN_URL_DAYS, with their
+    sentiment, as a sorted array of 64-bit URL hashes and parallel arrays of
+    scores and publish times (24 bytes per URL). A mention whose URL is known is
+    counted with its stored score instead of being scored again, and is not sent
+    to the database, where ON CONFLICT would drop it anyway. URLs written during
+    the run are added once the commit that inserted them succeeds.
+    """
+
+    def __init__(
+        self,
+        enabled=KNOWN_URL_PREFILTER,
+        days=KNOWN_URL_DAYS,
+        cache_path=KNOWN_URLS_CACHE_PATH,
+        overlap_hours=KNOWN_URL_OVERLAP_HOURS,
+    ):
+        self.enabled = enabled
+        self.days = days
+        self.cache_path = cache_path
+        self.overlap_hours = overlap_hours
+        self.database = None
+        self.keys = array("q")
+        self.scores = array("d")
+        self.published = array("q")
+        # added during the run, merged into the arrays by the next refresh or save
+        self.added = {}
+        self.loaded_through = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys) + len(self.added)
+
+    def _find(self, key):
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+    def get(self, url):
+        """The stored sentiment of a known URL, or None."""
+        if not self.enabled or not url:
+            return None
+        key = url_key(url)
+        index = self._find(key)
+        if index is not None:
+            return self.scores[index]
+        with self.lock:
+            entry = self.added.get(key)
+        return entry[0] if entry else None
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def add(self, url, score, published_at):
+        if not self.enabled or not url or score is None or not published_at:
+            return
+        with self.lock:
+            self.added[url_key(url)] = (score, to_epoch(published_at))
+
+    def _merge(self, entries, cutoff):
+        # entries: key -> (score, published epoch); newer entries win
+        merged = {
+            key: (score, published)
+            for key, score, published in zip(self.keys, self.scores, self.published)
+            if published > cutoff
+        }
+        merged.update(
+            (key, entry) for key, entry in entries.items() if entry[1] > cutoff
+        )
+        keys = sorted(merged)
+        self.keys = array("q", keys)
+        self.scores = array("d", (merged[key][0] for key in keys))
+        self.published = array("q", (merged[key][1] for key in keys))
+
+    def _read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read the known URL cache {self.cache_path}: {e}")
+            return False
+        if (
+            cached.get("format") != KNOWN_URLS_FORMAT
+            or cached.get("database") != self.database
+        ):
+            return False
+        self.keys = cached["keys"]
+        self.scores = cached["scores"]
+        self.published = cached["published"]
+        self.loaded_through = cached["loaded_through"]
+        return True
+
+    def refresh(self, conn):
+        """
+        Loads the URLs stored since the last refresh (from the cached copy, then
+        the database by published_at) and drops the ones older than the window.
+        """
+        if not self.enabled:
+            return self
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        cutoff = now - int(self.days * 24 * 60 * 60)
+        database = get_database_name(conn)
+        if database != self.database:
+            self.database = database
+            self.keys, self.scores, self.published = array("q"), array("d"), array("q")
+            self.loaded_through = None
+            if database is None:
+                logger.warning("snack_mentions does not exist yet; no URLs are known.")
+                return self
+            self._read_cache()
+        elif database is None:
+            return self
+
+        since = cutoff
+        if self.loaded_through is not None:
+            since = max(cutoff, self.loaded_through - int(self.overlap_hours * 3600))
+        with conn.cursor() as cursor:
+            cursor.execute(
+                GET_KNOWN_URLS_QUERY,
+                (datetime.datetime.fromtimestamp(since, tz=datetime.timezone.utc),),
+            )
+            rows = cursor.fetchall()
+        conn.commit()
+
+        entries = {}
+        for url, score, published_at in rows:
+            entries[url_key(url)] = (score, to_epoch(published_at))
+        with self.lock:
+            entries.update(self.added)
+            self.added = {}
+        self._merge(entries, cutoff)
+        newest = max((published for _, published in entries.values()), default=None)
+        if newest is not None:
+            self.loaded_through = max(self.loaded_through or newest, newest)
+        logger.info(
+            f"Loaded {len(rows)} recent mention URLs; {len(self.keys)} known in total."
+        )
+        return self
+
+    def save(self):
+        """Merges the URLs added this run and writes the cache file."""
+        if not self.enabled or self.database is None:
+            return
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        with self.lock:
+            added, self.added = self.added, {}
+        self._merge(added, now - int(self.days * 24 * 60 * 60))
+        if not self.cache_path:
+            return
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "format": KNOWN_URLS_FORMAT,
+                        "database": self.database,
+                        "keys": self.keys,
+                        "scores": self.scores,
+                        "published": self.published,
+                        "loaded_through": self.loaded_through,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(
+                f"Could not write the known URL cache {self.cache_path}: {e}"
+            )
+
+
+known_urls = KnownUrls()
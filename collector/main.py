@@ -2,13 +2,15 @@ import json
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
-from data_collector import run_collection_pipeline
-from db_utils import connect_db, fetch_data, close_db_connection, create_snack_config
 from dotenv import load_dotenv
 
-
+# The collector modules read their settings when imported, so .env is loaded first
 load_dotenv()
 
+from data_collector import run_collection_pipeline  # noqa: E402
+from db_utils import create_db_pool, close_db_pool  # noqa: E402
+from snack_catalog import load_snack_catalog  # noqa: E402
+
 log_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -27,21 +29,25 @@ logger.addHandler(file_handler)
 
 
 def main():
-    conn = connect_db()
+    db_pool = create_db_pool()
 
-    if conn:
+    if db_pool:
         logger.info("Fectching Data:")
-        rows = fetch_data(conn)
-        SNACK_CONFIG = create_snack_config(rows)
-        logging.debug(json.dumps(SNACK_CONFIG, indent=2))
-        run_collection_pipeline(SNACK_CONFIG, conn)
+        SNACK_CONFIG = db_pool.run(load_snack_catalog)
+        logging.debug(
+            json.dumps(
+                {key: record.to_dict() for key, record in SNACK_CONFIG.items()},
+                indent=2,
+            )
+        )
+        run_collection_pipeline(SNACK_CONFIG, db_pool)
 
         # TESTING
         # first_snack_key = next(iter(SNACK_CONFIG))
         # test_config = {first_snack_key: SNACK_CONFIG[first_snack_key]}
-        # run_collection_pipeline(test_config, conn)
+        # run_collection_pipeline(test_config, db_pool)
 
-        close_db_connection(conn)
+        close_db_pool(db_pool)
 
 
 if __name__ == "__main__":
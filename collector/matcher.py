@@ -0,0 +1,103 @@
+import re
+from functools import lru_cache
+
+# Simple plural/possessive endings still count as a hit ("chips", "Oreo's")
+SUFFIX_PATTERN = r"(?:'?s|es)?"
+WORD_CHAR = re.compile(r"\w")
+
+
+def normalize_term(term):
+    # "Coca-Cola", "coca cola" and "Coca  Cola" all normalize to "coca cola"
+    return " ".join(term.lower().replace("-", " ").split())
+
+
+def contained_terms(term, terms):
+    """
+    The other terms that occur inside term on word boundaries. Only substrings
+    that start and end on a boundary are looked up, so the cost depends on the
+    length of term rather than on how many terms there are.
+    """
+    is_word = [bool(WORD_CHAR.match(char)) for char in term]
+    starts = [i for i in range(len(term)) if i == 0 or not is_word[i - 1]]
+    ends = [j for j in range(1, len(term) + 1) if j == len(term) or not is_word[j]]
+    return {
+        term[i:j]
+        for i in starts
+        for j in ends
+        if j > i and term[i:j] != term and term[i:j] in terms
+    }
+
+
+def _trie_pattern(node):
+    # Turns a character trie into a regex, so matching cost does not grow with
+    # the number of terms that share a prefix
+    is_end = "" in node
+    branches = []
+    for char in sorted(key for key in node if key):
+        token = r"[\s\-]+" if char == " " else re.escape(char)
+        branches.append(token + _trie_pattern(node[char]))
+
+    if not branches:
+        return ""
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if is_end else pattern
+
+
+class TermMatcher:
+    """
+    Finds every one of a fixed set of terms in a text with a single regex pass.
+    Terms only match on word boundaries, so "race" does not hit "embrace", and
+    a hit on a longer term also reports the shorter terms it contains
+    ("snack food" also counts as "snack" and "food").
+    """
+
+    def __init__(self, terms):
+        self.terms = {normalize_term(term) for term in terms if term and term.strip()}
+        self.pattern = None
+        self.contained = {}
+        # matched text -> normalized term; only the handful of spellings that
+        # actually occur end up here
+        self.normalized = {}
+        if not self.terms:
+            return
+
+        trie = {}
+        for term in self.terms:
+            node = trie
+            for char in term:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        self.pattern = re.compile(
+            rf"(?<!\w)({_trie_pattern(trie)}){SUFFIX_PATTERN}(?!\w)", re.IGNORECASE
+        )
+
+        for term in self.terms:
+            self.contained[term] = contained_terms(term, self.terms)
+
+    def find(self, text):
+        """Returns the set of (normalized) terms that occur in text."""
+        hits = set()
+        if not self.pattern or not text:
+            return hits
+
+        for match in self.pattern.finditer(text):
+            matched = match.group(1)
+            term = self.normalized.get(matched)
+            if term is None:
+                term = self.normalized[matched] = normalize_term(matched)
+            hits.add(term)
+            hits.update(self.contained.get(term, ()))
+        return hits
+
+    def search(self, text):
+        """True if any term occurs in text."""
+        return bool(self.pattern and text and self.pattern.search(text))
+
+
+@lru_cache(maxsize=1024)
+def get_term_matcher(terms):
+    # terms must be hashable (a tuple); snacks reuse the same matcher all run
+    return TermMatcher(terms)
@@ -0,0 +1,152 @@
+import datetime
+import logging
+import os
+
+from reddit_ingest import AliasIndex
+
+logger = logging.getLogger(__name__)
+
+# NewsAPI rejects q values longer than 500 characters
+NEWS_QUERY_MAX_LENGTH = int(os.getenv("NEWS_QUERY_MAX_LENGTH", "500"))
+NEWS_PAGE_SIZE = 100
+NEWS_MAX_PAGES = int(os.getenv("NEWS_MAX_PAGES", "3"))
+
+
+def is_seen(article, published_after):
+    published_at = datetime.datetime.fromisoformat(
+        article["publishedAt"].replace("Z", "+00:00")
+    )
+    return published_at <= published_after
+
+
+def plan_news_queries(snack_config, negative_query, max_length=NEWS_QUERY_MAX_LENGTH):
+    """
+    Packs several snacks' alias groups into each NewsAPI query, up to max_length.
+    Returns a list of (query, [snack keys]) plans.
+    """
+    plans = []
+    groups = []
+    snacks = []
+
+    def build(parts):
+        return f"({' OR '.join(parts)}) {negative_query}"
+
+    for snack_name, config in snack_config.items():
+        group = config["reddit_query"]
+        if groups and len(build(groups + [group])) > max_length:
+            plans.append((build(groups), snacks))
+            groups, snacks = [], []
+        if len(build([group])) > max_length:
+            logger.warning(
+                f"News query for {snack_name} is longer than {max_length} characters and may be rejected."
+            )
+        groups.append(group)
+        snacks.append(snack_name)
+
+    if groups:
+        plans.append((build(groups), snacks))
+    return plans
+
+
+def stream_planned_news(
+    client,
+    snack_config,
+    plans,
+    time_filter_iso,
+    is_relevant,
+    limiter=None,
+    cache=None,
+    published_after=None,
+):
+    """
+    Runs each planned query, paging through its results, and routes every article
+    back to the snacks whose aliases it mentions. Articles published at or before
+    published_after (a datetime) were seen by an earlier run and are skipped.
+    Yields (snack key, unscored mention) pairs as the pages come in.
+    """
+    api_calls = 0
+
+    for query, snack_names in plans:
+        index = AliasIndex({name: snack_config[name] for name in snack_names})
+        processed_urls = set()
+        unrouted = 0
+
+        for page in range(1, NEWS_MAX_PAGES + 1):
+            logger.info(f"Searching NewsAPI (page {page}) for query: '{query}'")
+            request = dict(
+                q=query,
+                from_param=time_filter_iso,
+                language="en",
+                sort_by="relevancy",
+                page_size=NEWS_PAGE_SIZE,
+                page=page,
+            )
+            api_calls += 1
+
+            def download():
+                if limiter:
+                    return limiter.call(client.get_everything, **request)
+                return client.get_everything(**request)
+
+            try:
+                if cache is not None:
+                    response = cache.call("news", request, download)
+                else:
+                    response = download()
+            except Exception as e:
+                # without the first page the plan's snacks have no count at all,
+                # which must not be stored as zero articles
+                if page == 1:
+                    raise
+                # later pages can hit the plan's result cap; keep what we already have
+                logger.error(f"An error occurred while fetching news data {e}")
+                break
+
+            articles = response.get("articles", [])
+            for article in articles:
+                url = article["url"]
+                if url in processed_urls:
+                    continue
+
+                processed_urls.add(url)
+                if published_after and is_seen(article, published_after):
+                    continue
+                article_text = f"{article['title']} {article['description']}"
+                # content carries a snippet of the body, which NewsAPI also searched
+                snacks = index.match(f"{article_text} {article.get('content') or ''}")
+                if not snacks:
+                    unrouted += 1
+                    continue
+
+                for snack_name in snack_names:
+                    if snack_name not in snacks:
+                        continue
+                    if not is_relevant(
+                        article_text, snack_config[snack_name]["search_terms"]
+                    ):
+                        logger.debug(f"Filtered irrelevant article: {article['title']}")
+                        continue
+                    yield (
+                        snack_name,
+                        {
+                            "text": article_text,
+                            "sentiment_score": None,
+                            "source": "NewsAPI",
+                            "source_name": article["source"]["name"],
+                            "url": url,
+                            "published_at": article["publishedAt"],
+                        },
+                    )
+
+            if len(articles) < NEWS_PAGE_SIZE or page * NEWS_PAGE_SIZE >= response.get(
+                "totalResults", 0
+            ):
+                break
+
+        if unrouted:
+            logger.debug(f"{unrouted} articles matched no snack alias for '{query}'.")
+
+    logger.info(
+        f"NewsAPI: {api_calls} calls for {len(snack_config)} snacks in {len(plans)} combined queries "
+        f"({len(snack_config) - api_calls} calls saved)."
+    )
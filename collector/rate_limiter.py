@@ -0,0 +1,255 @@
+import email.utils
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from instrumentation import run_metrics
+
+logger = logging.getLogger(__name__)
+
+# Retries of a throttled (429) or transient (5xx, connection) error per call
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+# First backoff in seconds; it doubles per retry up to RATE_LIMIT_MAX_BACKOFF
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "2"))
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv("RATE_LIMIT_MAX_BACKOFF", "60"))
+# Calls that fail after all retries in a row before the provider is treated as down
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+# Seconds an open circuit fails calls right away before one trial call is let through
+CIRCUIT_BREAKER_COOLDOWN = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", "120"))
+
+# AIMD: a 429 halves the rate, every success adds back a tenth of the ceiling
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_SHARE = 0.1
+# The rate never drops below this share of the ceiling
+MIN_RATE_SHARE = 0.05
+
+TRANSIENT_ERROR_NAMES = {
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "ServerError",
+}
+# pytrends and some clients only put the status in the message
+STATUS_PATTERN = re.compile(r"(?:code|status)\D{0,3}(429|5\d\d)\b", re.IGNORECASE)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider that kept failing until its cooldown ends."""
+
+
+def get_status_code(error):
+    for owner in (error, getattr(error, "response", None)):
+        status = getattr(owner, "status_code", None)
+        if isinstance(status, int):
+            return status
+    # NewsAPI raises with its own error codes instead of the HTTP status
+    get_code = getattr(error, "get_code", None)
+    if callable(get_code) and get_code() == "rateLimited":
+        return 429
+    if type(error).__name__ in ("TooManyRequests", "TooManyRequestsError"):
+        return 429
+    match = STATUS_PATTERN.search(str(error))
+    return int(match.group(1)) if match else None
+
+
+def get_retry_after(error):
+    """
+    Seconds the provider asked us to wait, from a Retry-After header (seconds
+    or an HTTP date) or an X-RateLimit-Reset epoch. None when it did not say.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get("X-RateLimit-Reset") or headers.get("X-Ratelimit-Reset")
+    if reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def classify_error(error):
+    """
+    Returns ("throttled", retry_after) for a 429, ("transient", None) for errors
+    worth retrying and (None, None) for everything else, which is raised as is.
+    """
+    status = get_status_code(error)
+    if status == 429:
+        return "throttled", get_retry_after(error)
+    if (status is not None and status >= 500) or (
+        isinstance(error, (ConnectionError, TimeoutError))
+        or type(error).__name__ in TRANSIENT_ERROR_NAMES
+    ):
+        return "transient", None
+    return None, None
+
+
+class RateLimiter:
+    """
+    Rate control for one provider. Caps how many calls run at once and spaces
+    their starts as a token bucket (one token of burst) whose rate adapts AIMD
+    style: a 429 halves it and blocks every caller for the Retry-After the
+    provider gave, and each success raises it again toward max_requests_per_second.
+    call() retries throttled and transient errors with capped exponential backoff
+    and full jitter. After CIRCUIT_BREAKER_FAILURES calls in a row fail anyway,
+    the circuit opens and calls raise CircuitOpenError for a cooldown, after
+    which one trial call decides whether it closes again.
+    Use it as a context manager around each request for the limits alone.
+    """
+
+    def __init__(
+        self,
+        name,
+        concurrency=1,
+        requests_per_second=None,
+        max_requests_per_second=None,
+        retries=RATE_LIMIT_RETRIES,
+        backoff=RATE_LIMIT_BACKOFF,
+        max_backoff=RATE_LIMIT_MAX_BACKOFF,
+        failure_threshold=CIRCUIT_BREAKER_FAILURES,
+        cooldown=CIRCUIT_BREAKER_COOLDOWN,
+    ):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.requests_per_second = requests_per_second
+        # unthrottled limiters stay that way; only Retry-After blocks them
+        self.max_requests_per_second = (
+            max(max_requests_per_second or 0, requests_per_second)
+            if requests_per_second
+            else None
+        )
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = cooldown
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._failures = 0
+        self._open_until = None
+        self._probing = False
+
+    def _wait_for_slot(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._blocked_until)
+            if self.requests_per_second:
+                self._next_slot = slot + 1.0 / self.requests_per_second
+
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        self._wait_for_slot()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+        return False
+
+    def throttled(self, retry_after=None):
+        """Backs off after a 429: multiplicative decrease, plus the provider's wait."""
+        run_metrics.count("throttled", source=self.name)
+        with self._lock:
+            now = time.monotonic()
+            # 429s from calls that were already in flight count as one decrease
+            if (
+                self.requests_per_second
+                and now - self._last_decrease >= 1.0 / self.requests_per_second
+            ):
+                self.requests_per_second = max(
+                    self.max_requests_per_second * MIN_RATE_SHARE,
+                    self.requests_per_second * RATE_DECREASE_FACTOR,
+                )
+                self._last_decrease = now
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            rate = self.requests_per_second
+        logger.warning(
+            f"{self.name} is rate limiting us; slowing to "
+            + (f"{rate:.2f} requests/s" if rate else "the provider's pace")
+            + (f" and pausing {retry_after:.1f}s." if retry_after else ".")
+        )
+
+    def _succeeded(self):
+        with self._lock:
+            if self.requests_per_second:
+                self.requests_per_second = min(
+                    self.max_requests_per_second,
+                    self.requests_per_second
+                    + self.max_requests_per_second * RATE_INCREASE_SHARE,
+                )
+            self._failures = 0
+            self._open_until = None
+            self._probing = False
+
+    def _failed(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures < self.failure_threshold:
+                return
+            self._open_until = time.monotonic() + self.cooldown
+        run_metrics.count("circuit_opened", source=self.name)
+        logger.error(
+            f"{self.name} failed {self._failures} calls in a row; skipping its calls for {self.cooldown:.0f}s."
+        )
+
+    def _check_circuit(self):
+        with self._lock:
+            if self._open_until is None:
+                return
+            if time.monotonic() >= self._open_until and not self._probing:
+                # half open: this call is the trial, the others keep failing fast
+                self._probing = True
+                return
+        run_metrics.count("circuit_rejected", source=self.name)
+        raise CircuitOpenError(f"{self.name} circuit is open after repeated failures")
+
+    def call(self, func, *args, **kwargs):
+        delay = self.backoff
+        for attempt in range(1, self.retries + 2):
+            self._check_circuit()
+            try:
+                with self:
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                kind, retry_after = classify_error(e)
+                if kind is None:
+                    with self._lock:
+                        self._probing = False
+                    raise
+                if kind == "throttled":
+                    self.throttled(retry_after)
+                if attempt > self.retries:
+                    self._failed()
+                    raise
+                run_metrics.count("retries", source=self.name)
+                # a Retry-After wait already holds back the next slot
+                wait = 0 if retry_after else random.uniform(0, delay)
+                logger.warning(
+                    f"{self.name} call failed ({e}); retry {attempt}/{self.retries} in {wait:.1f}s."
+                )
+                time.sleep(wait)
+                delay = min(delay * 2, self.max_backoff)
+            else:
+                self._succeeded()
+                return result
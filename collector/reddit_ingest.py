@@ -0,0 +1,288 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from matcher import TermMatcher, normalize_term
+from rate_limiter import CircuitOpenError, RateLimiter, classify_error
+
+logger = logging.getLogger(__name__)
+
+COMMENT_TREE_WORKERS = int(os.getenv("COMMENT_TREE_WORKERS", "4"))
+# Per-submission caps so one viral thread cannot stall the run
+COMMENT_TREE_MAX_COMMENTS = int(os.getenv("COMMENT_TREE_MAX_COMMENTS", "2000"))
+COMMENT_TREE_MAX_SECONDS = float(os.getenv("COMMENT_TREE_MAX_SECONDS", "30"))
+# How many submissions' kept comments are remembered for the rest of the run
+COMMENT_TREE_MEMO_SIZE = int(os.getenv("COMMENT_TREE_MEMO_SIZE", "5000"))
+
+
+class AliasIndex:
+    """Inverted index from every snack's normalized search terms to the snacks that use them."""
+
+    def __init__(self, snack_config):
+        self.snacks_by_term = {}
+        for snack_name, config in snack_config.items():
+            # catalog records carry their terms already normalized
+            terms = config.get("normalized_terms") or [
+                normalize_term(term) for term in config.get("search_terms", [])
+            ]
+            for term in terms:
+                self.snacks_by_term.setdefault(term, []).append(snack_name)
+        self.matcher = TermMatcher(self.snacks_by_term)
+
+    def match(self, text):
+        """Returns the snacks mentioned in text."""
+        snacks = set()
+        for term in self.matcher.find(text):
+            snacks.update(self.snacks_by_term.get(term, ()))
+        return snacks
+
+
+def to_mention(item, text, source):
+    return {
+        "text": text,
+        "sentiment_score": None,
+        "source": source,
+        "source_name": item.subreddit.display_name,
+        "url": f"https://www.reddit.com{item.permalink}",
+        "published_at": datetime.datetime.fromtimestamp(
+            item.created_utc, tz=datetime.timezone.utc
+        ).isoformat(),
+    }
+
+
+def snapshot_submission(submission):
+    # The fields the collector reads, in a form the response cache can store
+    return {
+        "id": submission.id,
+        "title": submission.title,
+        "selftext": submission.selftext,
+        "subreddit": submission.subreddit.display_name,
+        "permalink": submission.permalink,
+        "created_utc": submission.created_utc,
+    }
+
+
+def snapshot_comment(comment):
+    return {
+        "id": comment.id,
+        "body": comment.body,
+        "subreddit": comment.subreddit.display_name,
+        "permalink": comment.permalink,
+        "created_utc": comment.created_utc,
+    }
+
+
+def restore_item(record):
+    """Rebuilds a cached submission or comment with the attributes praw objects have."""
+    return SimpleNamespace(
+        **{
+            **record,
+            "subreddit": SimpleNamespace(display_name=record["subreddit"]),
+            "replies": [],
+        }
+    )
+
+
+def cached_listing(cache, params, listing, snapshot, time_filter_unix):
+    # The window is left out of the key, so a rerun can reuse the listing and
+    # filter it again locally
+    if cache is None or not cache.enabled:
+        return iter_recent(listing(), time_filter_unix)
+
+    records = cache.call(
+        "reddit",
+        params,
+        lambda: [snapshot(item) for item in iter_recent(listing(), time_filter_unix)],
+    )
+    return iter_recent((restore_item(record) for record in records), time_filter_unix)
+
+
+def iter_recent(listing, time_filter_unix):
+    # Listings are newest first, so stop at the first item outside the window
+    for item in listing:
+        if item.created_utc <= time_filter_unix:
+            break
+        yield item
+
+
+def stream_reddit_mentions(
+    reddit, snack_config, subreddits_to_search, time_filter_unix, cache=None
+):
+    """
+    Reads every new post and comment in the window from each subreddit once and
+    routes it to every snack whose aliases it mentions. Yields (snack key,
+    unscored mention) pairs in the order the items were seen.
+    """
+    index = AliasIndex(snack_config)
+    scanned = 0
+    matched = 0
+
+    def route(item, text, source):
+        snacks = index.match(text)
+        if not snacks:
+            return []
+        mention = to_mention(item, text, source)
+        # each snack gets its own copy since the writer annotates mentions in place
+        return [(snack_name, dict(mention)) for snack_name in sorted(snacks)]
+
+    # Listings cap out at roughly 1000 items, so each subreddit is read on its own
+    for subreddit_name in subreddits_to_search.split("+"):
+        new_posts = cached_listing(
+            cache,
+            {"new": subreddit_name},
+            lambda: reddit.subreddit(subreddit_name).new(limit=None),
+            snapshot_submission,
+            time_filter_unix,
+        )
+        for submission in new_posts:
+            scanned += 1
+            routed = route(
+                submission,
+                f"{submission.title} {submission.selftext}",
+                "Reddit Submission",
+            )
+            matched += len(routed)
+            yield from routed
+
+        new_comments = cached_listing(
+            cache,
+            {"comments": subreddit_name},
+            lambda: reddit.subreddit(subreddit_name).comments(limit=None),
+            snapshot_comment,
+            time_filter_unix,
+        )
+        for comment in new_comments:
+            scanned += 1
+            routed = route(comment, comment.body, "Reddit Comment")
+            matched += len(routed)
+            yield from routed
+
+    logger.info(
+        f"Shared Reddit ingest scanned {scanned} posts and comments and routed {matched} mentions."
+    )
+
+
+class CommentTreeFetcher:
+    """
+    Loads submission comment trees on a small thread pool, once per submission
+    per run: the kept comments of the last memo_size submissions are remembered,
+    so every snack whose search finds a thread shares one download. Trees are walked breadth-first (the same order as
+    comments.list()) without flattening them first, and the walk stops at the
+    comment or time cap. Only comments accepted by the keep matcher are held on
+    to, as unscored mention dicts. With a ResponseCache the walked comments are
+    stored, and cached submissions are reloaded through the reddit client.
+    Downloads go through the limiter handed to prefetch(), normally the one the
+    Reddit search used, so they share its rate and its concurrency (praw's
+    client is not thread safe) and 429s and transient errors are retried there.
+    """
+
+    def __init__(
+        self,
+        keep_matcher,
+        workers=COMMENT_TREE_WORKERS,
+        max_comments=COMMENT_TREE_MAX_COMMENTS,
+        max_seconds=COMMENT_TREE_MAX_SECONDS,
+        memo_size=COMMENT_TREE_MEMO_SIZE,
+        reddit=None,
+        cache=None,
+        limiter=None,
+    ):
+        self.keep_matcher = keep_matcher
+        self.reddit = reddit
+        self.cache = cache
+        self.max_comments = max_comments
+        self.max_seconds = max_seconds
+        self.memo_size = max(1, memo_size)
+        # one request at a time unless a caller hands prefetch() its own limiter
+        self.limiter = limiter or RateLimiter("reddit_comments")
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="comment-trees"
+        )
+        # submission id -> future of its kept comments, oldest first
+        self.futures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _iter_tree(self, submission):
+        # praw is heavy to import, so only runs that read comment trees pay for it
+        from praw.models import MoreComments
+
+        visited = 0
+        # reading submission.comments the first time downloads the whole tree, which
+        # is where most of the time goes, so it counts toward max_seconds
+        started = time.monotonic()
+        queue = deque(submission.comments)
+
+        while queue:
+            if visited >= self.max_comments:
+                logger.info(
+                    f"Stopped reading comments for {submission.id} after {visited} comments."
+                )
+                break
+            if time.monotonic() - started > self.max_seconds:
+                logger.info(
+                    f"Stopped reading comments for {submission.id} after {self.max_seconds}s."
+                )
+                break
+
+            comment = queue.popleft()
+            if isinstance(comment, MoreComments):
+                continue
+            visited += 1
+            yield comment
+            queue.extend(comment.replies)
+
+    def _walk(self, submission):
+        if self.cache is not None and self.cache.enabled:
+
+            def download():
+                live = submission
+                if isinstance(submission, SimpleNamespace):
+                    live = self.reddit.submission(id=submission.id)
+                return [snapshot_comment(comment) for comment in self._iter_tree(live)]
+
+            records = self.cache.call(
+                "reddit",
+                {"comment_tree": submission.id, "max_comments": self.max_comments},
+                download,
+            )
+            comments = (restore_item(record) for record in records)
+        else:
+            comments = self._iter_tree(submission)
+
+        return [
+            to_mention(comment, comment.body, "Reddit Comment")
+            for comment in comments
+            if self.keep_matcher.search(comment.body)
+        ]
+
+    def prefetch(self, submission, limiter=None):
+        with self.lock:
+            future = self.futures.get(submission.id)
+            if future is None:
+                future = self.executor.submit(
+                    (limiter or self.limiter).call, self._walk, submission
+                )
+                self.futures[submission.id] = future
+                if len(self.futures) > self.memo_size:
+                    # a reader already holding the evicted future still gets its result
+                    self.futures.popitem(last=False)
+            return future
+
+    def comments(self, submission):
+        """Returns the kept comments of a submission as fresh mention dicts."""
+        try:
+            return [dict(mention) for mention in self.prefetch(submission).result()]
+        except Exception as e:
+            # a throttled or failing Reddit fails the fetch instead of counting no comments
+            if isinstance(e, CircuitOpenError) or classify_error(e)[0]:
+                raise
+            logger.error(f"Could not load comments for {submission.id}: {e}")
+            return []
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
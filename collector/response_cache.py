@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# off: no caching. on: reuse fresh responses, store new ones.
+# record: always call the API and store the response. replay: never call the API.
+RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", "off").strip().lower()
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", ".cache/responses.sqlite")
+
+# Seconds a stored response stays fresh in "on" mode
+RESPONSE_CACHE_TTLS = {
+    "trends": int(os.getenv("TRENDS_CACHE_TTL", str(6 * 60 * 60))),
+    "reddit": int(os.getenv("REDDIT_CACHE_TTL", str(2 * 60 * 60))),
+    "news": int(os.getenv("NEWS_CACHE_TTL", str(6 * 60 * 60))),
+    "stocks": int(os.getenv("FINNHUB_CACHE_TTL", str(60 * 60))),
+    "run": 0,
+}
+
+CACHE_MODES = ("off", "on", "record", "replay")
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode when no response was recorded for a request."""
+
+
+def request_key(source, params):
+    # Sorted-key JSON makes the key independent of argument order
+    normalized = json.dumps(params, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(f"{source}:{normalized}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of source responses, stored as zlib-compressed JSON in a single
+    sqlite file and keyed by source plus normalized request parameters.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, mode=RESPONSE_CACHE_MODE, ttls=None):
+        if mode not in CACHE_MODES:
+            logger.warning(f"Unknown RESPONSE_CACHE_MODE {mode!r}; caching is off.")
+            mode = "off"
+        self.path = path
+        self.mode = mode
+        self.ttls = ttls or RESPONSE_CACHE_TTLS
+        self.lock = threading.Lock()
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def _get_db(self):
+        if self.db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, source TEXT, stored_at REAL, body BLOB)"
+            )
+        return self.db
+
+    def get(self, source, params):
+        with self.lock:
+            row = (
+                self._get_db()
+                .execute(
+                    "SELECT stored_at, body FROM responses WHERE key = ?",
+                    (request_key(source, params),),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        stored_at, body = row
+        if not self.replaying and time.time() - stored_at > self.ttls.get(source, 0):
+            return None
+        return json.loads(zlib.decompress(body))
+
+    def put(self, source, params, value):
+        body = zlib.compress(json.dumps(value, default=str).encode("utf-8"))
+        with self.lock:
+            db = self._get_db()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, source, stored_at, body) VALUES (?, ?, ?, ?)",
+                (request_key(source, params), source, time.time(), body),
+            )
+            db.commit()
+
+    def call(self, source, params, fetch):
+        """
+        Returns the response for (source, params), calling fetch() only when the
+        mode and cache contents require it. fetch must return JSON-serializable data.
+        """
+        if not self.enabled:
+            return fetch()
+
+        if self.mode in ("on", "replay"):
+            cached = self.get(source, params)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            if self.replaying:
+                raise CacheMiss(f"No recorded {source} response for {params}")
+
+        self.misses += 1
+        value = fetch()
+        self.put(source, params, value)
+        return value
+
+    def close(self):
+        if self.enabled and (self.hits or self.misses):
+            logger.info(
+                f"Response cache ({self.mode}): {self.hits} hits, {self.misses} live requests."
+            )
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+response_cache = ResponseCache()
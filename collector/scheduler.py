@@ -0,0 +1,339 @@
+"""
+Orders a run's snacks by priority and keeps their per-snack fetches within a
+wall-clock budget. Without this, a slow run leaves no row for whichever snacks
+come last in the catalog. With it, a slow run drops its least important work.
+
+Priority adds up three percentile ranks over the last SCHEDULER_LOOKBACK_DAYS of
+daily_metrics, weighted by PRIORITY_WEIGHTS:
+
+- staleness: days since the snack last got Reddit or news numbers,
+- volatility: how much its trends score and mention count move, and
+- popularity: its trends score and mention count, weighted as in the overview's
+  overall score.
+
+A snack with no recent rows ranks first on all three.
+
+The cost of each (snack, source) fetch is a moving average of its earlier fetch
+times, kept in collector_fetch_costs. Just before a fetch starts, it is checked
+against the deadline. It runs in full if its estimate still fits. If only the
+cheaper variant fits, that runs instead (Reddit without comment trees). If
+neither fits, the fetch is skipped. The snack's row is still written, using what
+was collected (the batched trends and stock fetches always run). The row is then
+listed in collector_partial_rows with what it lacks.
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from psycopg2.extras import execute_values
+
+from db_utils import CREATE_SCHEDULE_TABLES_QUERY
+from instrumentation import run_metrics
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Wall-clock seconds a run may take; 0 keeps the catalog order and fetches everything
+COLLECTOR_TIME_BUDGET = float(os.getenv("COLLECTOR_TIME_BUDGET", "0"))
+# Seconds of the budget held back for writing rows and the post-run stages
+COLLECTOR_TIME_RESERVE = float(os.getenv("COLLECTOR_TIME_RESERVE", "120"))
+# Days of daily_metrics the priority looks at
+SCHEDULER_LOOKBACK_DAYS = int(os.getenv("SCHEDULER_LOOKBACK_DAYS", "28"))
+# Weight of each new fetch time in the moving average of a fetch's cost
+SCHEDULER_COST_SMOOTHING = 0.3
+
+PRIORITY_WEIGHTS = {"staleness": 0.5, "volatility": 0.25, "popularity": 0.25}
+# Seconds assumed for a fetch that has never been timed, when no other snack's
+# fetch from the same source has been timed either
+DEFAULT_COSTS = {"reddit": 10.0, "reddit:lite": 2.0, "news": 2.0}
+# What the cheaper variant of a source leaves out, as listed in collector_partial_rows
+LITE_VARIANTS = {"reddit": "reddit_comments"}
+
+FULL, LITE, SKIPPED = "full", "lite", "skipped"
+
+GET_PRIORITY_SIGNALS_QUERY = """
+    SELECT
+        snack_id,
+        %(run_date)s::date - MAX(date) FILTER (
+            WHERE reddit_mention_count IS NOT NULL OR news_article_count IS NOT NULL
+        ) AS days_stale,
+        COALESCE(
+            stddev_samp(google_trends_score) / NULLIF(AVG(google_trends_score), 0), 0
+        ) + COALESCE(
+            stddev_samp(reddit_mention_count + news_article_count)
+            / NULLIF(AVG(reddit_mention_count + news_article_count), 0),
+            0
+        ) AS volatility,
+        AVG(COALESCE(google_trends_score, 0)) * 0.4
+        + AVG(COALESCE(reddit_mention_count, 0) + COALESCE(news_article_count, 0))
+        * 0.15 AS popularity
+    FROM daily_metrics
+    WHERE snack_id = ANY(%(snack_ids)s)
+      AND date > %(run_date)s::date - %(lookback)s
+      AND date <= %(run_date)s::date
+    GROUP BY snack_id;
+"""
+
+GET_FETCH_COSTS_QUERY = "SELECT snack_id, source, seconds FROM collector_fetch_costs;"
+
+UPSERT_FETCH_COSTS_QUERY = """
+    INSERT INTO collector_fetch_costs (snack_id, source, seconds)
+    VALUES %s
+    ON CONFLICT (snack_id, source) DO UPDATE SET
+        seconds = collector_fetch_costs.seconds * (1 - {smoothing})
+            + EXCLUDED.seconds * {smoothing},
+        samples = collector_fetch_costs.samples + 1,
+        updated_at = now();
+"""
+
+UPSERT_PARTIAL_ROWS_QUERY = """
+    INSERT INTO collector_partial_rows (snack_id, date, missing)
+    VALUES %s
+    ON CONFLICT (snack_id, date) DO UPDATE SET
+        missing = EXCLUDED.missing,
+        updated_at = now();
+"""
+
+# Rows a rerun of the same date completed are no longer partial
+DELETE_PARTIAL_ROWS_QUERY = """
+    DELETE FROM collector_partial_rows
+    WHERE date = %s AND snack_id = ANY(%s);
+"""
+
+
+def percentile_ranks(values):
+    """Each value's rank among values, from 0 (lowest) to 1 (highest); ties share one."""
+    ordered = sorted(values)
+    spread = max(1, len(ordered) - 1)
+    return [
+        (bisect_left(ordered, value) + bisect_right(ordered, value) - 1) / 2 / spread
+        for value in values
+    ]
+
+
+def cost_key(source, mode):
+    return source if mode == FULL else f"{source}:{mode}"
+
+
+class Scheduler:
+    """
+    Per-run priority order, cost estimates and deadline checks. With a budget of
+    0 it keeps the catalog order and runs every fetch in full, but still records
+    how long each fetch took for later budgeted runs.
+    """
+
+    def __init__(
+        self,
+        budget=COLLECTOR_TIME_BUDGET,
+        reserve=COLLECTOR_TIME_RESERVE,
+        lookback=SCHEDULER_LOOKBACK_DAYS,
+        concurrency=None,
+    ):
+        self.budget = budget
+        self.enabled = budget > 0
+        self.reserve = reserve
+        self.lookback = lookback
+        # source -> fetches run side by side, in concurrent mode
+        self.concurrency = concurrency
+        self.deadline = None
+        # (snack_id, cost key) -> average seconds from earlier runs
+        self.costs = {}
+        # cost key -> median over the snacks, for fetches never timed before
+        self.source_costs = {}
+        # (snack_id, cost key) -> seconds this run
+        self.observed = {}
+        # snack_id -> {source: LITE or SKIPPED}
+        self.degradations = {}
+        # snack_id -> what its row lacks; empty for a complete row
+        self.written = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        # the budget counts from the start of the run, not from the first fetch
+        if self.enabled:
+            self.deadline = time.monotonic() + self.budget - self.reserve
+        return self
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def estimate(self, snack_id, key):
+        """Seconds a fetch is expected to take: its own average, the source's median, or a default."""
+        cost = self.costs.get((snack_id, key))
+        if cost is None:
+            cost = self.source_costs.get(key, DEFAULT_COSTS.get(key, 0.0))
+        return cost
+
+    def prioritize(self, conn, snack_config, run_date):
+        """
+        Returns snack_config as a dict in priority order, highest first, and
+        loads the fetch costs. Without a budget, snack_config is returned as is.
+        """
+        if not self.enabled or not snack_config:
+            return snack_config
+        snack_ids = [config["snack_id"] for config in snack_config.values()]
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_SCHEDULE_TABLES_QUERY)
+            cursor.execute(
+                GET_PRIORITY_SIGNALS_QUERY,
+                {
+                    "run_date": run_date,
+                    "snack_ids": snack_ids,
+                    "lookback": self.lookback,
+                },
+            )
+            signals = {row[0]: row[1:] for row in cursor.fetchall()}
+            cursor.execute(GET_FETCH_COSTS_QUERY)
+            self.costs = {
+                (snack_id, key): seconds for snack_id, key, seconds in cursor.fetchall()
+            }
+        conn.commit()
+        by_source = {}
+        for (_, key), seconds in self.costs.items():
+            by_source.setdefault(key, []).append(seconds)
+        self.source_costs = {
+            key: statistics.median(seconds) for key, seconds in by_source.items()
+        }
+
+        # a snack without recent numbers is treated as the stalest and most in need
+        unknown = (float(self.lookback + 1), float("inf"), float("inf"))
+        rows = [
+            tuple(
+                fallback if value is None else float(value)
+                for value, fallback in zip(signals.get(snack_id, unknown), unknown)
+            )
+            for snack_id in snack_ids
+        ]
+        ranks = [percentile_ranks(column) for column in zip(*rows)]
+        priority = [
+            sum(
+                PRIORITY_WEIGHTS[name] * rank
+                for name, rank in zip(PRIORITY_WEIGHTS, snack)
+            )
+            for snack in zip(*ranks)
+        ]
+        # sorted() is stable, so equal priorities keep their catalog order
+        order = sorted(
+            range(len(snack_ids)), key=lambda index: priority[index], reverse=True
+        )
+        names = list(snack_config)
+        ordered = {names[index]: snack_config[names[index]] for index in order}
+        logger.info(
+            f"Scheduled {len(ordered)} snacks by priority "
+            f"({len(snack_ids) - len(signals)} without recent rows) within a "
+            f"{self.budget:.0f}s budget; per-snack fetches are estimated at "
+            f"{self.planned_seconds(ordered):.0f}s."
+        )
+        return ordered
+
+    def planned_seconds(self, snack_config):
+        # in concurrent mode the sources overlap and each runs concurrency fetches
+        # at once; otherwise every fetch waits for the one before
+        totals = {}
+        for config in snack_config.values():
+            for source in ("reddit", "news"):
+                totals[source] = totals.get(source, 0.0) + self.estimate(
+                    config["snack_id"], source
+                )
+        if not self.concurrency:
+            return sum(totals.values())
+        return max(
+            (
+                seconds / max(1, self.concurrency.get(source, 1))
+                for source, seconds in totals.items()
+            ),
+            default=0.0,
+        )
+
+    def choose(self, snack_id, source, has_lite):
+        remaining = self.remaining()
+        if remaining is None or self.estimate(snack_id, source) <= remaining:
+            return FULL
+        if has_lite and self.estimate(snack_id, cost_key(source, LITE)) <= remaining:
+            return LITE
+        return SKIPPED
+
+    def fetch(self, source, snack_id, full, lite=None):
+        """
+        Runs full(), or lite() when only the cheaper variant fits before the
+        deadline, and times it. Returns None without fetching when neither fits.
+        """
+        mode = self.choose(snack_id, source, lite is not None)
+        if mode != FULL:
+            with self.lock:
+                self.degradations.setdefault(snack_id, {})[source] = mode
+            run_metrics.count("deadline_degraded", source=source, mode=mode)
+        if mode == SKIPPED:
+            return None
+
+        started = time.perf_counter()
+        result = (full if mode == FULL else lite)()
+        # failed fetches often return early, so they say little about the cost
+        if result is not None:
+            with self.lock:
+                self.observed[(snack_id, cost_key(source, mode))] = (
+                    time.perf_counter() - started
+                )
+        return result
+
+    def degraded(self, snack_id):
+        """The sources of a snack that ran cut down or not at all: {source: mode}."""
+        with self.lock:
+            return dict(self.degradations.get(snack_id, {}))
+
+    def flag(self, snack_id, results):
+        """
+        Records what the snack's row lacks because of the deadline: sources that
+        were skipped and have no checkpointed result, and cut-down sources.
+        """
+        missing = []
+        for source, mode in self.degraded(snack_id).items():
+            if mode == LITE:
+                missing.append(LITE_VARIANTS[source])
+            elif results.get(source) is None:
+                missing.append(source)
+        self.written[snack_id] = sorted(missing)
+
+    def finish(self, conn, run_date):
+        """
+        Folds this run's fetch times into collector_fetch_costs and lists its
+        partial rows in collector_partial_rows. Replayed responses say nothing
+        about the providers' latency, so their times are not kept.
+        """
+        costs = [] if response_cache.replaying else list(self.observed.items())
+        partial = [
+            (snack_id, run_date, missing)
+            for snack_id, missing in self.written.items()
+            if missing
+        ]
+        complete = [
+            snack_id for snack_id, missing in self.written.items() if not missing
+        ]
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_SCHEDULE_TABLES_QUERY)
+            if costs:
+                execute_values(
+                    cursor,
+                    UPSERT_FETCH_COSTS_QUERY.format(smoothing=SCHEDULER_COST_SMOOTHING),
+                    [(snack_id, key, seconds) for (snack_id, key), seconds in costs],
+                    page_size=1000,
+                )
+            if self.enabled:
+                if partial:
+                    execute_values(
+                        cursor, UPSERT_PARTIAL_ROWS_QUERY, partial, page_size=1000
+                    )
+                if complete:
+                    cursor.execute(DELETE_PARTIAL_ROWS_QUERY, (run_date, complete))
+        conn.commit()
+        if self.enabled:
+            run_metrics.count("partial_rows", len(partial))
+            if partial:
+                logger.warning(
+                    f"{len(partial)} snacks were written without some sources to stay within the "
+                    f"{self.budget:.0f}s budget; see collector_partial_rows."
+                )
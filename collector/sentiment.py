@@ -0,0 +1,171 @@
+import atexit
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+logger = logging.getLogger(__name__)
+
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "50000"))
+# Optional sqlite file that keeps compound scores between runs
+SENTIMENT_CACHE_PATH = os.getenv("SENTIMENT_CACHE_PATH")
+# 0 means one worker per CPU
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", "0"))
+# Smaller batches are scored in-process; pickling them to a pool costs more than it saves
+SENTIMENT_PARALLEL_THRESHOLD = int(os.getenv("SENTIMENT_PARALLEL_THRESHOLD", "200"))
+
+_worker_analyzer = None
+
+
+def _init_worker():
+    global _worker_analyzer
+    _worker_analyzer = SentimentIntensityAnalyzer()
+
+
+def _score_chunk(texts):
+    return [_worker_analyzer.polarity_scores(text)["compound"] for text in texts]
+
+
+def text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class SentimentScorer:
+    """
+    Scores texts with VADER's compound score. Batches are deduplicated by content
+    hash, results are memoized in an LRU (and optionally on disk), and large
+    batches of cache misses are spread across a process pool.
+    """
+
+    def __init__(
+        self,
+        cache_size=SENTIMENT_CACHE_SIZE,
+        cache_path=SENTIMENT_CACHE_PATH,
+        workers=SENTIMENT_WORKERS,
+        parallel_threshold=SENTIMENT_PARALLEL_THRESHOLD,
+    ):
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.analyzer = None
+        self.pool = None
+        self.disk = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_analyzer(self):
+        if self.analyzer is None:
+            self.analyzer = SentimentIntensityAnalyzer()
+        return self.analyzer
+
+    def _get_disk(self):
+        if self.disk is None and self.cache_path:
+            self.disk = sqlite3.connect(self.cache_path, check_same_thread=False)
+            self.disk.execute(
+                "CREATE TABLE IF NOT EXISTS sentiment (key BLOB PRIMARY KEY, compound REAL)"
+            )
+        return self.disk
+
+    def _remember(self, key, score):
+        self.memo[key] = score
+        self.memo.move_to_end(key)
+        if len(self.memo) > self.cache_size:
+            self.memo.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        for key in keys:
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                found[key] = self.memo[key]
+
+        disk = self._get_disk()
+        missing = [key for key in keys if key not in found]
+        if disk and missing:
+            for start in range(0, len(missing), 500):
+                chunk = missing[start : start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = disk.execute(
+                    f"SELECT key, compound FROM sentiment WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, score in rows:
+                    found[key] = score
+                    self._remember(key, score)
+        return found
+
+    def _compute(self, texts):
+        if len(texts) < self.parallel_threshold or self.workers < 2:
+            analyzer = self._get_analyzer()
+            return [analyzer.polarity_scores(text)["compound"] for text in texts]
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker
+            )
+        chunk_size = max(1, len(texts) // (self.workers * 4))
+        chunks = [
+            texts[start : start + chunk_size]
+            for start in range(0, len(texts), chunk_size)
+        ]
+        scores = []
+        for chunk_scores in self.pool.map(_score_chunk, chunks):
+            scores.extend(chunk_scores)
+        return scores
+
+    def score_batch(self, texts):
+        """Returns the compound score for each text, in order."""
+        if not texts:
+            return []
+
+        keys = [text_key(text) for text in texts]
+        unique = dict(zip(keys, texts))
+
+        with self.lock:
+            scores = self._lookup(list(unique))
+            misses = [key for key in unique if key not in scores]
+            self.hits += len(texts) - len(misses)
+            self.misses += len(misses)
+
+            if misses:
+                computed = self._compute([unique[key] for key in misses])
+                for key, score in zip(misses, computed):
+                    scores[key] = score
+                    self._remember(key, score)
+
+                disk = self._get_disk()
+                if disk:
+                    disk.executemany(
+                        "INSERT OR REPLACE INTO sentiment (key, compound) VALUES (?, ?)",
+                        [(key, scores[key]) for key in misses],
+                    )
+                    disk.commit()
+
+        return [scores[key] for key in keys]
+
+    def score(self, text):
+        return self.score_batch([text])[0]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+        if self.hits or self.misses:
+            logger.info(
+                f"Sentiment scoring: {self.misses} texts scored, {self.hits} served from cache."
+            )
+
+
+sentiment_scorer = SentimentScorer()
+atexit.register(sentiment_scorer.close)
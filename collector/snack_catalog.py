@@ -0,0 +1,158 @@
+import logging
+import os
+import pickle
+
+from db_utils import create_snack_config, fetch_data
+from matcher import normalize_term
+from reddit_ingest import AliasIndex
+
+logger = logging.getLogger(__name__)
+
+# Where the compiled catalog is kept between runs; set to "" to always rebuild it
+SNACK_CATALOG_CACHE_PATH = os.getenv(
+    "SNACK_CATALOG_CACHE_PATH", ".cache/snack_catalog.pickle"
+)
+# Bumped whenever the pickled layout changes, so old cache files are rebuilt
+CATALOG_FORMAT = 1
+
+# Changes whenever a row of snacks, companies or snack_aliases is added, removed or edited
+CATALOG_FINGERPRINT_QUERY = """
+    SELECT md5(string_agg(row_hash, '' ORDER BY table_name, row_hash))
+    FROM (
+        SELECT 'snacks' AS table_name, md5(s::text) AS row_hash FROM snacks s
+        UNION ALL
+        SELECT 'companies', md5(c::text) FROM companies c
+        UNION ALL
+        SELECT 'snack_aliases', md5(a::text) FROM snack_aliases a
+    ) catalog_rows;
+"""
+
+
+class SnackRecord:
+    """
+    One snack's compiled search data: its terms (as entered and normalized) and
+    prebuilt Reddit and news queries. Supports config["key"] and config.get(key)
+    like the dicts create_snack_config returns, so the pipeline takes either.
+    """
+
+    __slots__ = (
+        "snack_id",
+        "name",
+        "stock_ticker",
+        "search_terms",
+        "normalized_terms",
+        "reddit_query",
+        "news_query",
+    )
+
+    def __init__(self, snack_id, search_terms, stock_ticker, reddit_query, news_query):
+        self.snack_id = snack_id
+        self.name = search_terms[0]
+        self.stock_ticker = stock_ticker
+        self.search_terms = tuple(search_terms)
+        self.normalized_terms = tuple(
+            dict.fromkeys(normalize_term(term) for term in search_terms if term)
+        )
+        self.reddit_query = reddit_query
+        self.news_query = news_query
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class SnackCatalog(dict):
+    """
+    Snack key -> SnackRecord, plus the alias index over every snack. Built once
+    from the catalog tables and reused from disk until their fingerprint changes.
+    """
+
+    __slots__ = ("fingerprint", "alias_index")
+
+    def __init__(self, records=(), fingerprint=None):
+        super().__init__(records)
+        self.fingerprint = fingerprint
+        self.alias_index = AliasIndex(self)
+
+    @classmethod
+    def from_rows(cls, rows, fingerprint=None):
+        records = {
+            snack_name: SnackRecord(
+                config["snack_id"],
+                config["search_terms"],
+                config["stock_ticker"],
+                config["reddit_query"],
+                config["news_query"],
+            )
+            for snack_name, config in create_snack_config(rows).items()
+        }
+        return cls(records, fingerprint)
+
+
+def read_cached_catalog(cache_path, fingerprint):
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read the snack catalog cache {cache_path}: {e}")
+        return None
+
+    if (
+        cached.get("format") != CATALOG_FORMAT
+        or cached.get("fingerprint") != fingerprint
+    ):
+        return None
+    return cached["catalog"]
+
+
+def write_cached_catalog(cache_path, catalog):
+    directory = os.path.dirname(cache_path)
+    try:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{cache_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(
+                {
+                    "format": CATALOG_FORMAT,
+                    "fingerprint": catalog.fingerprint,
+                    "catalog": catalog,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write the snack catalog cache {cache_path}: {e}")
+
+
+def load_snack_catalog(conn, cache_path=SNACK_CATALOG_CACHE_PATH):
+    """
+    Returns the compiled SnackCatalog. The catalog tables are only read (and the
+    catalog rebuilt) when their fingerprint differs from the cached copy's.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(CATALOG_FINGERPRINT_QUERY)
+        fingerprint = cursor.fetchone()[0]
+
+    catalog = read_cached_catalog(cache_path, fingerprint)
+    if catalog is not None:
+        logger.info(f"Loaded {len(catalog)} snacks from the catalog cache.")
+        return catalog
+
+    catalog = SnackCatalog.from_rows(fetch_data(conn), fingerprint)
+    logger.info(f"Compiled the snack catalog: {len(catalog)} snacks.")
+    # an empty catalog is usually a failed read, so it is not kept
+    if catalog and cache_path:
+        write_cached_catalog(cache_path, catalog)
+    return catalog
@@ -0,0 +1,188 @@
+"""
+Maintains snack_summary, one row per snack with what the overview endpoints
+show: the latest daily_metrics row, the comparison row, the trends and stock
+changes, the overall score and totals over the last SUMMARY_WINDOW_ROWS rows.
+Runs refresh the snacks they wrote. While the table is empty (the first run, or
+after a TRUNCATE to pick up a changed score) every snack is rebuilt.
+"""
+
+import logging
+
+from db_utils import CREATE_SNACK_SUMMARY_QUERY
+from instrumentation import run_metrics
+
+logger = logging.getLogger(__name__)
+
+# daily_metrics rows per snack the overview looks at (the detail page shows as many)
+SUMMARY_WINDOW_ROWS = 30
+
+# The snacks a run wrote, with the earliest date written for each
+WRITTEN_SNACKS_TARGETS = """
+    SELECT t.snack_id, MIN(t.date) AS date
+    FROM unnest(%(snack_ids)s::integer[], %(dates)s::date[]) AS t (snack_id, date)
+    GROUP BY t.snack_id
+"""
+
+IS_SUMMARY_EMPTY_QUERY = "SELECT NOT EXISTS (SELECT 1 FROM snack_summary);"
+
+ALL_SNACKS_TARGETS = """
+    SELECT DISTINCT snack_id, '-infinity'::date AS date
+    FROM daily_metrics
+"""
+
+# Mirrors the backend's former per-request calculation: the comparison row is
+# the second oldest of the window (the older of two), changes are 0 when either
+# side is missing or 0, and scores round half up like Math.round. A snack is only
+# recomputed when a written date can change its window.
+REFRESH_SUMMARY_QUERY = """
+    WITH targets AS ({targets}),
+    changed AS (
+        SELECT t.snack_id
+        FROM targets t
+        LEFT JOIN snack_summary s ON s.snack_id = t.snack_id
+        WHERE s.snack_id IS NULL
+           OR t.date >= s.window_start
+           OR s.window_rows < %(window)s
+    ),
+    recent AS (
+        SELECT
+            m.*,
+            row_number() OVER (PARTITION BY m.snack_id ORDER BY m.date DESC) AS position,
+            count(*) OVER (PARTITION BY m.snack_id) AS window_rows
+        FROM changed c
+        CROSS JOIN LATERAL (
+            SELECT *
+            FROM daily_metrics d
+            WHERE d.snack_id = c.snack_id
+            ORDER BY d.date DESC
+            LIMIT %(window)s
+        ) m
+    ),
+    totals AS (
+        SELECT
+            snack_id,
+            MIN(date) AS window_start,
+            AVG(google_trends_score) AS window_avg_trends_score,
+            SUM(reddit_mention_count) AS window_reddit_mentions,
+            AVG(avg_reddit_sentiment) AS window_avg_reddit_sentiment,
+            SUM(news_article_count) AS window_news_articles,
+            AVG(avg_news_sentiment) AS window_avg_news_sentiment
+        FROM recent
+        GROUP BY snack_id
+    )
+    INSERT INTO snack_summary (
+        snack_id, latest_date, google_trends_score, reddit_mention_count,
+        avg_reddit_sentiment, news_article_count, avg_news_sentiment,
+        stock_close_price, previous_date, previous_trends_score,
+        previous_stock_price, trends_change, stock_change, overall_score,
+        window_start, window_rows, window_avg_trends_score, window_reddit_mentions,
+        window_avg_reddit_sentiment, window_news_articles, window_avg_news_sentiment
+    )
+    SELECT
+        latest.snack_id,
+        latest.date,
+        latest.google_trends_score,
+        latest.reddit_mention_count,
+        latest.avg_reddit_sentiment,
+        latest.news_article_count,
+        latest.avg_news_sentiment,
+        latest.stock_close_price,
+        previous.date,
+        previous.google_trends_score,
+        previous.stock_close_price,
+        CASE
+            WHEN latest.google_trends_score <> 0 AND previous.google_trends_score <> 0
+            THEN floor(
+                (latest.google_trends_score::float8 - previous.google_trends_score)
+                / previous.google_trends_score * 100 * 10 + 0.5
+            ) / 10
+            ELSE 0
+        END,
+        CASE
+            WHEN latest.stock_close_price <> 0 AND previous.stock_close_price <> 0
+            THEN floor(
+                (latest.stock_close_price::float8 - previous.stock_close_price)
+                / previous.stock_close_price * 100 * 100 + 0.5
+            ) / 100
+            ELSE 0
+        END,
+        floor(
+            (
+                COALESCE(latest.google_trends_score, 0)::float8 * 0.4
+                + (
+                    COALESCE(latest.reddit_mention_count, 0)::float8 * 0.5
+                    + COALESCE(latest.avg_reddit_sentiment, 0)::float8 * 0.5
+                ) * 0.3
+                + (
+                    COALESCE(latest.news_article_count, 0)::float8 * 0.5
+                    + COALESCE(latest.avg_news_sentiment, 0)::float8 * 0.5
+                ) * 0.3
+            ) * 10 + 0.5
+        ) / 10,
+        totals.window_start,
+        latest.window_rows,
+        totals.window_avg_trends_score,
+        totals.window_reddit_mentions,
+        totals.window_avg_reddit_sentiment,
+        totals.window_news_articles,
+        totals.window_avg_news_sentiment
+    FROM recent latest
+    JOIN totals ON totals.snack_id = latest.snack_id
+    LEFT JOIN recent previous
+        ON previous.snack_id = latest.snack_id
+       AND previous.position = CASE
+           WHEN latest.window_rows > 2 THEN latest.window_rows - 1 ELSE 2
+       END
+    WHERE latest.position = 1
+    ON CONFLICT (snack_id) DO UPDATE SET
+        latest_date = EXCLUDED.latest_date,
+        google_trends_score = EXCLUDED.google_trends_score,
+        reddit_mention_count = EXCLUDED.reddit_mention_count,
+        avg_reddit_sentiment = EXCLUDED.avg_reddit_sentiment,
+        news_article_count = EXCLUDED.news_article_count,
+        avg_news_sentiment = EXCLUDED.avg_news_sentiment,
+        stock_close_price = EXCLUDED.stock_close_price,
+        previous_date = EXCLUDED.previous_date,
+        previous_trends_score = EXCLUDED.previous_trends_score,
+        previous_stock_price = EXCLUDED.previous_stock_price,
+        trends_change = EXCLUDED.trends_change,
+        stock_change = EXCLUDED.stock_change,
+        overall_score = EXCLUDED.overall_score,
+        window_start = EXCLUDED.window_start,
+        window_rows = EXCLUDED.window_rows,
+        window_avg_trends_score = EXCLUDED.window_avg_trends_score,
+        window_reddit_mentions = EXCLUDED.window_reddit_mentions,
+        window_avg_reddit_sentiment = EXCLUDED.window_avg_reddit_sentiment,
+        window_news_articles = EXCLUDED.window_news_articles,
+        window_avg_news_sentiment = EXCLUDED.window_avg_news_sentiment,
+        updated_at = now();
+"""
+
+
+def refresh_snack_summary(conn, written=None, window=SUMMARY_WINDOW_ROWS):
+    """
+    Recomputes the snack_summary rows of the snacks in written (snack_id -> the
+    earliest date written for it), or of every snack when written is None or
+    the table is still empty. Returns the number of rows updated.
+    """
+    with run_metrics.timer("rollup"), conn.cursor() as cursor:
+        cursor.execute(CREATE_SNACK_SUMMARY_QUERY)
+        cursor.execute(IS_SUMMARY_EMPTY_QUERY)
+        if cursor.fetchone()[0]:
+            written = None
+        if written is None:
+            targets = ALL_SNACKS_TARGETS
+            params = {"window": window}
+        else:
+            targets = WRITTEN_SNACKS_TARGETS
+            params = {
+                "window": window,
+                "snack_ids": list(written),
+                "dates": [str(date) for date in written.values()],
+            }
+        cursor.execute(REFRESH_SUMMARY_QUERY.format(targets=targets), params)
+        updated = cursor.rowcount
+    conn.commit()
+    run_metrics.count("rows_written", updated, table="snack_summary")
+    logger.info(f"Updated the summary of {updated} snacks.")
+    return updated
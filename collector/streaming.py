@@ -0,0 +1,116 @@
+import os
+import queue
+import threading
+
+# Items a stage may run ahead of the next one before it blocks
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "256"))
+# Mentions scored per sentiment call; large enough for the process pool to kick in
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "256"))
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def bounded(iterable, maxsize=STREAM_QUEUE_SIZE, name="stream"):
+    """
+    Runs iterable on its own thread and yields its items through a bounded queue.
+    The producer blocks while the queue is full, so a slow consumer holds it
+    back instead of letting items pile up. An exception in the producer is
+    re-raised in the consumer; a consumer that stops early stops the producer.
+    """
+    handoff = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_Failed(e))
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name=f"{name}-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def batched(iterable, size=STREAM_BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class MentionAggregator:
+    """
+    Streaming summary of one group's mentions: count, running mean sentiment,
+    the newest published_at and the first `keep` mentions, in constant memory.
+    """
+
+    __slots__ = ("keep", "count", "total_sentiment", "top", "latest")
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.total_sentiment = 0.0
+        self.top = []
+        self.latest = None
+
+    def add(self, mention):
+        self.count += 1
+        self.total_sentiment += mention["sentiment_score"]
+        if len(self.top) < self.keep:
+            self.top.append(mention)
+        published_at = mention["published_at"]
+        if published_at and (self.latest is None or published_at > self.latest):
+            self.latest = published_at
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg_sentiment": self.total_sentiment / self.count if self.count else 0.0,
+            "mentions": self.top,
+            "latest": self.latest,
+        }
+
+
+def aggregate(pairs, keep, groups=()):
+    """
+    Consumes (group, mention) pairs into one MentionAggregator per group. Groups
+    listed up front get a summary even when nothing was routed to them.
+    """
+    aggregators = {group: MentionAggregator(keep) for group in groups}
+    for group, mention in pairs:
+        if group not in aggregators:
+            aggregators[group] = MentionAggregator(keep)
+        aggregators[group].add(mention)
+    return {group: aggregator.summary() for group, aggregator in aggregators.items()}
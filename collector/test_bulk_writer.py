@@ -0,0 +1,146 @@
+import psycopg2
+import pytest
+
+import db_utils
+from db_utils import BulkWriter
+
+
+class FakeCursor:
+    """Records statements; single-row inserts fail for "bad" URLs and skip stored ones."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.connection.statements.append(query.strip().split("\n")[0])
+        if params is None:
+            return
+        url = params[4]
+        if url == "bad":
+            raise psycopg2.DataError("invalid input")
+        self.rowcount = 0 if url in self.connection.stored else 1
+        self.connection.stored.add(url)
+
+
+class FakeConnection:
+    def __init__(self, stored):
+        self.stored = set(stored)
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakePool:
+    connect_retries = 1
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def getconn(self):
+        return self.connection
+
+    def putconn(self, connection, broken=False):
+        assert not broken
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection(stored={"https://stored"})
+
+    def execute_values(cursor, query, rows, page_size=None, fetch=False):
+        # the batch statement fails as a whole when any of its rows is bad
+        cursor.execute(query)
+        if any(row[4] == "bad" for row in rows):
+            raise psycopg2.DataError("invalid input in batch")
+        return [
+            (row[0], row[4], row[5], row[6])
+            for row in rows
+            if row[4] not in connection.stored
+        ]
+
+    monkeypatch.setattr(db_utils, "execute_values", execute_values)
+    return connection
+
+
+def mention(url):
+    return {
+        "text": "tasty",
+        "source": "Reddit Submission",
+        "source_name": "snacks",
+        "url": url,
+        "sentiment_score": 0.5,
+        "published_at": "2025-01-01T10:00:00+00:00",
+    }
+
+
+def test_a_failed_batch_is_retried_one_row_at_a_time(connection):
+    inserted = []
+    writer = BulkWriter(
+        FakePool(connection),
+        on_inserted=lambda *mention: inserted.append(mention),
+    )
+    urls = ["https://new/1", "bad", "https://stored", "https://new/2"]
+    writer.add_mentions(7, [mention(url) for url in urls])
+    writer.close()
+
+    statements = connection.statements
+    assert statements[:3] == [
+        "SAVEPOINT bulk_batch",
+        "INSERT INTO snack_mentions (",
+        "ROLLBACK TO SAVEPOINT bulk_batch",
+    ]
+    # every row gets its own savepoint, and only the bad one is rolled back
+    assert statements.count("SAVEPOINT bulk_row") == 4
+    assert statements.count("ROLLBACK TO SAVEPOINT bulk_row") == 1
+    assert statements.count("RELEASE SAVEPOINT bulk_row") == 3
+    assert connection.commits == 1
+    assert writer.mention_stats == {7: {"inserted": 2, "skipped": 2}}
+    assert [url for url, _, _ in inserted] == ["https://new/1", "https://new/2"]
+
+
+def test_a_clean_batch_is_written_in_one_statement(connection):
+    inserted = []
+    writer = BulkWriter(
+        FakePool(connection),
+        on_inserted=lambda *mention: inserted.append(mention),
+    )
+    writer.add_mentions(7, [mention("https://new/1"), mention("https://stored")])
+    writer.close()
+
+    assert connection.statements == [
+        "SAVEPOINT bulk_batch",
+        "INSERT INTO snack_mentions (",
+        "RELEASE SAVEPOINT bulk_batch",
+    ]
+    assert writer.mention_stats == {7: {"inserted": 1, "skipped": 1}}
+    assert inserted == [
+        ("https://new/1", 0.5, "2025-01-01T10:00:00+00:00"),
+    ]
+
+
+def test_inserted_urls_are_reported_only_after_the_commit(connection):
+    inserted = []
+    writer = BulkWriter(
+        FakePool(connection),
+        commit_interval=3600,
+        on_inserted=lambda *mention: inserted.append(mention),
+    )
+    writer.add_mentions(7, [mention("https://new/1")])
+    writer.flush()
+
+    assert connection.commits == 0
+    assert inserted == []
+    writer.commit()
+    assert [url for url, _, _ in inserted] == ["https://new/1"]
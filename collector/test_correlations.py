@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from correlations import (
+    SIGNALS,
+    SUM_NAMES,
+    lagged_sums,
+    load_matrices,
+    pearson,
+)  # noqa: E402
+
+
+def random_matrices(days=60, snacks=3, seed=7):
+    rng = np.random.default_rng(seed)
+    signals = rng.normal(50, 10, (len(SIGNALS), days, snacks))
+    prices = rng.normal(100, 5, (days, snacks)).cumsum(axis=0)
+    # missing days and NULL columns
+    signals[rng.random(signals.shape) < 0.1] = np.nan
+    prices[rng.random(prices.shape) < 0.1] = np.nan
+    return signals, prices
+
+
+@pytest.mark.parametrize("lag", [0, 1, 7])
+def test_folding_new_days_into_stored_sums_matches_a_full_recompute(lag):
+    signals, prices = random_matrices()
+    days, snacks = prices.shape
+    everything = np.ones((days, snacks), dtype=bool)
+    # a first run saw 40 days, a later one folds in the rest
+    dates = np.arange(days)[:, None]
+    earlier, later = everything & (dates < 40), everything & (dates >= 40)
+
+    full = lagged_sums(signals, prices, everything, lag)
+    first = lagged_sums(signals, prices, earlier, lag)
+    added = lagged_sums(signals, prices, later, lag)
+    folded = {name: first[name] + added[name] for name in SUM_NAMES}
+
+    for name in SUM_NAMES:
+        np.testing.assert_allclose(folded[name], full[name])
+    np.testing.assert_allclose(
+        pearson(folded, min_periods=5), pearson(full, min_periods=5)
+    )
+
+
+def test_pearson_matches_numpy_on_the_paired_days():
+    signals, prices = random_matrices()
+    lag = 2
+    sums = lagged_sums(signals, prices, np.ones(prices.shape, dtype=bool), lag)
+    correlation = pearson(sums, min_periods=5)
+
+    x, y = signals[0, :-lag, 1], prices[lag:, 1]
+    paired = np.isfinite(x) & np.isfinite(y)
+    expected = np.corrcoef(x[paired], y[paired])[0, 1]
+    assert correlation[0, 1] == pytest.approx(expected)
+
+
+def test_pearson_is_nan_with_too_few_pairs_or_a_flat_series():
+    signals, prices = random_matrices(days=10, snacks=2)
+    signals[:, :, 1] = 5.0
+    sums = lagged_sums(signals, prices, np.ones(prices.shape, dtype=bool), 0)
+
+    assert np.isnan(pearson(sums, min_periods=11)).all()
+    flat = pearson(sums, min_periods=3)
+    assert np.isnan(flat[:, 1]).all()
+    assert np.isfinite(flat[:, 0]).all()
+
+
+def test_load_matrices_places_rows_by_day_and_snack():
+    start = datetime.date(2025, 1, 1)
+    values = tuple(float(i) for i in range(len(SIGNALS)))
+    rows = [
+        (20, start + datetime.timedelta(days=2), *values, 101.0),
+        (10, start, *(None,) * len(SIGNALS), 99.0),
+    ]
+    signals, prices = load_matrices(
+        rows, [10, 20], start, start + datetime.timedelta(days=3)
+    )
+
+    assert signals.shape == (len(SIGNALS), 4, 2)
+    assert list(signals[:, 2, 1]) == list(values)
+    assert np.isnan(signals[:, 0, 0]).all()
+    assert prices[0, 0] == 99.0 and prices[2, 1] == 101.0
+    assert np.isnan(prices[1]).all()
@@ -0,0 +1,114 @@
+import csv
+import io
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from export import (  # noqa: E402
+    MENTIONS_COLUMNS,
+    copy_to_table,
+    export_late_mentions,
+    find_gaps,
+)
+
+
+class CopyCursor:
+    """Stands in for a psycopg2 cursor whose COPY ... TO STDOUT returns rows as CSV."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def mogrify(self, query, params):
+        return query.encode()
+
+    def copy_expert(self, query, buffer):
+        text = io.StringIO()
+        writer = csv.writer(text, lineterminator="\n")
+        writer.writerow(MENTIONS_COLUMNS)
+        writer.writerows(self.rows)
+        buffer.write(text.getvalue().encode())
+
+
+def test_copy_to_table_keeps_line_breaks_and_quotes_in_values():
+    content = 'first line\nsecond "quoted" line\r\nthird, with a comma ' + "x" * 1000
+    rows = [
+        (1, 7, "news", "N", "plain", "https://n/1", "", ""),
+    ] + [
+        (
+            mention_id,
+            7,
+            "reddit",
+            "snacks",
+            content,
+            f"https://r/{mention_id}",
+            0.5,
+            "2025-01-01 12:00:00",
+        )
+        for mention_id in range(2, 3002)
+    ]
+
+    # several MB, so pyarrow splits the CSV into blocks, some inside a quoted value
+    table = copy_to_table(CopyCursor(rows), "COPY", (0, 3001), MENTIONS_COLUMNS)
+
+    assert table.num_rows == 3001
+    assert table["id"].to_pylist() == list(range(1, 3002))
+    assert set(table["content"].to_pylist()[1:]) == {content}
+    assert table["sentiment_score"][0].as_py() is None
+    assert table["published_at"][0].as_py() is None
+
+
+def mention_row(mention_id, published_at="2025-01-15 12:00:00"):
+    return (
+        mention_id,
+        7,
+        "reddit",
+        "snacks",
+        "tasty",
+        f"https://r/{mention_id}",
+        0.5,
+        published_at,
+    )
+
+
+def test_find_gaps_lists_missing_id_ranges():
+    assert find_gaps([3, 4, 7, 10], after_id=0, until_id=12) == [
+        [1, 2],
+        [5, 6],
+        [8, 9],
+        [11, 12],
+    ]
+    assert find_gaps([1, 2, 3], after_id=0, until_id=3) == []
+    assert find_gaps([], after_id=5, until_id=8) == [[6, 8]]
+    assert find_gaps([], after_id=5, until_id=5) == []
+
+
+def test_export_late_mentions_writes_found_rows_and_keeps_open_gaps(tmp_path):
+    gaps = [[5, 6], [8, 12]]
+    # 6 and 9 to 10 committed since the last export; 5, 8, 11 and 12 still have not
+    cursor = CopyCursor(
+        [mention_row(6), mention_row(9), mention_row(10, "2025-02-01 00:30:00")]
+    )
+
+    written, open_gaps = export_late_mentions(cursor, str(tmp_path), gaps, "arrow")
+
+    assert written == 3
+    assert open_gaps == [[5, 5], [8, 8], [11, 12]]
+    january = tmp_path / "snack_mentions" / "month=2025-01"
+    february = tmp_path / "snack_mentions" / "month=2025-02"
+    assert sorted(os.listdir(january)) == ["part-000000000006-late.arrow"]
+    assert sorted(os.listdir(february)) == ["part-000000000006-late.arrow"]
+    table = pa.ipc.open_file(str(january / "part-000000000006-late.arrow")).read_all()
+    assert table["id"].to_pylist() == [6, 9]
+
+
+def test_export_late_mentions_without_new_rows_keeps_every_gap(tmp_path):
+    gaps = [[5, 6]]
+
+    assert export_late_mentions(CopyCursor([]), str(tmp_path), gaps, "arrow") == (
+        0,
+        gaps,
+    )
+    assert export_late_mentions(CopyCursor([]), str(tmp_path), [], "arrow") == (0, [])
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,46 @@
+from matcher import TermMatcher, normalize_term
+
+
+def test_terms_only_match_on_word_boundaries():
+    matcher = TermMatcher(["race", "chip"])
+
+    assert matcher.find("We embrace the new chipotle flavor") == set()
+    assert matcher.find("A race between two chips.") == {"race", "chip"}
+    assert not matcher.search("embraced")
+    assert matcher.search("(race)")
+
+
+def test_plural_possessive_and_spelling_variants_match():
+    matcher = TermMatcher(["Coca-Cola", "Oreo"])
+
+    assert matcher.find("Oreo's new cookie beats COCA COLA") == {"oreo", "coca cola"}
+    assert matcher.find("two oreos and a coca-cola") == {"oreo", "coca cola"}
+    assert matcher.find("oreoville") == set()
+
+
+def test_overlapping_aliases_report_every_contained_term():
+    matcher = TermMatcher(["Doritos", "Cool Ranch Doritos", "Cool Ranch", "ranch"])
+
+    assert matcher.find("The cool ranch doritos are back") == {
+        "cool ranch doritos",
+        "cool ranch",
+        "ranch",
+        "doritos",
+    }
+    assert matcher.find("plain doritos and ranch dip") == {"doritos", "ranch"}
+    # "ranch" inside "branch" is not on a word boundary
+    assert matcher.find("cool branch doritos") == {"doritos"}
+
+
+def test_terms_sharing_a_prefix_match_the_longest_one():
+    matcher = TermMatcher(["snack", "snack food", "snacks"])
+
+    assert matcher.find("snack food aisle") == {"snack food", "snack"}
+    # the longer alias wins, and "snack" does not end on a boundary inside it
+    assert matcher.find("snacks") == {"snacks"}
+
+
+def test_empty_terms_and_text_match_nothing():
+    assert TermMatcher(["", "  "]).find("anything") == set()
+    assert TermMatcher(["chip"]).find("") == set()
+    assert normalize_term(" Coca-Cola  Zero ") == "coca cola zero"
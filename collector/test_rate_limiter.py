@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limiter
+from rate_limiter import CircuitOpenError, RateLimiter
+
+
+class FakeClock:
+    """Stands in for the time module; sleeping only moves the clock forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+class HttpError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    # full jitter at its upper bound, so the backoff is predictable
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: high)
+    return clock
+
+
+def failing(errors, result="ok"):
+    calls = []
+
+    def func():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return func, calls
+
+
+def test_transient_errors_are_retried_with_capped_exponential_backoff(clock):
+    limiter = RateLimiter("test", retries=4, backoff=1, max_backoff=3)
+    func, calls = failing(
+        [HttpError(503), ConnectionError(), HttpError(500), TimeoutError()]
+    )
+
+    assert limiter.call(func) == "ok"
+    assert len(calls) == 5
+    assert clock.sleeps == [1, 2, 3, 3]
+
+
+def test_errors_that_are_not_transient_are_raised_without_retrying(clock):
+    limiter = RateLimiter("test", retries=3)
+    func, calls = failing([ValueError("bad request")])
+
+    with pytest.raises(ValueError):
+        limiter.call(func)
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+
+def test_a_429_halves_the_rate_and_waits_for_retry_after(clock):
+    limiter = RateLimiter("test", requests_per_second=4, retries=1)
+    func, calls = failing([HttpError(429, {"Retry-After": "5"})])
+
+    assert limiter.call(func) == "ok"
+    # halved to 2/s, then raised by a tenth of the 4/s ceiling on success
+    assert limiter.requests_per_second == pytest.approx(2.4)
+    # the retry waits out the Retry-After in the slot, not in a jittered backoff
+    assert clock.sleeps == [0, 5]
+
+
+def test_the_circuit_opens_after_repeated_failures_and_a_trial_call_closes_it(clock):
+    limiter = RateLimiter("test", retries=0, failure_threshold=2, cooldown=30)
+    func, calls = failing([HttpError(503), HttpError(503)])
+
+    for _ in range(2):
+        with pytest.raises(HttpError):
+            limiter.call(func)
+    with pytest.raises(CircuitOpenError):
+        limiter.call(func)
+    assert len(calls) == 2
+
+    clock.now += 30
+    assert limiter.call(func) == "ok"
+    assert limiter.call(func) == "ok"
+    assert len(calls) == 4
+
+
+def test_a_failed_trial_call_opens_the_circuit_again(clock):
+    limiter = RateLimiter("test", retries=0, failure_threshold=1, cooldown=30)
+    func, calls = failing([HttpError(503), HttpError(503)])
+
+    with pytest.raises(HttpError):
+        limiter.call(func)
+    clock.now += 30
+    with pytest.raises(HttpError):
+        limiter.call(func)
+    with pytest.raises(CircuitOpenError):
+        limiter.call(func)
+    assert len(calls) == 2
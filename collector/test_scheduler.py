@@ -0,0 +1,69 @@
+import time
+
+from scheduler import FULL, LITE, SKIPPED, Scheduler, percentile_ranks
+
+
+def budgeted(seconds_left, costs):
+    schedule = Scheduler(budget=3600, reserve=0).start()
+    schedule.deadline = time.monotonic() + seconds_left
+    schedule.costs = costs
+    return schedule
+
+
+def test_percentile_ranks_spread_from_zero_to_one_and_share_ties():
+    assert percentile_ranks([3.0, 1.0, 2.0]) == [1.0, 0.0, 0.5]
+    assert percentile_ranks([5.0, 5.0, 1.0]) == [0.75, 0.75, 0.0]
+    assert percentile_ranks([7.0]) == [0.0]
+    assert percentile_ranks([]) == []
+
+
+def test_choose_runs_in_full_without_a_budget():
+    schedule = Scheduler(budget=0).start()
+    schedule.costs = {(1, "reddit"): 1e9}
+
+    assert schedule.choose(1, "reddit", has_lite=True) == FULL
+
+
+def test_choose_falls_back_to_lite_then_skips():
+    schedule = budgeted(
+        60, {(1, "reddit"): 30, (2, "reddit"): 120, (2, "reddit:lite"): 10}
+    )
+    schedule.costs[(3, "reddit")] = 120
+    schedule.costs[(3, "reddit:lite")] = 90
+
+    assert schedule.choose(1, "reddit", has_lite=True) == FULL
+    assert schedule.choose(2, "reddit", has_lite=True) == LITE
+    assert schedule.choose(2, "reddit", has_lite=False) == SKIPPED
+    assert schedule.choose(3, "reddit", has_lite=True) == SKIPPED
+
+
+def test_choose_uses_the_source_median_for_untimed_snacks():
+    schedule = budgeted(60, {})
+    schedule.source_costs = {"news": 90}
+
+    assert schedule.choose(4, "news", has_lite=False) == SKIPPED
+
+
+def test_flag_lists_what_a_row_lacks():
+    schedule = budgeted(
+        60,
+        {
+            (1, "reddit"): 120,
+            (1, "reddit:lite"): 1,
+            (1, "news"): 120,
+            (2, "news"): 120,
+        },
+    )
+
+    assert schedule.fetch("reddit", 1, lambda: "full", lambda: "lite") == "lite"
+    assert schedule.fetch("news", 1, lambda: "full") is None
+    assert schedule.fetch("news", 2, lambda: "full") is None
+    assert schedule.fetch("news", 3, lambda: "full") == "full"
+    schedule.flag(1, {"reddit": "lite", "news": None})
+    # a skipped source that an earlier attempt checkpointed leaves nothing out
+    schedule.flag(2, {"news": {"count": 3}})
+    schedule.flag(3, {"news": "full"})
+
+    assert schedule.written == {1: ["news", "reddit_comments"], 2: [], 3: []}
+    assert schedule.degraded(1) == {"reddit": LITE, "news": SKIPPED}
+    assert schedule.degraded(3) == {}
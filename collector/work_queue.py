@@ -0,0 +1,291 @@
+import logging
+import os
+import socket
+import threading
+
+from psycopg2.extras import Json, execute_values
+
+from db_utils import CREATE_RUN_TABLES_QUERY, CREATE_WORK_QUEUE_QUERY
+
+logger = logging.getLogger(__name__)
+
+# A claimed unit goes back to the queue if its worker has not finished or renewed
+# it within this many seconds, e.g. because the job was cancelled
+WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "600"))
+# Units of one source a worker claims at a time; batched sources fetch them together
+WORK_CLAIM_SIZE = int(os.getenv("WORK_CLAIM_SIZE", "25"))
+# Claims per unit before it is given up on and reduced with the source's fallback
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+# Shown in leased_by; unique per process unless set
+COLLECTOR_WORKER_ID = os.getenv("COLLECTOR_WORKER_ID") or (
+    f"{socket.gethostname()}-{os.getpid()}"
+)
+
+# A run date that is enqueued again keeps its window and existing units
+ENQUEUE_RUN_QUERY = """
+    INSERT INTO collector_runs (run_date, window_start_unix)
+    VALUES (%s, %s)
+    ON CONFLICT (run_date) DO UPDATE SET completed_at = NULL
+    RETURNING window_start_unix;
+"""
+
+ENQUEUE_UNITS_QUERY = """
+    INSERT INTO collector_work_units (run_date, snack_id, source)
+    VALUES %s
+    ON CONFLICT (run_date, snack_id, source) DO NOTHING;
+"""
+
+FIND_QUEUED_RUN_QUERY = """
+    SELECT r.run_date::text, r.window_start_unix
+    FROM collector_runs r
+    WHERE r.completed_at IS NULL
+      AND EXISTS (SELECT 1 FROM collector_work_units u WHERE u.run_date = r.run_date)
+    ORDER BY r.run_date DESC
+    LIMIT 1;
+"""
+
+FIND_QUEUED_RUN_BY_DATE_QUERY = """
+    SELECT run_date::text, window_start_unix
+    FROM collector_runs
+    WHERE run_date = %s;
+"""
+
+# SKIP LOCKED lets any number of workers claim at once without waiting on each
+# other; a unit whose lease ran out is claimable again
+CLAIM_UNITS_QUERY = """
+    UPDATE collector_work_units
+    SET status = 'leased',
+        leased_by = %s,
+        attempts = attempts + 1,
+        lease_expires_at = now() + %s * interval '1 second'
+    WHERE (run_date, snack_id, source) IN (
+        SELECT run_date, snack_id, source
+        FROM collector_work_units
+        WHERE run_date = %s
+          AND source = %s
+          AND attempts < %s
+          AND (
+              status = 'pending'
+              OR (status = 'leased' AND lease_expires_at < now())
+          )
+        ORDER BY snack_id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING snack_id;
+"""
+
+RENEW_LEASES_QUERY = """
+    UPDATE collector_work_units
+    SET lease_expires_at = now() + %s * interval '1 second'
+    WHERE run_date = %s AND leased_by = %s AND status = 'leased';
+"""
+
+# Only the worker still holding the lease may finish a unit
+COMPLETE_UNITS_QUERY = """
+    UPDATE collector_work_units u
+    SET status = 'done',
+        result = v.result::jsonb,
+        error = NULL,
+        lease_expires_at = NULL,
+        completed_at = now()
+    FROM (VALUES %s) AS v (run_date, snack_id, source, leased_by, result)
+    WHERE u.run_date = v.run_date::date
+      AND u.snack_id = v.snack_id
+      AND u.source = v.source
+      AND u.leased_by = v.leased_by
+      AND u.status = 'leased'
+    RETURNING u.snack_id;
+"""
+
+# A failed unit is retried by whichever worker claims it next, up to WORK_MAX_ATTEMPTS
+FAIL_UNITS_QUERY = """
+    UPDATE collector_work_units
+    SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+        error = %s,
+        lease_expires_at = NULL
+    WHERE run_date = %s
+      AND source = %s
+      AND snack_id = ANY(%s)
+      AND leased_by = %s
+      AND status = 'leased';
+"""
+
+# A lease that ran out on its last attempt will not be claimed again
+EXPIRE_EXHAUSTED_QUERY = """
+    UPDATE collector_work_units
+    SET status = 'failed', error = 'lease expired'
+    WHERE run_date = %s
+      AND status = 'leased'
+      AND lease_expires_at < now()
+      AND attempts >= %s;
+"""
+
+GET_UNITS_QUERY = """
+    SELECT snack_id, source, status, result
+    FROM collector_work_units
+    WHERE run_date = %s;
+"""
+
+
+def enqueue_run(conn, window, units):
+    """
+    Registers the run date and one pending unit per (snack_id, source). Returns
+    the run's (start unix time, run date), which is the first enqueue's window.
+    """
+    window_start_unix, run_date = window
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_RUN_TABLES_QUERY)
+        cursor.execute(CREATE_WORK_QUEUE_QUERY)
+        cursor.execute(ENQUEUE_RUN_QUERY, (run_date, window_start_unix))
+        window_start_unix = cursor.fetchone()[0]
+        if units:
+            execute_values(
+                cursor,
+                ENQUEUE_UNITS_QUERY,
+                [(run_date, snack_id, source) for snack_id, source in units],
+            )
+    conn.commit()
+    return window_start_unix, run_date
+
+
+def find_queued_run(conn, run_date=None):
+    # the given run date, or the newest unfinished one with queued units
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_RUN_TABLES_QUERY)
+        cursor.execute(CREATE_WORK_QUEUE_QUERY)
+        if run_date:
+            cursor.execute(FIND_QUEUED_RUN_BY_DATE_QUERY, (run_date,))
+        else:
+            cursor.execute(FIND_QUEUED_RUN_QUERY)
+        row = cursor.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    run_date, window_start_unix = row
+    return window_start_unix, run_date
+
+
+def claim_units(
+    conn,
+    run_date,
+    source,
+    worker_id=COLLECTOR_WORKER_ID,
+    limit=WORK_CLAIM_SIZE,
+    lease_seconds=WORK_LEASE_SECONDS,
+    max_attempts=WORK_MAX_ATTEMPTS,
+):
+    """Leases up to limit open units of source. Returns their snack ids."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            CLAIM_UNITS_QUERY,
+            (worker_id, lease_seconds, run_date, source, max_attempts, limit),
+        )
+        snack_ids = sorted(snack_id for (snack_id,) in cursor.fetchall())
+    conn.commit()
+    return snack_ids
+
+
+def renew_leases(
+    conn, run_date, worker_id=COLLECTOR_WORKER_ID, lease_seconds=WORK_LEASE_SECONDS
+):
+    with conn.cursor() as cursor:
+        cursor.execute(RENEW_LEASES_QUERY, (lease_seconds, run_date, worker_id))
+        renewed = cursor.rowcount
+    conn.commit()
+    return renewed
+
+
+def complete_units(
+    conn,
+    run_date,
+    source,
+    results,
+    worker_id=COLLECTOR_WORKER_ID,
+    max_attempts=WORK_MAX_ATTEMPTS,
+):
+    """
+    Stores the result of each claimed unit (snack_id -> result, None when the
+    fetch failed) in one transaction. Returns the snack ids whose lease had been
+    lost to another worker; their results are dropped.
+    """
+    done = {
+        snack_id: result for snack_id, result in results.items() if result is not None
+    }
+    failed = [snack_id for snack_id, result in results.items() if result is None]
+    with conn.cursor() as cursor:
+        stored = set()
+        if done:
+            returned = execute_values(
+                cursor,
+                COMPLETE_UNITS_QUERY,
+                [
+                    (run_date, snack_id, source, worker_id, Json(result))
+                    for snack_id, result in done.items()
+                ],
+                fetch=True,
+            )
+            stored = {snack_id for (snack_id,) in returned}
+        if failed:
+            cursor.execute(
+                FAIL_UNITS_QUERY,
+                (max_attempts, "fetch failed", run_date, source, failed, worker_id),
+            )
+    conn.commit()
+    return sorted(set(done) - stored)
+
+
+def get_units(conn, run_date, max_attempts=WORK_MAX_ATTEMPTS):
+    """Returns snack_id -> source -> (status, result) for every unit of the run."""
+    with conn.cursor() as cursor:
+        cursor.execute(EXPIRE_EXHAUSTED_QUERY, (run_date, max_attempts))
+        cursor.execute(GET_UNITS_QUERY, (run_date,))
+        units = {}
+        for snack_id, source, status, result in cursor.fetchall():
+            units.setdefault(snack_id, {})[source] = (status, result)
+    conn.commit()
+    return units
+
+
+class LeaseKeeper:
+    """
+    Renews this worker's leases in the background, so a unit that takes longer
+    than WORK_LEASE_SECONDS (a large batched fetch) is not handed to another
+    worker while it is still being worked on.
+    """
+
+    def __init__(
+        self,
+        pool,
+        run_date,
+        worker_id=COLLECTOR_WORKER_ID,
+        lease_seconds=WORK_LEASE_SECONDS,
+    ):
+        self.pool = pool
+        self.run_date = run_date
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="collector-leases", daemon=True
+        )
+
+    def _run(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                self.pool.run(
+                    renew_leases,
+                    self.run_date,
+                    self.worker_id,
+                    self.lease_seconds,
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew work unit leases: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()